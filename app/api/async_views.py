@@ -0,0 +1,322 @@
+import asyncio
+import hashlib
+import json
+import time
+import weakref
+from functools import wraps
+from math import ceil
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import path
+from django.utils import timezone
+from redis import asyncio as aioredis
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api.caching import CachedResponseMixin, get_token_cache_key, get_version_key
+from api.serializers import (AppScreenInfoSerializer, CompetitionEditStatusSerializer, CompetitionSerializerWithTours,
+                             CompetitionTourSerializer, FantasyTeamRatingSerializer, FantasyTeamTourRatingSerializer)
+from api.views import LeaderboardMixin, get_editing_boundaries, get_seconds_to_boundaries
+from fantasy.leaderboards import AsyncLeaderboard, get_competition_leaderboard, get_tour_leaderboard
+from fantasy.models import AppScreenInfo, Competition, CompetitionTour, FantasyTeam, FantasyTeamTour
+
+NOT_FOUND = {'detail': 'Not found.'}
+redis_clients = weakref.WeakKeyDictionary()
+database_slots = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    loop = asyncio.get_running_loop()
+    if loop not in redis_clients:
+        pool = aioredis.BlockingConnectionPool.from_url(settings.CACHES['default']['LOCATION'],
+                                                        max_connections=settings.ASYNC_REDIS_MAX_CONNECTIONS)
+        redis_clients[loop] = aioredis.Redis(connection_pool=pool)
+    return redis_clients[loop]
+
+
+def get_database_slots():
+    loop = asyncio.get_running_loop()
+    if loop not in database_slots:
+        database_slots[loop] = asyncio.Semaphore(settings.ASYNC_DATABASE_CONCURRENCY)
+    return database_slots[loop]
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def read_view(authenticated=True):
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+            if authenticated:
+                keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+                if keyword.lower() != 'token' or not key.strip():
+                    return unauthorized('Authentication credentials were not provided.')
+                request.user_id = await aget_token_user_id(key.strip())
+                if request.user_id is None:
+                    return unauthorized('Invalid token.')
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def aget_token_user_id(key):
+    redis = get_redis()
+    cache_key = get_token_cache_key(key)
+    user_id = await redis.get(cache_key)
+    if user_id is None:
+        async with get_database_slots():
+            user_id = await Token.objects.filter(key=key, user__is_active=True).values_list('user_id',
+                                                                                             flat=True).afirst()
+        if user_id is None:
+            return None
+        await redis.set(cache_key, user_id, ex=settings.ASYNC_AUTH_CACHE_TIMEOUT)
+    return int(user_id)
+
+
+def unauthorized(detail):
+    response = json_response({'detail': detail}, status=401)
+    response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+async def aget_editing_cache_timeout():
+    now = timezone.now()
+    boundaries = await CompetitionTour.objects.aaggregate(**get_editing_boundaries(now))
+    return get_seconds_to_boundaries(CachedResponseMixin.cache_timeout, boundaries, now)
+
+
+async def aget_default_cache_timeout():
+    return CachedResponseMixin.cache_timeout
+
+
+def get_fresh_body(cached, versions):
+    if cached is None:
+        return None
+    cached_versions, _, body = cached.partition(b'\n')
+    return body if cached_versions == versions else None
+
+
+async def get_cached_response(request, basename, cache_models, get_data, get_timeout=aget_default_cache_timeout):
+    redis = get_redis()
+    params = urlencode(sorted(request.GET.lists()), doseq=True)
+    url = f'{request.build_absolute_uri(request.path)}?{params}'
+    key = f'response:async:{basename}:{hashlib.md5(url.encode()).hexdigest()}'
+    version_keys = [cache.make_key(get_version_key(model)) for model in cache_models]
+    cached, *versions = await redis.mget([key, *version_keys])
+    versions = json.dumps([int(version or 0) for version in versions]).encode()
+    body = get_fresh_body(cached, versions)
+    if body is not None:
+        return HttpResponse(body, content_type='application/json')
+
+    lock_key = f'{key}:lock'
+    locked = await redis.set(lock_key, 1, nx=True, ex=CachedResponseMixin.cache_lock_timeout)
+    if not locked:
+        if cached is not None:
+            return HttpResponse(cached.partition(b'\n')[2], content_type='application/json')
+        deadline = time.monotonic() + CachedResponseMixin.cache_wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            body = get_fresh_body(await redis.get(key), versions)
+            if body is not None:
+                return HttpResponse(body, content_type='application/json')
+
+    try:
+        async with get_database_slots():
+            status, data = await get_data()
+            timeout = await get_timeout() if status == 200 else None
+        response = json_response(data, status=status)
+        if status == 200:
+            await redis.set(key, versions + b'\n' + response.content, ex=timeout)
+    finally:
+        if locked:
+            await redis.delete(lock_key)
+    return response
+
+
+async def get_page_data(request, queryset, serializer_class):
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        return 404, {'detail': 'Invalid page.'}
+    count = await queryset.acount()
+    pages_count = max(ceil(count / page_size), 1)
+    if not 1 <= page <= pages_count:
+        return 404, {'detail': 'Invalid page.'}
+
+    objects = [obj async for obj in queryset[(page - 1) * page_size:page * page_size]]
+    url = request.build_absolute_uri()
+    previous_url = None
+    if page == 2:
+        previous_url = remove_query_param(url, 'page')
+    elif page > 2:
+        previous_url = replace_query_param(url, 'page', page - 1)
+    return 200, {
+        'count': count,
+        'next': replace_query_param(url, 'page', page + 1) if page < pages_count else None,
+        'previous': previous_url,
+        'results': serializer_class(objects, many=True).data,
+    }
+
+
+async def leaderboard_page_response(request, leaderboard, queryset, serializer_class):
+    try:
+        cursor, limit = LeaderboardMixin.get_page_params(request.GET)
+    except ValueError:
+        return json_response({"error": "Invalid cursor or limit"}, status=400)
+
+    count = await leaderboard.count()
+    page = await leaderboard.get_page(cursor, limit)
+    objects = await queryset.ain_bulk([obj_id for obj_id, _, _ in page])
+    serializer = serializer_class(LeaderboardMixin.rank_objects(page, objects), many=True)
+    return json_response(LeaderboardMixin.get_page_data(count, cursor, limit, serializer.data))
+
+
+async def leaderboard_user_response(request, leaderboard, queryset, serializer_class, obj):
+    position = await leaderboard.get_position(obj.id) if obj else None
+    if position is None:
+        return json_response({"error": "Fantasy team not found"}, status=404)
+
+    try:
+        around = LeaderboardMixin.get_around(request.GET)
+    except ValueError:
+        return json_response({"error": "Invalid around"}, status=400)
+
+    offset = max(position - around, 0)
+    page = await leaderboard.get_page(offset, position - offset + around + 1)
+    objects = await queryset.ain_bulk([obj_id for obj_id, _, _ in page])
+    serializer = serializer_class(LeaderboardMixin.rank_objects(page, objects), many=True)
+    return json_response(LeaderboardMixin.get_user_data(obj, page, serializer.data))
+
+
+async def leaderboard_top_response(leaderboard, queryset, serializer_class):
+    page = await leaderboard.get_page(0, LeaderboardMixin.leaderboard_page_size)
+    objects = await queryset.ain_bulk([obj_id for obj_id, _, _ in page])
+    return json_response(serializer_class(LeaderboardMixin.rank_objects(page, objects), many=True).data)
+
+
+@read_view()
+async def competition_detail(request, pk):
+    async def get_data():
+        competition = await Competition.objects.prefetch_related('competition_tours').filter(pk=pk).afirst()
+        if competition is None:
+            return 404, NOT_FOUND
+        return 200, CompetitionSerializerWithTours(competition).data
+
+    return await get_cached_response(request, 'competition', (Competition, CompetitionTour), get_data,
+                                     aget_editing_cache_timeout)
+
+
+@read_view()
+async def competition_edit_status(request, pk):
+    async with get_database_slots():
+        competition = await Competition.objects.select_related('active_tour').filter(pk=pk).afirst()
+        if competition is None:
+            return json_response(NOT_FOUND, status=404)
+        return json_response({'competition_details': CompetitionEditStatusSerializer(competition).data})
+
+
+@read_view()
+async def competition_leaderboard(request, pk):
+    async with get_database_slots():
+        if not await Competition.objects.filter(pk=pk).aexists():
+            return json_response(NOT_FOUND, status=404)
+        return await leaderboard_page_response(request, AsyncLeaderboard(get_competition_leaderboard(pk), get_redis()),
+                                               FantasyTeam.objects.select_related('user'), FantasyTeamRatingSerializer)
+
+
+@read_view()
+async def competition_rating(request, pk):
+    async with get_database_slots():
+        if not await Competition.objects.filter(pk=pk).aexists():
+            return json_response(NOT_FOUND, status=404)
+        return await leaderboard_top_response(AsyncLeaderboard(get_competition_leaderboard(pk), get_redis()),
+                                              FantasyTeam.objects.select_related('user'), FantasyTeamRatingSerializer)
+
+
+@read_view()
+async def competition_my_rating(request, pk):
+    async with get_database_slots():
+        if not await Competition.objects.filter(pk=pk).aexists():
+            return json_response(NOT_FOUND, status=404)
+        fantasy_team = await FantasyTeam.objects.filter(competition_id=pk, user_id=request.user_id).afirst()
+        return await leaderboard_user_response(request, AsyncLeaderboard(get_competition_leaderboard(pk), get_redis()),
+                                               FantasyTeam.objects.select_related('user'), FantasyTeamRatingSerializer,
+                                               fantasy_team)
+
+
+@read_view()
+async def tour_detail(request, pk):
+    async def get_data():
+        tour = await CompetitionTour.objects.filter(pk=pk).afirst()
+        if tour is None:
+            return 404, NOT_FOUND
+        return 200, CompetitionTourSerializer(tour).data
+
+    return await get_cached_response(request, 'competition-tour', (CompetitionTour, ), get_data,
+                                     aget_editing_cache_timeout)
+
+
+@read_view()
+async def tour_leaderboard(request, pk):
+    async with get_database_slots():
+        if not await CompetitionTour.objects.filter(pk=pk).aexists():
+            return json_response(NOT_FOUND, status=404)
+        return await leaderboard_page_response(request, AsyncLeaderboard(get_tour_leaderboard(pk), get_redis()),
+                                               FantasyTeamTour.objects.select_related('fantasy_team__user'),
+                                               FantasyTeamTourRatingSerializer)
+
+
+@read_view()
+async def tour_rating(request, pk):
+    async with get_database_slots():
+        if not await CompetitionTour.objects.filter(pk=pk).aexists():
+            return json_response(NOT_FOUND, status=404)
+        return await leaderboard_top_response(AsyncLeaderboard(get_tour_leaderboard(pk), get_redis()),
+                                              FantasyTeamTour.objects.select_related('fantasy_team__user'),
+                                              FantasyTeamTourRatingSerializer)
+
+
+@read_view()
+async def tour_my_rating(request, pk):
+    async with get_database_slots():
+        if not await CompetitionTour.objects.filter(pk=pk).aexists():
+            return json_response(NOT_FOUND, status=404)
+        fantasy_team_tour = await FantasyTeamTour.objects.filter(competition_tour_id=pk,
+                                                                 fantasy_team__user_id=request.user_id).afirst()
+        return await leaderboard_user_response(request, AsyncLeaderboard(get_tour_leaderboard(pk), get_redis()),
+                                               FantasyTeamTour.objects.select_related('fantasy_team__user'),
+                                               FantasyTeamTourRatingSerializer, fantasy_team_tour)
+
+
+@read_view(authenticated=False)
+async def app_info(request):
+    async def get_data():
+        queryset = AppScreenInfo.objects.all()
+        if request.GET.get('screen'):
+            queryset = queryset.filter(screen=request.GET['screen'])
+        return await get_page_data(request, queryset, AppScreenInfoSerializer)
+
+    return await get_cached_response(request, 'app-info', (AppScreenInfo, ), get_data)
+
+
+urlpatterns = [
+    path('competition/<int:pk>/', competition_detail),
+    path('competition/<int:pk>/edit_status/', competition_edit_status),
+    path('competition/<int:pk>/leaderboard/', competition_leaderboard),
+    path('competition/<int:pk>/rating/', competition_rating),
+    path('competition/<int:pk>/my-rating/', competition_my_rating),
+    path('competition-tour/<int:pk>/', tour_detail),
+    path('competition-tour/<int:pk>/leaderboard/', tour_leaderboard),
+    path('competition-tour/<int:pk>/rating/', tour_rating),
+    path('competition-tour/<int:pk>/my-rating/', tour_my_rating),
+    path('app-info/', app_info),
+]
@@ -0,0 +1,67 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from rest_framework.response import Response
+
+
+def get_version_key(model):
+    return f'cache_version:{model._meta.label_lower}'
+
+
+def get_token_cache_key(key):
+    return f'auth:token:{key}'
+
+
+def bump_versions(*models):
+    for model in models:
+        key = get_version_key(model)
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+class CachedResponseMixin:
+    cache_models = ()
+    cache_timeout = 60 * 60
+    cache_lock_timeout = 30
+    cache_wait_timeout = 3
+
+    def get_cache_key(self, request):
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        # paginated bodies embed absolute next/previous links, so the host is part of the key
+        digest = hashlib.md5(f'{request.build_absolute_uri(request.path)}?{params}'.encode()).hexdigest()
+        return f'response:{self.basename}:{digest}'
+
+    def get_cache_timeout(self):
+        return self.cache_timeout
+
+    def get_cached_response(self, request, handler, *args, **kwargs):
+        key = self.get_cache_key(request)
+        version_keys = [get_version_key(model) for model in self.cache_models]
+        values = cache.get_many([key, *version_keys])
+        versions = [values.get(version_key, 0) for version_key in version_keys]
+        cached = values.get(key)
+        if cached and cached[0] == versions:
+            return Response(cached[1])
+
+        lock_key = f'{key}:lock'
+        locked = cache.add(lock_key, 1, timeout=self.cache_lock_timeout)
+        if not locked:
+            if cached:
+                return Response(cached[1])
+            deadline = time.monotonic() + self.cache_wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                cached = cache.get(key)
+                if cached and cached[0] == versions:
+                    return Response(cached[1])
+
+        try:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, (versions, response.data), timeout=self.get_cache_timeout())
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return response
@@ -1,17 +1,303 @@
+import codecs
+import json
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from time import sleep
 
 import requests
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from requests.adapters import HTTPAdapter
+
+from api.response_cache import ResponseCache
+from core import metrics
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        wait = self.try_acquire()
+        while wait:
+            sleep(wait)
+            wait = self.try_acquire()
+
+
+class SharedTokenBucket(TokenBucket):
+    SCRIPT = """
+        local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or capacity
+        tokens = math.min(capacity, tokens + math.max(0, now - (tonumber(state[2]) or now)) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, key, rate, capacity=1):
+        super().__init__(rate, capacity)
+        self.key = key
+        self.script = None
+
+    def try_acquire(self):
+        try:
+            if self.script is None:
+                self.script = get_redis_connection('default').register_script(self.SCRIPT)
+            return float(self.script(keys=[self.key], args=[self.rate, self.capacity]))
+        except RedisError:
+            return super().try_acquire()
+
+
+JSON_SPACE = re.compile(r'[\s,]*')
+LeagueMatch = namedtuple('LeagueMatch', ['match_id', 'start_time', 'series_id', 'series_type', 'radiant_team_id',
+                                         'dire_team_id'])
+
+
+def iter_json_array(chunks):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    started = finished = False
+    while True:
+        position = JSON_SPACE.match(buffer, position).end()
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError('JSON array expected')
+            started = True
+            position += 1
+            continue
+        if started and buffer.startswith(']', position):
+            for _ in chunks:
+                pass
+            return
+        if started and position < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                end = None
+            if end is not None and (end < len(buffer) or finished):
+                yield item
+                position = end
+                continue
+        if finished:
+            raise ValueError('incomplete JSON array')
+        chunk = next(chunks, None)
+        finished = chunk is None
+        buffer = buffer[position:] + text_decoder.decode(chunk or b'', final=finished)
+        position = 0
+
+
+class ApiRetryError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_delay=None, max_delay=None):
+        self.base_delay = base_delay or settings.OPENDOTA_RETRY_BASE_DELAY
+        self.max_delay = max_delay or settings.OPENDOTA_RETRY_MAX_DELAY
+
+    def get_delay(self, attempt, retry_after=None):
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(backoff / 2, backoff)
+        if retry_after:
+            delay = max(delay, retry_after + random.uniform(0, self.base_delay))
+        return min(delay, self.max_delay)
+
+
+class CircuitBreaker:
+    def __init__(self, key='opendota:circuit', failure_threshold=None, failure_window=None, cooldown=None):
+        self.key = key
+        self.failures_key = f'{key}:failures'
+        self.failure_threshold = failure_threshold or settings.OPENDOTA_CIRCUIT_FAILURE_THRESHOLD
+        self.failure_window = failure_window or settings.OPENDOTA_CIRCUIT_FAILURE_WINDOW
+        self.cooldown = cooldown or settings.OPENDOTA_CIRCUIT_COOLDOWN
+        self.has_failures = False
+
+    @property
+    def redis(self):
+        return get_redis_connection('default')
+
+    def get_remaining(self):
+        try:
+            remaining = self.redis.pttl(self.key)
+        except RedisError:
+            return 0
+        return remaining / 1000 if remaining > 0 else 0
+
+    def trip(self, seconds=None):
+        seconds = max(seconds or 0, self.cooldown)
+        try:
+            self.redis.set(self.key, 1, px=int(seconds * 1000))
+            self.redis.delete(self.failures_key)
+        except RedisError:
+            return
+        metrics.inc('opendota_circuit_trips_total')
+
+    def record_failure(self):
+        self.has_failures = True
+        try:
+            pipe = self.redis.pipeline()
+            pipe.incr(self.failures_key)
+            pipe.expire(self.failures_key, self.failure_window)
+            failures, _ = pipe.execute()
+        except RedisError:
+            return
+        if failures >= self.failure_threshold:
+            self.trip()
+
+    def record_success(self):
+        if self.has_failures:
+            self.has_failures = False
+            try:
+                self.redis.delete(self.failures_key)
+            except RedisError:
+                pass
 
 
 class DotaApiConnector:
-    BASE_URL = 'https://api.opendota.com/api/'
+    def __init__(self, rate_limit=None, burst=None, max_workers=None, cache=None, base_url=None, breaker=None,
+                 timeout=None, limiter_key='opendota:rate_limit'):
+        self.base_url = base_url or settings.OPENDOTA_API_URL
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout or settings.OPENDOTA_API_TIMEOUT
+        self.rate_limit = rate_limit or settings.OPENDOTA_API_RATE_LIMIT
+        self.max_workers = max_workers or settings.OPENDOTA_API_MAX_WORKERS
+        self.limiter = SharedTokenBucket(limiter_key, self.rate_limit, burst or settings.OPENDOTA_API_BURST)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.cache = cache if cache is not None else self.get_default_cache()
+
+    @staticmethod
+    def get_default_cache():
+        if settings.OPENDOTA_CACHE_MODE == ResponseCache.MODE_OFF:
+            return None
+        return ResponseCache(settings.OPENDOTA_CACHE_DIR, settings.OPENDOTA_CACHE_MAX_SIZE,
+                             mode=settings.OPENDOTA_CACHE_MODE)
 
     @staticmethod
-    def get(url, **kwargs):
+    def get_cached_response(url, content):
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200 if content is not None else 404
+        response._content = content or b''
+        response.from_cache = True
+        return response
+
+    def get_endpoint(self, url):
+        return url[len(self.base_url):].split('/')[0] if url.startswith(self.base_url) else 'other'
+
+    def get(self, url, ttl=0, stream=False, **kwargs):
+        endpoint = self.get_endpoint(url)
+        if self.cache:
+            content = self.cache.get(url)
+            if content is not None or self.cache.replay:
+                metrics.inc('opendota_requests_total', endpoint=endpoint, status='cache')
+                return self.get_cached_response(url, content)
+
+        remaining = self.breaker.get_remaining()
+        if remaining:
+            metrics.inc('opendota_requests_total', endpoint=endpoint, status='circuit_open')
+            raise ApiRetryError('circuit open', remaining)
+
         headers = kwargs.get('headers') or {}
-        response = requests.get(url=url, headers=headers)
+        self.limiter.acquire()
+        status = 'error'
+        try:
+            with metrics.timed('opendota_request_duration_seconds', endpoint=endpoint):
+                response = self.session.get(url=url, headers=headers, timeout=self.timeout, stream=stream)
+            status = response.status_code
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise ApiRetryError(str(e)) from e
+        finally:
+            metrics.inc('opendota_requests_total', endpoint=endpoint, status=status)
+
+        if status in RetryPolicy.RETRY_STATUSES:
+            response.close()
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if status == 429:
+                self.breaker.trip(retry_after)
+            else:
+                self.breaker.record_failure()
+            raise ApiRetryError(f'{url}: {status}', retry_after)
+        self.breaker.record_success()
+        response.from_cache = False
+        if ttl != 0:
+            self.store_response(url, response, ttl)
         return response
 
+    def get_stream(self, url, ttl=0):
+        chunk_size = settings.OPENDOTA_STREAM_CHUNK_SIZE
+        if self.cache:
+            chunks = self.cache.get_stream(url, chunk_size)
+            if chunks is not None or self.cache.replay:
+                metrics.inc('opendota_requests_total', endpoint=self.get_endpoint(url), status='cache')
+                return chunks
+
+        response = self.get(url=url, stream=True)
+        if not response.ok:
+            response.close()
+            return None
+        chunks = response.iter_content(chunk_size)
+        if self.cache and ttl != 0:
+            chunks = self.cache.put_stream(url, chunks, ttl)
+        return chunks
+
+    def store_response(self, url, response, ttl=None):
+        if self.cache and response.ok and not response.from_cache:
+            self.cache.put(url, response.content, ttl)
+
     @staticmethod
     def post(url, json, auth, **kwargs):
         headers = kwargs.get('headers') or {}
@@ -20,8 +306,11 @@ class DotaApiConnector:
 
     def get_matches_id(self, team_id, competition_id):
         all_matches = []
-        url = f'{self.BASE_URL}teams/{team_id}/matches'
-        response = self.get(url=url)
+        url = f'{self.base_url}teams/{team_id}/matches'
+        try:
+            response = self.get(url=url)
+        except ApiRetryError:
+            return ''
 
         if response.ok:
             data = response.json()
@@ -38,25 +327,49 @@ class DotaApiConnector:
 
         return all_matches
 
+    def iter_league_matches(self, competition_id):
+        url = f'{self.base_url}leagues/{competition_id}/matches'
+        try:
+            chunks = self.get_stream(url=url, ttl=settings.OPENDOTA_CACHE_TTL['leagues'])
+        except ApiRetryError:
+            return None
+        if chunks is None:
+            return None
+        return self.parse_league_matches(chunks)
+
+    @staticmethod
+    def parse_league_matches(chunks):
+        try:
+            for data in iter_json_array(chunks):
+                yield LeagueMatch(*(data.get(field) for field in LeagueMatch._fields))
+        except requests.RequestException as e:
+            raise ApiRetryError(str(e)) from e
+
     def get_league_matches_id(self, competition_id):
-        url = f'{self.BASE_URL}leagues/{competition_id}/matches'
-        response = self.get(url=url)
-        if response.ok and response.json():
-            return response.json()
-        else:
-            return {}
+        league_matches = self.iter_league_matches(competition_id)
+        return list(league_matches) if league_matches is not None else []
 
     def get_match_info(self, id_match):
-        url = f'{self.BASE_URL}matches/{id_match}'
+        url = f'{self.base_url}matches/{id_match}'
         response = self.get(url=url)
         if response.ok:
-            return response.json()
-
-        counter = 10
-        while counter > 0 and not response.ok:
-            counter -= 1
-            sleep(1)
-            response = self.get(url=url)
-            if response.ok:
-                return response.json()
+            return self.store_match_info(url, response)
         return {}
+
+    def store_match_info(self, url, response):
+        data = response.json()
+        # only replay-parsed matches (non-empty version) are final, the rest is refetched until parsed
+        if data.get('version'):
+            self.store_response(url, response, None)
+        return data
+
+    def fetch_match_info(self, id_match):
+        try:
+            return self.get_match_info(id_match), None
+        except ApiRetryError as e:
+            return None, e
+
+    def get_matches_info(self, match_ids):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for match_id, (data, error) in zip(match_ids, executor.map(self.fetch_match_info, match_ids)):
+                yield match_id, data, error
@@ -0,0 +1,129 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import ceil
+
+from django.conf import settings
+
+from api.connectors import TokenBucket
+from api.response_cache import ResponseCache
+from fantasy.synthetic import SERIES_MATCHES, build_match_data, get_league_match
+
+LEAGUE_MATCHES_PATH = re.compile(r'/leagues/(\d+)/matches/?$')
+MATCH_PATH = re.compile(r'/matches/(\d+)/?$')
+ERROR_STATUSES = [500, 502, 503]
+
+
+class FakeOpenDotaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, body, headers = self.server.respond(self.path.split('?')[0])
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenDotaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), cache_dir=None, source_url=None, latency=0, jitter=0,
+                 error_rate=0, throttle_rate=0, rate_limit=None, burst=1, league_size=100, seed=None):
+        super().__init__(address, FakeOpenDotaHandler)
+        self.cache = ResponseCache(cache_dir, 0, mode=ResponseCache.MODE_REPLAY) if cache_dir else None
+        self.source_url = source_url or settings.OPENDOTA_API_URL
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.league_size = league_size
+        self.random = random.Random(seed)
+        self.generated = {}
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/api/'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def respond(self, path):
+        with self.lock:
+            delay = max(0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            fault = self.random.random()
+        time.sleep(delay)
+
+        if self.limiter:
+            wait = self.limiter.try_acquire()
+            if wait:
+                return self.reply(429, {'error': 'rate limit exceeded'}, {'Retry-After': str(ceil(wait))})
+        if fault < self.throttle_rate:
+            return self.reply(429, {'error': 'rate limit exceeded'}, {'Retry-After': '1'})
+        if fault < self.throttle_rate + self.error_rate:
+            return self.reply(self.random.choice(ERROR_STATUSES), {'error': 'injected failure'})
+
+        match = LEAGUE_MATCHES_PATH.search(path) or MATCH_PATH.search(path)
+        if not match:
+            return self.reply(404, {'error': 'Not Found'})
+        relative_url = match.group(0).lstrip('/').rstrip('/')
+        if self.cache:
+            content = self.cache.get(f'{self.source_url}{relative_url}')
+            if content is None:
+                return self.reply(404, {'error': 'Not Found'})
+            return self.reply(200, content)
+        if match.re is LEAGUE_MATCHES_PATH:
+            return self.reply(200, [get_league_match(data) for data in self.generate_league(int(match.group(1)))])
+        return self.reply(200, self.get_generated_match(int(match.group(1))))
+
+    def reply(self, status, data, headers=None):
+        self.stats[status] += 1
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        return status, body, headers or {}
+
+    @staticmethod
+    def get_lineup(rnd, team_id):
+        return team_id, [(rnd.randint(10 ** 8, 10 ** 9), role < 3) for role in range(5)]
+
+    def generate_league(self, league_id):
+        rnd = random.Random(league_id)
+        lineups = [self.get_lineup(rnd, league_id * 100 + n) for n in range(8)]
+        start_time = int(time.time()) - self.league_size * 3600
+        matches = []
+        while len(matches) < self.league_size:
+            series_id = rnd.randint(10 ** 6, 10 ** 7)
+            series_type = rnd.choice(list(SERIES_MATCHES))
+            radiant, dire = rnd.sample(lineups, 2)
+            for _ in range(rnd.randint(*SERIES_MATCHES[series_type])):
+                match_id = league_id * 10 ** 6 + len(matches)
+                matches.append(build_match_data(rnd, match_id, league_id, series_id, series_type, radiant, dire,
+                                                start_time + len(matches) * 3600))
+        matches = matches[:self.league_size]
+        with self.lock:
+            self.generated.update((data['match_id'], data) for data in matches)
+        return matches
+
+    def get_generated_match(self, match_id):
+        with self.lock:
+            data = self.generated.get(match_id)
+        if data is None:
+            rnd = random.Random(match_id)
+            data = build_match_data(rnd, match_id, 0, None, None, self.get_lineup(rnd, 1), self.get_lineup(rnd, 2),
+                                    int(time.time()))
+        return data
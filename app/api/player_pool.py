@@ -0,0 +1,41 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from api.caching import get_version_key
+from fantasy.models import Competition, Player, Team
+
+PLAYER_FIELDS = ['id', 'nickname', 'team', 'game_role', 'cost']
+
+
+def build_player_pool(competition_id):
+    if not Competition.objects.filter(id=competition_id).exists():
+        return None
+    teams = Team.objects.filter(competitions=competition_id).order_by('id').values('id', 'name', 'short_name', 'dota_id')
+    players = Player.objects.filter(team__competitions=competition_id).values_list(
+        'id', 'nickname', 'team_id', 'game_role', 'cost')
+    pool = {
+        'teams': list(teams),
+        'player_fields': PLAYER_FIELDS,
+        'players': [[player_id, nickname, team_id, game_role, str(cost)]
+                    for player_id, nickname, team_id, game_role, cost in players],
+    }
+    return json.dumps(pool, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def get_player_pool(competition_id):
+    key = f'player_pool:{competition_id}'
+    version_keys = [get_version_key(model) for model in (Player, Team, Competition)]
+    values = cache.get_many([key, *version_keys])
+    versions = [values.get(version_key, 0) for version_key in version_keys]
+    cached = values.get(key)
+    if cached and cached[0] == versions:
+        return cached[1], cached[2]
+
+    body = build_player_pool(competition_id)
+    if body is None:
+        return None, None
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    cache.set(key, (versions, etag, body), timeout=None)
+    return etag, body
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+import zlib
+
+
+class ResponseCache:
+    MODE_OFF = 'off'
+    MODE_ON = 'on'
+    MODE_REPLAY = 'replay'
+
+    def __init__(self, path, max_size, mode=MODE_ON, evict_every=100):
+        self.path = path
+        self.max_size = max_size
+        self.mode = mode
+        self.evict_every = evict_every
+        self.puts = 0
+        self.puts_lock = threading.Lock()
+
+    @property
+    def replay(self):
+        return self.mode == self.MODE_REPLAY
+
+    @staticmethod
+    def digest(value):
+        return hashlib.sha256(value).hexdigest()
+
+    def ref_path(self, url):
+        key = self.digest(url.encode())
+        return os.path.join(self.path, 'refs', key[:2], key)
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.path, 'blobs', content_hash[:2], content_hash)
+
+    @staticmethod
+    def write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get_fresh_blob_path(self, url):
+        with open(self.ref_path(url)) as f:
+            content_hash, expires = f.read().split()
+        if not self.replay and float(expires) and float(expires) < time.time():
+            return None
+        return self.blob_path(content_hash)
+
+    def get(self, url):
+        try:
+            blob_path = self.get_fresh_blob_path(url)
+            if blob_path is None:
+                return None
+            with open(blob_path, 'rb') as f:
+                content = zlib.decompress(f.read())
+            os.utime(blob_path)
+            return content
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    def get_stream(self, url, chunk_size):
+        try:
+            blob_path = self.get_fresh_blob_path(url)
+            if blob_path is None:
+                return None
+            blob = open(blob_path, 'rb')
+            os.utime(blob_path)
+        except (OSError, ValueError):
+            return None
+        return self.iter_blob(blob, chunk_size)
+
+    @staticmethod
+    def iter_blob(blob, chunk_size):
+        decompressor = zlib.decompressobj()
+        with blob:
+            for chunk in iter(lambda: blob.read(chunk_size), b''):
+                yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+    def put(self, url, content, ttl=None):
+        content_hash = self.digest(content)
+        blob_path = self.blob_path(content_hash)
+        if not os.path.exists(blob_path):
+            self.write_atomic(blob_path, zlib.compress(content))
+        self.put_ref(url, content_hash, ttl)
+
+    def put_stream(self, url, chunks, ttl=None):
+        content_hash = hashlib.sha256()
+        compressor = zlib.compressobj()
+        tmp_path = os.path.join(self.path, 'tmp', f'{uuid.uuid4().hex}.tmp')
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    content_hash.update(chunk)
+                    f.write(compressor.compress(chunk))
+                    yield chunk
+                f.write(compressor.flush())
+            blob_path = self.blob_path(content_hash.hexdigest())
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.put_ref(url, content_hash.hexdigest(), ttl)
+
+    def put_ref(self, url, content_hash, ttl=None):
+        expires = time.time() + ttl if ttl else 0
+        self.write_atomic(self.ref_path(url), f'{content_hash} {expires}'.encode())
+
+        with self.puts_lock:
+            self.puts += 1
+            evict = self.puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        blobs = []
+        total_size = 0
+        for root, _, files in os.walk(os.path.join(self.path, 'blobs')):
+            for name in files:
+                stat = os.stat(os.path.join(root, name))
+                blobs.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+                total_size += stat.st_size
+
+        if total_size <= self.max_size:
+            return 0
+
+        removed = set()
+        for _, size, blob_path in sorted(blobs):
+            if total_size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(blob_path)
+            except OSError:
+                continue
+            total_size -= size
+            removed.add(os.path.basename(blob_path))
+        self.prune_refs(removed)
+        return len(removed)
+
+    def prune_refs(self, removed_hashes):
+        now = time.time()
+        for root, _, files in os.walk(os.path.join(self.path, 'refs')):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                ref_path = os.path.join(root, name)
+                try:
+                    with open(ref_path) as f:
+                        content_hash, expires = f.read().split()
+                    if content_hash in removed_hashes or not self.replay and 0 < float(expires) < now:
+                        os.remove(ref_path)
+                except (OSError, ValueError):
+                    continue
@@ -1,7 +1,11 @@
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.db.models import Sum
 from rest_framework import serializers
+from fantasy.constants import GameRoleEnum
 from fantasy.models import Competition, Team, Player, FantasyTeam, FantasyPlayer, PlayerMatchResult, \
     CompetitionTour, FantasyTeamTour, AppScreenInfo
 from djoser.serializers import UserCreateSerializer
@@ -171,6 +175,47 @@ class FantasyTeamTourRatingSerializer(serializers.ModelSerializer):
         fields = ['id', 'user',  'result', 'rank']
 
 
+class FantasyLineupSerializer(serializers.Serializer):
+    players = serializers.ListField(child=serializers.IntegerField(), max_length=len(GameRoleEnum))
+
+    def validate_players(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError('Players must be unique.')
+        players = Player.objects.in_bulk(value)
+        if len(players) != len(value):
+            raise serializers.ValidationError('Some players do not exist.')
+        players = [players[player_id] for player_id in value]
+        if len({player.game_role for player in players}) != len(players):
+            raise serializers.ValidationError('Only one player per game role is allowed.')
+        if sum(player.cost for player in players) > Decimal(str(settings.FANTASY_TEAM_BUDGET)):
+            raise serializers.ValidationError('Team cost is over budget.')
+        return players
+
+    def validate(self, attrs):
+        competition_tour = self.instance.competition_tour
+        if not competition_tour or not competition_tour.is_editing_allowed:
+            raise serializers.ValidationError('Editing is not allowed.')
+        return attrs
+
+    def update(self, instance, validated_data):
+        players = {player.id: player for player in validated_data['players']}
+        fantasy_players = list(instance.fantasy_players.all())
+        replaced = [fan_player for fan_player in fantasy_players if fan_player.player_id not in players]
+        new_players = [player for player_id, player in players.items()
+                       if player_id not in {fan_player.player_id for fan_player in fantasy_players}]
+
+        updated = []
+        for fan_player, player in zip(replaced, new_players):
+            fan_player.player = player
+            fan_player.result = 0
+            updated.append(fan_player)
+        FantasyPlayer.objects.bulk_update(updated, ['player', 'result'])
+        FantasyPlayer.objects.filter(id__in=[fan_player.id for fan_player in replaced[len(updated):]]).delete()
+        FantasyPlayer.objects.bulk_create([FantasyPlayer(player=player, fantasy_team_tour=instance)
+                                           for player in new_players[len(updated):]])
+        return instance
+
+
 class FantasyTeamTourCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = FantasyTeamTour
@@ -1,5 +1,7 @@
+from django.conf import settings
 from rest_framework.routers import DefaultRouter
 
+from api import async_views
 from api.views import CompetitionViewSet, PlayerViewSet, FantasyTeamViewSet, FantasyPlayerViewSet, UserViewSet, \
     CompetitionTourViewSet, FantasyTeamTourViewSet, AppReportViewSet, AppInfoViewSet
 
@@ -16,5 +18,5 @@ router.register('fantasy-team-tour', FantasyTeamTourViewSet, basename='fantasy-t
 router.register('fantasy-player', FantasyPlayerViewSet, basename='fantasy-player'),
 
 urlpatterns = router.urls
-
-
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns = async_views.urlpatterns + urlpatterns
@@ -1,5 +1,11 @@
-from django.db.models import Sum, Window, F
-from django.db.models.functions import Rank
+from django.conf import settings as django_settings
+from django.db import transaction
+from django.db.models import Min, Prefetch, Q, Sum
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import TokenCreateView
 from rest_framework import mixins
@@ -8,16 +14,19 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from api.caching import CachedResponseMixin
 from api.filters import PlayersFilterSet
+from api.player_pool import get_player_pool
 from api.serializers import CompetitionSerializerShort, PlayerSerializer, FantasyTeamSerializer, \
     FantasyPlayerSerializer, \
     FantasyTeamCreateSerializer, FantasyPlayerCreateSerializer, FantasyTeamTourRatingSerializer, UserSerializer, \
     CompetitionEditStatusSerializer, CompetitionTourSerializer, FantasyTeamTourSerializer, \
     FantasyTeamTourCreateSerializer, AppErrorReportSerializer, FantasyTeamRatingSerializer, \
-    CompetitionSerializerWithTours, AppScreenInfoSerializer
+    CompetitionSerializerWithTours, AppScreenInfoSerializer, FantasyLineupSerializer
 
+from fantasy.leaderboards import get_competition_leaderboard, get_tour_leaderboard
 from fantasy.models import Competition, Player, FantasyTeam, FantasyPlayer, CompetitionTour, FantasyTeamTour, \
-    AppScreenInfo
+    AppScreenInfo, Team
 from djoser import utils
 from djoser.conf import settings
 from rest_framework import status
@@ -37,13 +46,118 @@ class CustomTokenCreateView(TokenCreateView):
         )
 
 
-class CompetitionViewSet(mixins.ListModelMixin,
+def get_fantasy_players_prefetch():
+    return Prefetch('fantasy_players', queryset=FantasyPlayer.objects.select_related('player__team'))
+
+
+class LeaderboardMixin:
+    leaderboard_page_size = 100
+    leaderboard_max_page_size = 500
+
+    @staticmethod
+    def rank_objects(page, objects):
+        result = []
+        for obj_id, _, rank in page:
+            if obj_id in objects:
+                objects[obj_id].rank = rank
+                result.append(objects[obj_id])
+        return result
+
+    @classmethod
+    def get_leaderboard_objects(cls, page, queryset):
+        return cls.rank_objects(page, queryset.in_bulk([obj_id for obj_id, _, _ in page]))
+
+    @classmethod
+    def get_page_params(cls, query_params):
+        cursor = max(int(query_params.get('cursor', 0)), 0)
+        limit = min(int(query_params.get('limit', cls.leaderboard_page_size)), cls.leaderboard_max_page_size)
+        if limit < 1:
+            raise ValueError(limit)
+        return cursor, limit
+
+    @classmethod
+    def get_around(cls, query_params):
+        return min(max(int(query_params.get('around', 5)), 0), cls.leaderboard_max_page_size // 2)
+
+    @staticmethod
+    def get_page_data(count, cursor, limit, results):
+        return {
+            'count': count,
+            'next_cursor': cursor + limit if cursor + limit < count else None,
+            'results': results,
+        }
+
+    @staticmethod
+    def get_user_data(obj, page, neighbours):
+        return {
+            'id': obj.id,
+            'rank': next((rank for obj_id, _, rank in page if obj_id == obj.id), None),
+            'result': obj.result,
+            'neighbours': neighbours,
+        }
+
+    def leaderboard_page_response(self, leaderboard, queryset, serializer_class):
+        try:
+            cursor, limit = self.get_page_params(self.request.query_params)
+        except ValueError:
+            return Response({"error": "Invalid cursor or limit"}, status=400)
+
+        count = leaderboard.count()
+        page = leaderboard.get_page(cursor, limit)
+        serializer = serializer_class(self.get_leaderboard_objects(page, queryset), many=True)
+        return Response(self.get_page_data(count, cursor, limit, serializer.data))
+
+    def leaderboard_user_response(self, leaderboard, queryset, serializer_class, obj):
+        position = leaderboard.get_position(obj.id) if obj else None
+        if position is None:
+            return Response({"error": "Fantasy team not found"}, status=404)
+
+        try:
+            around = self.get_around(self.request.query_params)
+        except ValueError:
+            return Response({"error": "Invalid around"}, status=400)
+
+        offset = max(position - around, 0)
+        page = leaderboard.get_page(offset, position - offset + around + 1)
+        serializer = serializer_class(self.get_leaderboard_objects(page, queryset), many=True)
+        return Response(self.get_user_data(obj, page, serializer.data))
+
+
+def get_editing_boundaries(now):
+    return {
+        'start': Min('editing_start', filter=Q(editing_start__gt=now)),
+        'end': Min('editing_end', filter=Q(editing_end__gte=now)),
+    }
+
+
+def get_seconds_to_boundaries(default, boundaries, now):
+    seconds = [(boundary - now).total_seconds() + 1 for boundary in boundaries.values() if boundary]
+    return max(int(min([default, *seconds])), 1)
+
+
+def get_editing_cache_timeout(default):
+    now = timezone.now()
+    boundaries = CompetitionTour.objects.aggregate(**get_editing_boundaries(now))
+    return get_seconds_to_boundaries(default, boundaries, now)
+
+
+class CompetitionViewSet(LeaderboardMixin,
+                         CachedResponseMixin,
+                         mixins.ListModelMixin,
                          mixins.RetrieveModelMixin,
                          GenericViewSet):
     queryset = Competition.objects.all()
     serializer_class = CompetitionSerializerWithTours
     filter_backends = [DjangoFilterBackend]
     permission_classes = [IsAuthenticated]
+    cache_models = (Competition, CompetitionTour)
+
+    def get_queryset(self):
+        if self.action == 'retrieve':
+            return self.queryset.prefetch_related('competition_tours')
+        if self.action == 'edit_status':
+            return self.queryset.select_related('active_tour')
+        return self.queryset
 
     def get_serializer_class(self):
         if self.action in ['list']:
@@ -51,6 +165,15 @@ class CompetitionViewSet(mixins.ListModelMixin,
         else:
             return self.serializer_class
 
+    def get_cache_timeout(self):
+        return get_editing_cache_timeout(self.cache_timeout)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().retrieve, *args, **kwargs)
+
     @action(detail=True, methods=['GET'])
     def rating(self, request, pk=None):
         try:
@@ -58,11 +181,41 @@ class CompetitionViewSet(mixins.ListModelMixin,
         except Competition.DoesNotExist:
             return Response({"error": "Competition not found"}, status=404)
 
-        fantasy_teams = (competition.fantasy_teams.all()
-                         .annotate(rank=Window(expression=Rank(), order_by=F('result').desc())))[:100]
+        leaderboard = get_competition_leaderboard(competition.id)
+        fantasy_teams = self.get_leaderboard_objects(leaderboard.get_page(0, self.leaderboard_page_size),
+                                                     FantasyTeam.objects.select_related('user'))
         serializer = FantasyTeamRatingSerializer(fantasy_teams, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['GET'])
+    def leaderboard(self, request, pk=None):
+        competition = self.get_object()
+        return self.leaderboard_page_response(get_competition_leaderboard(competition.id),
+                                              FantasyTeam.objects.select_related('user'),
+                                              FantasyTeamRatingSerializer)
+
+    @action(detail=True, methods=['GET'], url_path='player-pool')
+    def player_pool(self, request, pk=None):
+        etag, body = get_player_pool(pk) if pk.isdigit() else (None, None)
+        if body is None:
+            raise Http404
+        etags = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(detail=True, methods=['GET'], url_path='my-rating')
+    def my_rating(self, request, pk=None):
+        competition = self.get_object()
+        fantasy_team = FantasyTeam.objects.filter(competition=competition, user=request.user).first()
+        return self.leaderboard_user_response(get_competition_leaderboard(competition.id),
+                                              FantasyTeam.objects.select_related('user'),
+                                              FantasyTeamRatingSerializer, fantasy_team)
+
     @action(detail=True, methods=['GET'])
     def edit_status(self, request, pk=None):
         instance = self.get_object()
@@ -72,7 +225,9 @@ class CompetitionViewSet(mixins.ListModelMixin,
         })
 
 
-class CompetitionTourViewSet(mixins.ListModelMixin,
+class CompetitionTourViewSet(LeaderboardMixin,
+                             CachedResponseMixin,
+                             mixins.ListModelMixin,
                              mixins.RetrieveModelMixin,
                              GenericViewSet):
     queryset = CompetitionTour.objects.all()
@@ -82,6 +237,16 @@ class CompetitionTourViewSet(mixins.ListModelMixin,
         'competition': ['in', 'exact']
     }
     permission_classes = [IsAuthenticated]
+    cache_models = (CompetitionTour, )
+
+    def get_cache_timeout(self):
+        return get_editing_cache_timeout(self.cache_timeout)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().retrieve, *args, **kwargs)
 
     @action(detail=True, methods=['GET'])
     def rating(self, request, pk=None):
@@ -90,21 +255,46 @@ class CompetitionTourViewSet(mixins.ListModelMixin,
         except Competition.DoesNotExist:
             return Response({"error": "Competition not found"}, status=404)
 
-        fantasy_teams = (tour.fantasy_teams.all()
-                         .annotate(rank=Window(expression=Rank(), order_by=F('result').desc())))[:100]
+        leaderboard = get_tour_leaderboard(tour.id)
+        fantasy_teams = self.get_leaderboard_objects(leaderboard.get_page(0, self.leaderboard_page_size),
+                                                     FantasyTeamTour.objects.select_related('fantasy_team__user'))
         serializer = FantasyTeamTourRatingSerializer(fantasy_teams, many=True)
         return Response(serializer.data)
 
-
-class PlayerViewSet(mixins.ListModelMixin,
+    @action(detail=True, methods=['GET'])
+    def leaderboard(self, request, pk=None):
+        tour = self.get_object()
+        return self.leaderboard_page_response(get_tour_leaderboard(tour.id),
+                                              FantasyTeamTour.objects.select_related('fantasy_team__user'),
+                                              FantasyTeamTourRatingSerializer)
+
+    @action(detail=True, methods=['GET'], url_path='my-rating')
+    def my_rating(self, request, pk=None):
+        tour = self.get_object()
+        fantasy_team_tour = FantasyTeamTour.objects.filter(competition_tour=tour,
+                                                           fantasy_team__user=request.user).first()
+        return self.leaderboard_user_response(get_tour_leaderboard(tour.id),
+                                              FantasyTeamTour.objects.select_related('fantasy_team__user'),
+                                              FantasyTeamTourRatingSerializer, fantasy_team_tour)
+
+
+class PlayerViewSet(CachedResponseMixin,
+                    mixins.ListModelMixin,
                     mixins.RetrieveModelMixin,
                     GenericViewSet):
-    queryset = Player.objects.all()
+    queryset = Player.objects.select_related('team')
     serializer_class = PlayerSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = PlayersFilterSet
     # ordering = ('-cost', 'team__name', 'nickname')
     permission_classes = [IsAuthenticated]
+    cache_models = (Player, Team, Competition)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().retrieve, *args, **kwargs)
 
 
 class FantasyTeamViewSet(mixins.ListModelMixin,
@@ -121,6 +311,14 @@ class FantasyTeamViewSet(mixins.ListModelMixin,
     }
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        if self.action in ['list', 'retrieve']:
+            return self.queryset.select_related('competition').prefetch_related(
+                Prefetch('child_teams', queryset=FantasyTeamTour.objects.select_related('competition_tour')
+                         .prefetch_related(get_fantasy_players_prefetch())),
+            )
+        return self.queryset
+
     def filter_queryset(self, queryset):
         queryset = queryset.filter(user=self.request.user)
         return super().filter_queryset(queryset)
@@ -147,18 +345,39 @@ class FantasyTeamTourViewSet(mixins.ListModelMixin,
     }
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        if self.action in ['list', 'retrieve']:
+            return self.queryset.select_related('competition_tour').prefetch_related(get_fantasy_players_prefetch())
+        return self.queryset
+
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return FantasyTeamTourCreateSerializer
+        elif self.action == 'lineup':
+            return FantasyLineupSerializer
         else:
             return self.serializer_class
 
+    @action(detail=True, methods=['PUT'])
+    def lineup(self, request, pk=None):
+        with transaction.atomic():
+            instance = get_object_or_404(
+                FantasyTeamTour.objects.select_for_update(of=('self', )).select_related('competition_tour'),
+                pk=pk, fantasy_team__user=request.user,
+            )
+            serializer = self.get_serializer(instance, data=request.data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        instance = self.queryset.select_related('competition_tour') \
+            .prefetch_related(get_fantasy_players_prefetch()).get(pk=instance.pk)
+        return Response(FantasyTeamTourSerializer(instance, context=self.get_serializer_context()).data)
+
 
 class FantasyPlayerViewSet(mixins.ListModelMixin,
                            mixins.CreateModelMixin,
                            mixins.UpdateModelMixin,
                            GenericViewSet):
-    queryset = FantasyPlayer.objects.all()
+    queryset = FantasyPlayer.objects.select_related('player__team')
     serializer_class = FantasyPlayerSerializer
     permission_classes = [IsAuthenticated]
 
@@ -177,7 +396,7 @@ class FantasyPlayerViewSet(mixins.ListModelMixin,
             current_player_cost = (ft_tour.fantasy_players
                                    .filter(player__game_role=player.game_role)
                                    .aggregate(total_cost=Sum('player__cost')))['total_cost'] or 0.00
-            allowable_balance = 50.0 - float(team_cost) + float(current_player_cost)
+            allowable_balance = django_settings.FANTASY_TEAM_BUDGET - float(team_cost) + float(current_player_cost)
             if ft_tour.competition_tour.is_editing_allowed and float(player.cost) <= allowable_balance:
                 serializer.save()
         except KeyError:
@@ -192,7 +411,7 @@ class FantasyPlayerViewSet(mixins.ListModelMixin,
             current_player_cost = (ft_tour.fantasy_players
                                    .filter(player__game_role=player.game_role)
                                    .aggregate(total_cost=Sum('player__cost')))['total_cost'] or 0.00
-            allowable_balance = 50.0 - float(team_cost) + float(current_player_cost)
+            allowable_balance = django_settings.FANTASY_TEAM_BUDGET - float(team_cost) + float(current_player_cost)
             if ft_tour.competition_tour.is_editing_allowed and float(player.cost) <= allowable_balance:
                 serializer.save()
         except KeyError:
@@ -218,7 +437,8 @@ class AppReportViewSet(mixins.CreateModelMixin,
     permission_classes = [AllowAny]
 
 
-class AppInfoViewSet(mixins.ListModelMixin,
+class AppInfoViewSet(CachedResponseMixin,
+                     mixins.ListModelMixin,
                      GenericViewSet):
     queryset = AppScreenInfo.objects.all()
     serializer_class = AppScreenInfoSerializer
@@ -227,3 +447,7 @@ class AppInfoViewSet(mixins.ListModelMixin,
         'screen': ['exact'],
     }
     permission_classes = [AllowAny]
+    cache_models = (AppScreenInfo, )
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().list, *args, **kwargs)
@@ -0,0 +1,113 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'metrics:samples'
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+GAUGE = 'gauge'
+
+METRICS = {
+    'fantasy_pipeline_stage_duration_seconds': (HISTOGRAM, 'Pipeline stage duration.'),
+    'fantasy_pipeline_stage_runs_total': (COUNTER, 'Pipeline stage runs by outcome.'),
+    'fantasy_pipeline_items_total': (COUNTER, 'Items processed by a pipeline stage.'),
+    'fantasy_pipeline_backlog': (GAUGE, 'Items waiting for a pipeline stage.'),
+    'opendota_request_duration_seconds': (HISTOGRAM, 'OpenDota API request duration.'),
+    'opendota_requests_total': (COUNTER, 'OpenDota API requests by status.'),
+    'opendota_circuit_trips_total': (COUNTER, 'Times OpenDota fetches were paused.'),
+    'opendota_circuit_open_seconds': (GAUGE, 'Remaining OpenDota fetch pause.'),
+}
+
+
+def format_labels(labels, le=None):
+    pairs = [f'{name}="{value}"' for name, value in sorted(labels.items())]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return f'{{{",".join(pairs)}}}' if pairs else ''
+
+
+def get_sort_key(sample):
+    prefix, _, le = sample[0].partition('le="')
+    return prefix, float(le.rstrip('"}')) if le else 0
+
+
+def write_samples(samples):
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        for sample, value in samples:
+            pipe.hincrbyfloat(METRICS_KEY, sample, value)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning('metrics write failed', extra={'error': str(e)})
+
+
+def inc(name, value=1, **labels):
+    write_samples([(f'{name}{format_labels(labels)}', value)])
+
+
+def observe(name, value, **labels):
+    samples = [(f'{name}_bucket{format_labels(labels, le=bucket)}', 1)
+               for bucket in settings.METRICS_HISTOGRAM_BUCKETS if value <= bucket]
+    samples += [
+        (f'{name}_bucket{format_labels(labels, le="+Inf")}', 1),
+        (f'{name}_sum{format_labels(labels)}', value),
+        (f'{name}_count{format_labels(labels)}', 1),
+    ]
+    write_samples(samples)
+
+
+@contextmanager
+def timed(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        duration = time.perf_counter() - started
+        observe('fantasy_pipeline_stage_duration_seconds', duration, stage=name)
+        inc('fantasy_pipeline_stage_runs_total', stage=name, outcome=outcome)
+        logger.info('stage finished', extra={'stage': name, 'outcome': outcome, 'duration': round(duration, 3)})
+
+
+def get_metric_name(sample):
+    name = sample.split('{')[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def render(gauges=None):
+    try:
+        samples = get_redis_connection('default').hgetall(METRICS_KEY)
+    except RedisError as e:
+        logger.warning('metrics read failed', extra={'error': str(e)})
+        samples = {}
+    lines = [(sample.decode(), float(value)) for sample, value in samples.items()]
+    lines += [(f'{name}{format_labels(labels)}', value) for name, labels, value in gauges or []]
+
+    by_metric = {}
+    for sample, value in sorted(lines, key=get_sort_key):
+        by_metric.setdefault(get_metric_name(sample), []).append((sample, value))
+    output = []
+    for name, metric_lines in by_metric.items():
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        output += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+        output += [f'{sample} {value}' for sample, value in metric_lines]
+    return '\n'.join(output) + '\n'
@@ -59,6 +59,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'fantasy.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -179,6 +180,15 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Kiev'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_TASK_ROUTES = {
+    '2.1. Парсинг матчу.': {'queue': 'fetch'},
+    '3.1. Оцінка матчу.': {'queue': 'rate'},
+    '4.1. Збереження результатів матчу.': {'queue': 'save'},
+    '5.2. Оновлення фентезі балів за змінами.': {'queue': 'propagate'},
+}
+
+PIPELINE_FETCH_RETRY_DELAY = 5 * 60  # seconds, OpenDota may not have parsed a fresh match yet
+PIPELINE_FETCH_MAX_RETRIES = 12
 
 CACHES = {
     "default": {
@@ -189,10 +199,75 @@ CACHES = {
         },
     }
 }
+TEST_CACHE_LOCATION = 'redis://redis:6379/15'  # separate redis db for tests, they clear the cache
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# OPENDOTA
+OPENDOTA_API_URL = os.environ.get('OPENDOTA_API_URL', 'https://api.opendota.com/api/')
+OPENDOTA_API_RATE_LIMIT = float(os.environ.get('OPENDOTA_API_RATE_LIMIT', 1))  # req/s, shared by all workers via redis
+OPENDOTA_API_BURST = int(os.environ.get('OPENDOTA_API_BURST', 1))
+OPENDOTA_API_MAX_WORKERS = int(os.environ.get('OPENDOTA_API_MAX_WORKERS', 8))
+OPENDOTA_API_TIMEOUT = (3.05, 15)  # connect and read timeouts, seconds
+OPENDOTA_STREAM_CHUNK_SIZE = 64 * 1024  # bytes read at a time from streamed listings
+OPENDOTA_RETRY_BASE_DELAY = 10  # seconds, doubled per attempt with jitter
+OPENDOTA_RETRY_MAX_DELAY = PIPELINE_FETCH_RETRY_DELAY  # keeps retries inside the match pipeline lock
+OPENDOTA_CIRCUIT_FAILURE_THRESHOLD = 5  # failed requests within the window that pause all fetches
+OPENDOTA_CIRCUIT_FAILURE_WINDOW = 60  # seconds
+OPENDOTA_CIRCUIT_COOLDOWN = 30  # seconds, minimum pause, extended by Retry-After on 429
+
+OPENDOTA_CACHE_MODE = os.environ.get('OPENDOTA_CACHE_MODE', 'on')  # off | on | replay
+OPENDOTA_CACHE_DIR = os.environ.get('OPENDOTA_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'opendota'))
+OPENDOTA_CACHE_MAX_SIZE = int(os.environ.get('OPENDOTA_CACHE_MAX_SIZE', 1024 ** 3))  # bytes
+OPENDOTA_CACHE_TTL = {  # seconds
+    'leagues': 300,
+}
+
+LEAGUE_FULL_SYNC_INTERVAL = 6 * 60 * 60  # seconds between full league reconciliations
+LEAGUE_SYNC_LOOKBACK = 3 * 60 * 60  # seconds, covers matches listed only after they end
+
+RESCORE_WORKERS = int(os.environ.get('RESCORE_WORKERS', 4))
+RESCORE_CHUNK_SIZE = 500  # matches per worker task
+
+METRICS_HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)  # seconds
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # bearer token for /metrics, without it only staff can read it
+
+PROFILING_ENABLED = bool(int(os.environ.get('PROFILING_ENABLED', 0)))  # allows the admin profiling toggle
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')  # X-Profile header value that forces a request profile
+PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_CONFIG_TTL = 10  # seconds
+PROFILING_TOP_QUERIES = 20
+PROFILING_REPEAT_THRESHOLD = 10  # same query shape this many times is reported as repeated
+PROFILING_MAX_PROFILES = 500
+
+ASYNC_READ_VIEWS = bool(int(os.environ.get('ASYNC_READ_VIEWS', 0)))  # serve read endpoints with async views, for ASGI
+ASYNC_AUTH_CACHE_TIMEOUT = 60  # seconds a token is trusted without a database lookup by the async views
+ASYNC_DATABASE_CONCURRENCY = 4  # concurrent database-bound async requests per worker, each holds a connection
+ASYNC_REDIS_MAX_CONNECTIONS = 10  # redis connections per async worker, requests wait for a free one
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'core.logging.JsonFormatter'},
+    },
+    'handlers': {
+        'json': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'api': {'handlers': ['json'], 'level': 'INFO', 'propagate': False},
+        'core': {'handlers': ['json'], 'level': 'INFO', 'propagate': False},
+        'fantasy': {'handlers': ['json'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+MATCH_PAYLOAD_COMPRESSION_LEVEL = 6
+MATCH_PAYLOAD_RETENTION_DAYS = 30  # after the competition finishes
 
 
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10**5
 
+FANTASY_TEAM_BUDGET = 50.0
+
 FANTASY_FORMULA = {
     'kills': {
         'type': '+',
@@ -253,10 +328,12 @@ FANTASY_FORMULA = {
     'stuns': {
         'type': '+',
         'coef': {'core': 0.1, 'support': 0.1},
+        'cap': 5,
     },
     'hero_healing': {
         'type': '+',
         'coef': {'core': 0.001, 'support': 0.0015},
+        'cap': 5,
     },
     'buyback_count': {
         'type': '-',
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        caches = {alias: dict(config, LOCATION=settings.TEST_CACHE_LOCATION) for alias, config in settings.CACHES.items()}
+        self.cache_settings = override_settings(CACHES=caches)
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        super().teardown_test_environment(**kwargs)
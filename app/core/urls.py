@@ -22,6 +22,7 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, Spec
 from djoser import views as djoser_views
 
 from api.views import CustomTokenCreateView
+from fantasy.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -33,7 +34,9 @@ urlpatterns = [
     path('api/auth/register/', djoser_views.UserViewSet.as_view({'post': 'create'}), name='create_user'),
     path('api/token/', CustomTokenCreateView.as_view(), name='token_create'),
 
-    path('api/', include('api.urls'))
+    path('api/', include('api.urls')),
+
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
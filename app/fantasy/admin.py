@@ -1,17 +1,27 @@
-import threading
+import json
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.db import models
+from django.urls import reverse
+from django.utils.html import format_html
 from django_json_widget.widgets import JSONEditorWidget
 from django.contrib.auth.admin import UserAdmin
 
-from fantasy.models import Competition, Team, Player, FantasyTeam, FantasyPlayer, Match, \
-    PlayerMatchResult, CompetitionTour, FantasyTeamTour, MatchSeries, IgnoreMatch, AppScreenInfo
-from fantasy.tasks import competitions_parse_match_ids, parse_matches_data, rate_matches, save_results_to_player, \
-    update_fantasy_results
+from fantasy.models import Competition, CompetitionFormula, Team, Player, FantasyTeam, FantasyPlayer, Match, \
+    PlayerMatchResult, PlayerMatchStat, CompetitionTour, FantasyTeamTour, MatchSeries, IgnoreMatch, AppScreenInfo, \
+    PipelineJob, ProfilingConfig
+from fantasy.constants import PipelineJobKindEnum
+from fantasy.jobs import enqueue_job
 from users.models import CustomUser
 
 
+def queue_pipeline_job(model_admin, request, kind, args):
+    job, created = enqueue_job(kind, args, request.user)
+    url = reverse('admin:fantasy_pipelinejob_change', args=(job.id, ))
+    message = 'queued' if created else 'is already queued'
+    model_admin.message_user(request, format_html('<a href="{}">{}</a> {}.', url, job, message))
+
+
 class CustomUserAdmin(UserAdmin):
     model = CustomUser
     list_display = ['username', 'email']
@@ -63,10 +73,27 @@ class CompetitionAdmin(admin.ModelAdmin):
 
     @admin.action(description='1. Parse Match IDs')
     def parse_matches_ids(self, request, queryset):
-        dota_ids = queryset.values_list('dota_id', flat=True)
-        t = threading.Thread(target=competitions_parse_match_ids, args=(dota_ids, ))
-        t.daemon = True
-        t.start()
+        queue_pipeline_job(self, request, PipelineJobKindEnum.PARSE_MATCH_IDS,
+                           queryset.values_list('dota_id', flat=True))
+
+
+class CompetitionFormulaAdmin(admin.ModelAdmin):
+    list_display = ['competition', 'version', 'is_active', 'created']
+    list_filter = ['competition', 'is_active']
+    readonly_fields = ['is_active']
+    formfield_overrides = {
+        models.JSONField: {'widget': JSONEditorWidget},
+    }
+    actions = ('rescore_competition',)
+
+    @admin.action(description='Rescore Competition And Activate')
+    def rescore_competition(self, request, queryset):
+        invalid = [formula for formula in queryset if formula.get_formula_errors(formula.formula)]
+        if invalid:
+            self.message_user(request, f'Invalid formulas: {", ".join(map(str, invalid))}.', level=messages.ERROR)
+            return
+        queue_pipeline_job(self, request, PipelineJobKindEnum.RESCORE_COMPETITION,
+                           queryset.values_list('id', flat=True))
 
 
 class TeamAdmin(admin.ModelAdmin):
@@ -116,35 +143,30 @@ class MatchAdmin(admin.ModelAdmin):
     formfield_overrides = {
         models.JSONField: {'widget': JSONEditorWidget},
     }
+    exclude = ['data']
+    readonly_fields = ['payload_json']
     actions = ('parse_matches_data', 'rate_matches_data', 'save_result_to_players', 'parse_matches_short_data')
 
+    @admin.display(description='Data')
+    def payload_json(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.payload, indent=2, ensure_ascii=False))
+
     @admin.action(description='2. Parse Full Match Data')
     def parse_matches_data(self, request, queryset):
-        dota_ids = queryset.values_list('dota_id', flat=True)
-        t = threading.Thread(target=parse_matches_data, args=(dota_ids, ))
-        t.daemon = True
-        t.start()
+        queue_pipeline_job(self, request, PipelineJobKindEnum.PARSE_MATCHES, queryset.values_list('dota_id', flat=True))
 
     @admin.action(description='2. *** Parse Short Match Data')
     def parse_matches_short_data(self, request, queryset):
-        dota_ids = queryset.values_list('dota_id', flat=True)
-        t = threading.Thread(target=parse_matches_data, args=(dota_ids, False))
-        t.daemon = True
-        t.start()
+        queue_pipeline_job(self, request, PipelineJobKindEnum.PARSE_MATCHES_SHORT,
+                           queryset.values_list('dota_id', flat=True))
 
     @admin.action(description='3. Rate Match Data')
     def rate_matches_data(self, request, queryset):
-        dota_ids = queryset.values_list('dota_id', flat=True)
-        t = threading.Thread(target=rate_matches, args=(dota_ids, ))
-        t.daemon = True
-        t.start()
+        queue_pipeline_job(self, request, PipelineJobKindEnum.RATE_MATCHES, queryset.values_list('dota_id', flat=True))
 
     @admin.action(description='4. Save Result To Players')
     def save_result_to_players(self, request, queryset):
-        dota_ids = queryset.values_list('dota_id', flat=True)
-        t = threading.Thread(target=save_results_to_player, args=(dota_ids, ))
-        t.daemon = True
-        t.start()
+        queue_pipeline_job(self, request, PipelineJobKindEnum.SAVE_RESULTS, queryset.values_list('dota_id', flat=True))
 
 
 class PlayerMatchResultAdmin(admin.ModelAdmin):
@@ -153,16 +175,20 @@ class PlayerMatchResultAdmin(admin.ModelAdmin):
     raw_id_fields = ('player', 'match',)
 
 
+class PlayerMatchStatAdmin(admin.ModelAdmin):
+    list_display = ['account_id', 'match', 'hero_id', 'win', 'kills', 'deaths', 'assists']
+    search_fields = ['account_id', 'match__dota_id']
+    raw_id_fields = ('match',)
+
+
 class CompetitionTourAdmin(admin.ModelAdmin):
     list_display = ['name', 'start_date', 'end_date', 'competition']
     actions = ('update_fantasy_results',)
 
     @admin.action(description='5. Update Fantasy Results')
     def update_fantasy_results(self, request, queryset):
-        ids = queryset.values_list('id', flat=True)
-        t = threading.Thread(target=update_fantasy_results, args=(ids,))
-        t.daemon = True
-        t.start()
+        queue_pipeline_job(self, request, PipelineJobKindEnum.UPDATE_FANTASY_RESULTS,
+                           queryset.values_list('id', flat=True))
 
 
 class IgnoreMatchAdmin(admin.ModelAdmin):
@@ -173,8 +199,34 @@ class AppScreenInfoAdmin(admin.ModelAdmin):
     list_display = ['screen']
 
 
+class PipelineJobAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'status', 'progress_bar', 'failed', 'created_by', 'created', 'finished']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['kind', 'status', 'progress_bar', 'failed', 'args', 'error', 'created_by', 'created',
+                       'finished']
+    exclude = ['dedup_key', 'total', 'processed']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Progress')
+    def progress_bar(self, obj):
+        return format_html('<progress value="{}" max="100"></progress> {}/{}', obj.progress, obj.processed, obj.total)
+
+
+class ProfilingConfigAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'is_enabled', 'profile_requests', 'profile_tasks', 'slow_threshold_ms', 'updated']
+
+    def has_add_permission(self, request):
+        return not ProfilingConfig.objects.exists()
+
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Competition, CompetitionAdmin)
+admin.site.register(CompetitionFormula, CompetitionFormulaAdmin)
 admin.site.register(Team, TeamAdmin)
 admin.site.register(Player, PlayerAdmin)
 admin.site.register(FantasyTeam, FantasyTeamAdmin)
@@ -183,7 +235,10 @@ admin.site.register(FantasyPlayer, FantasyPlayerAdmin)
 admin.site.register(MatchSeries, MatchSeriesAdmin)
 admin.site.register(Match, MatchAdmin)
 admin.site.register(PlayerMatchResult, PlayerMatchResultAdmin)
+admin.site.register(PlayerMatchStat, PlayerMatchStatAdmin)
 admin.site.register(CompetitionTour, CompetitionTourAdmin)
 admin.site.register(IgnoreMatch, IgnoreMatchAdmin)
 admin.site.register(AppScreenInfo, AppScreenInfoAdmin)
+admin.site.register(PipelineJob, PipelineJobAdmin)
+admin.site.register(ProfilingConfig, ProfilingConfigAdmin)
 
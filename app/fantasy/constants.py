@@ -44,4 +44,32 @@ class MatchSeriesBOFormatEnum(str, Enum):
     @classmethod
     def choices(cls):
         res = tuple([(e.value, e.value) for e in cls])
-        return res
\ No newline at end of file
+        return res
+
+
+class PipelineJobKindEnum(str, Enum):
+    PARSE_MATCH_IDS = 'PARSE_MATCH_IDS'
+    PARSE_MATCHES = 'PARSE_MATCHES'
+    PARSE_MATCHES_SHORT = 'PARSE_MATCHES_SHORT'
+    RATE_MATCHES = 'RATE_MATCHES'
+    SAVE_RESULTS = 'SAVE_RESULTS'
+    UPDATE_FANTASY_RESULTS = 'UPDATE_FANTASY_RESULTS'
+    RESCORE_COMPETITION = 'RESCORE_COMPETITION'
+
+    @classmethod
+    def choices(cls):
+        res = tuple([(e.value, e.value) for e in cls])
+        return res
+
+
+class PipelineJobStatusEnum(str, Enum):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    PARTIAL = 'PARTIAL'
+    FAILED = 'FAILED'
+
+    @classmethod
+    def choices(cls):
+        res = tuple([(e.value, e.value) for e in cls])
+        return res
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import traceback
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from fantasy.constants import PipelineJobKindEnum, PipelineJobStatusEnum
+from fantasy.models import PipelineJob
+from fantasy.rescoring import rescore_competition
+from fantasy.tasks import (chunked, competitions_parse_match_ids, parse_matches_data, rate_matches,
+                           run_pipeline_job_celery_task, save_results_to_player, start_matches_pipeline,
+                           update_fantasy_results)
+
+def parse_competitions_match_ids(competition_ids):
+    start_matches_pipeline(competitions_parse_match_ids(competition_ids))
+
+
+def parse_matches(match_dota_ids, parse_full=True):
+    return parse_matches_data(match_dota_ids, parse_full=parse_full).keys()
+
+
+def rescore_competitions(formula_ids):
+    for formula_id in formula_ids:
+        rescore_competition(formula_id)
+
+
+# handlers return the args they failed to process (or None)
+JOB_HANDLERS = {
+    PipelineJobKindEnum.PARSE_MATCH_IDS: (parse_competitions_match_ids, 1),
+    PipelineJobKindEnum.PARSE_MATCHES: (parse_matches, 50),
+    PipelineJobKindEnum.PARSE_MATCHES_SHORT: (lambda ids: parse_matches(ids, parse_full=False), 50),
+    PipelineJobKindEnum.RATE_MATCHES: (rate_matches, 200),
+    PipelineJobKindEnum.SAVE_RESULTS: (save_results_to_player, 200),
+    PipelineJobKindEnum.UPDATE_FANTASY_RESULTS: (update_fantasy_results, 1),
+    PipelineJobKindEnum.RESCORE_COMPETITION: (rescore_competitions, 1),
+}
+
+
+def get_dedup_key(kind, args):
+    return hashlib.md5(json.dumps([kind, sorted(args)]).encode()).hexdigest()
+
+
+def enqueue_job(kind, args, user=None):
+    kind = PipelineJobKindEnum(kind).value
+    args = [str(arg) for arg in args]
+    dedup_key = get_dedup_key(kind, args)
+    try:
+        with transaction.atomic():
+            job = PipelineJob.objects.create(kind=kind, args=args, dedup_key=dedup_key, total=len(args),
+                                             created_by=user)
+    except IntegrityError:
+        return PipelineJob.objects.get(dedup_key=dedup_key, status__in=PipelineJob.ACTIVE_STATUSES), False
+    transaction.on_commit(lambda: run_pipeline_job_celery_task.delay(job.id))
+    return job, True
+
+
+def run_job(job_id):
+    job = PipelineJob.objects.get(id=job_id)
+    if job.status not in PipelineJob.ACTIVE_STATUSES:
+        return job
+    handler, chunk_size = JOB_HANDLERS[PipelineJobKindEnum(job.kind)]
+    PipelineJob.objects.filter(id=job.id).update(status=PipelineJobStatusEnum.RUNNING)
+
+    processed, failed = job.processed, job.failed
+    try:
+        for chunk in chunked(job.args[processed:], chunk_size):
+            failed += len(handler(chunk) or ())
+            processed += len(chunk)
+            PipelineJob.objects.filter(id=job.id).update(processed=processed, failed=failed)
+    except Exception:
+        PipelineJob.objects.filter(id=job.id).update(status=PipelineJobStatusEnum.FAILED, finished=timezone.now(),
+                                                     error=traceback.format_exc())
+        raise
+    status = PipelineJobStatusEnum.PARTIAL if failed else PipelineJobStatusEnum.DONE
+    PipelineJob.objects.filter(id=job.id).update(status=status, finished=timezone.now())
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,112 @@
+from django_redis import get_redis_connection
+
+from fantasy.models import FantasyTeam, FantasyTeamTour
+
+
+def rank_page(entries, offset, first_rank):
+    page = []
+    for i, (member, score) in enumerate(entries):
+        if page and score == page[-1][1]:
+            rank = page[-1][2]
+        elif i == 0:
+            rank = first_rank
+        else:
+            rank = offset + i + 1
+        page.append((int(member), score, rank))
+    return page
+
+
+class Leaderboard:
+    def __init__(self, key, queryset):
+        self.key = key
+        self.ready_key = f'{key}:ready'
+        self.queryset = queryset
+        self.redis = get_redis_connection('default')
+
+    def rebuild(self):
+        scores = {str(obj_id): float(result) for obj_id, result in self.queryset.values_list('id', 'result')}
+        pipe = self.redis.pipeline()
+        pipe.delete(self.key)
+        if scores:
+            pipe.zadd(self.key, scores)
+        pipe.set(self.ready_key, 1)
+        pipe.execute()
+
+    def ensure(self):
+        if not self.redis.exists(self.ready_key):
+            self.rebuild()
+
+    def update(self, scores):
+        if scores and self.redis.exists(self.ready_key):
+            self.redis.zadd(self.key, {str(obj_id): float(result) for obj_id, result in scores.items()})
+
+    def remove(self, obj_id):
+        self.redis.zrem(self.key, str(obj_id))
+
+    def count(self):
+        self.ensure()
+        return self.redis.zcard(self.key)
+
+    def get_rank(self, score):
+        return self.redis.zcount(self.key, f'({score}', '+inf') + 1
+
+    def get_page(self, offset, limit):
+        self.ensure()
+        entries = self.redis.zrevrange(self.key, offset, offset + limit - 1, withscores=True)
+        return rank_page(entries, offset, self.get_rank(entries[0][1]) if entries else None)
+
+    def get_position(self, obj_id):
+        self.ensure()
+        return self.redis.zrevrank(self.key, str(obj_id))
+
+
+class AsyncLeaderboard:
+    def __init__(self, leaderboard, redis):
+        self.key = leaderboard.key
+        self.ready_key = leaderboard.ready_key
+        self.queryset = leaderboard.queryset
+        self.redis = redis
+
+    async def rebuild(self):
+        scores = {str(obj_id): float(result) async for obj_id, result in self.queryset.values_list('id', 'result')}
+        pipe = self.redis.pipeline()
+        pipe.delete(self.key)
+        if scores:
+            pipe.zadd(self.key, scores)
+        pipe.set(self.ready_key, 1)
+        await pipe.execute()
+
+    async def ensure(self):
+        if not await self.redis.exists(self.ready_key):
+            await self.rebuild()
+
+    async def count(self):
+        await self.ensure()
+        return await self.redis.zcard(self.key)
+
+    async def get_rank(self, score):
+        return await self.redis.zcount(self.key, f'({score}', '+inf') + 1
+
+    async def get_page(self, offset, limit):
+        await self.ensure()
+        entries = await self.redis.zrevrange(self.key, offset, offset + limit - 1, withscores=True)
+        return rank_page(entries, offset, await self.get_rank(entries[0][1]) if entries else None)
+
+    async def get_position(self, obj_id):
+        await self.ensure()
+        return await self.redis.zrevrank(self.key, str(obj_id))
+
+
+def get_competition_leaderboard(competition_id):
+    return Leaderboard(f'leaderboard:competition:{competition_id}',
+                       FantasyTeam.objects.filter(competition_id=competition_id))
+
+
+def get_tour_leaderboard(tour_id):
+    return Leaderboard(f'leaderboard:tour:{tour_id}',
+                       FantasyTeamTour.objects.filter(competition_tour_id=tour_id))
+
+
+def update_leaderboards(get_leaderboard, results):
+    for obj_id, scores in results.items():
+        get_leaderboard(obj_id).update(scores)
@@ -0,0 +1,56 @@
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+from api.connectors import CircuitBreaker, DotaApiConnector
+from api.fake_opendota import FakeOpenDotaServer
+
+
+class Command(BaseCommand):
+    help = 'Compare sequential and rate-limited concurrent match fetching against a local fake API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=20)
+        parser.add_argument('--rate', type=float, default=20, help='API quota, requests per second.')
+        parser.add_argument('--latency', type=float, default=0.2, help='Fake API latency, seconds.')
+        parser.add_argument('--jitter', type=float, default=0, help='Fake API latency jitter, seconds.')
+        parser.add_argument('--error-rate', type=float, default=0, help='Share of fake API 5xx responses.')
+        parser.add_argument('--throttle-rate', type=float, default=0, help='Share of fake API 429 responses.')
+        parser.add_argument('--server-rate-limit', type=float, help='Fake API quota, requests per second.')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skip-sequential', action='store_true')
+
+    def handle(self, *args, **options):
+        server = FakeOpenDotaServer(latency=options['latency'], jitter=options['jitter'],
+                                    error_rate=options['error_rate'], throttle_rate=options['throttle_rate'],
+                                    rate_limit=options['server_rate_limit'], seed=options['seed']).start()
+        match_ids = list(range(1, options['matches'] + 1))
+
+        try:
+            if not options['skip_sequential']:
+                started = time.perf_counter()
+                for match_id in match_ids:
+                    requests.get(f'{server.url}matches/{match_id}').json()
+                    time.sleep(1)
+                self.report('sequential + sleep(1)', len(match_ids), time.perf_counter() - started)
+
+            server.stats.clear()
+            connector = DotaApiConnector(rate_limit=options['rate'], max_workers=options['workers'], cache=False,
+                                         base_url=server.url, breaker=CircuitBreaker('opendota:circuit:benchmark'),
+                                         limiter_key='opendota:rate_limit:benchmark')
+            connector.breaker.redis.delete(connector.breaker.key, connector.breaker.failures_key)
+            started = time.perf_counter()
+            fetched = failed = 0
+            for _, data, error in connector.get_matches_info(match_ids):
+                fetched += bool(data)
+                failed += bool(error)
+            self.report(f'concurrent, quota {options["rate"]}/s', fetched, time.perf_counter() - started)
+            self.stdout.write(f'requeued after retryable errors: {failed}')
+            self.stdout.write(f'fake API responses: {dict(server.stats)}')
+        finally:
+            server.stop()
+
+    def report(self, name, count, elapsed):
+        self.stdout.write(f'{name}: {count} matches in {elapsed:.2f}s ({count / elapsed:.2f} matches/s)')
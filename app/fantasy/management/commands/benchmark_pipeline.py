@@ -0,0 +1,196 @@
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+
+from api.caching import bump_versions
+from api.response_cache import ResponseCache
+from fantasy import tasks
+from fantasy.models import Competition, CompetitionTour, FantasyPlayer, FantasyTeam, Match, Player, Team
+from fantasy.synthetic import get_default_cache_dir, get_synthetic_competitions
+
+ENDPOINTS = [
+    '/api/competition/',
+    '/api/competition/{competition}/',
+    '/api/competition/{competition}/rating/',
+    '/api/competition/{competition}/leaderboard/?limit=50',
+    '/api/competition/{competition}/my-rating/',
+    '/api/competition/{competition}/player-pool/',
+    '/api/competition-tour/?competition={competition}',
+    '/api/competition-tour/{tour}/rating/',
+    '/api/competition-tour/{tour}/my-rating/',
+    '/api/player/?competition_id={competition}',
+    '/api/fantasy-team/',
+    '/api/fantasy-team-tour/?fantasy_team={fantasy_team}',
+]
+MIN_REGRESSION = {'time': 0.01, 'warm_time': 0.005, 'queries': 0, 'peak_memory': 1024 ** 2}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Time the match pipeline stages and the main API endpoints on the synthetic dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cache-dir', default=get_default_cache_dir())
+        parser.add_argument('--repeat', type=int, default=5, help='Warm requests per endpoint.')
+        parser.add_argument('--baseline', help='Compare with a stored benchmark JSON.')
+        parser.add_argument('--save-baseline', help='Store this run as benchmark JSON.')
+        parser.add_argument('--threshold', type=float, default=20, help='Allowed regression, percent.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--skip-api', action='store_true')
+        parser.add_argument('--skip-memory', action='store_true', help='Do not trace memory, for cleaner timings.')
+        parser.add_argument('--keep', action='store_true', help='Keep pipeline results instead of rolling back.')
+
+    def handle(self, *args, **options):
+        competitions = list(get_synthetic_competitions())
+        if not competitions:
+            raise CommandError('No synthetic dataset, run generate_fantasy_data first.')
+        self.trace_memory = not options['skip_memory']
+
+        connector_cache = tasks.api_connector.cache
+        tasks.api_connector.cache = ResponseCache(options['cache_dir'], settings.OPENDOTA_CACHE_MAX_SIZE,
+                                                  mode=ResponseCache.MODE_REPLAY)
+        try:
+            with transaction.atomic():
+                results = {'dataset': self.get_dataset_counts(competitions), 'stages': {}}
+                results['stages'].update(self.run_pipeline(competitions))
+                if not options['skip_api']:
+                    results['stages'].update(self.run_api(competitions[0], options['repeat']))
+                transaction.set_rollback(not options['keep'])
+        finally:
+            tasks.api_connector.cache = connector_cache
+            if not options['keep']:
+                self.reset_caches(competitions)
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            if baseline['dataset'] != results['dataset']:
+                self.stdout.write(self.style.WARNING(f'baseline dataset differs: {baseline["dataset"]}'))
+        regressions = self.report(results, baseline, options['threshold'])
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'regressions: {", ".join(regressions)}')
+
+    @staticmethod
+    def get_dataset_counts(competitions):
+        return {
+            'competitions': len(competitions),
+            'matches': sum(len(tasks.api_connector.get_league_matches_id(competition.dota_id))
+                           for competition in competitions),
+            'fantasy_teams': FantasyTeam.objects.filter(competition__in=competitions).count(),
+            'fantasy_players': FantasyPlayer.objects.filter(
+                fantasy_team_tour__fantasy_team__competition__in=competitions).count(),
+        }
+
+    def measure(self, func, trace_memory=None):
+        trace_memory = self.trace_memory if trace_memory is None else trace_memory
+        counter = QueryCounter()
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            started = time.perf_counter()
+            with connection.execute_wrapper(counter):
+                func()
+            elapsed = time.perf_counter() - started
+            peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        return {'time': elapsed, 'queries': counter.count, 'peak_memory': peak_memory}
+
+    def run_pipeline(self, competitions):
+        dota_ids = [competition.dota_id for competition in competitions]
+        matches = Match.objects.filter(competition__in=competitions)
+        tour_ids = CompetitionTour.objects.filter(competition__in=competitions).values_list('id', flat=True)
+        stages = [
+            ('competitions_parse_match_ids', lambda: tasks.competitions_parse_match_ids(dota_ids)),
+            ('parse_matches_data',
+             lambda: tasks.parse_matches_data(matches.filter(is_parsed=False).values_list('dota_id', flat=True))),
+            ('rate_matches',
+             lambda: tasks.rate_matches(matches.filter(is_parsed=True, is_rated=False)
+                                        .values_list('dota_id', flat=True))),
+            ('save_results_to_player',
+             lambda: tasks.save_results_to_player(matches.filter(is_rated=True, is_saved_to_players=False)
+                                                  .values_list('dota_id', flat=True))),
+            ('update_fantasy_results', lambda: tasks.update_fantasy_results(tour_ids)),
+        ]
+        results = {}
+        for name, func in stages:
+            results[name] = self.measure(func)
+        return results
+
+    def run_api(self, competition, repeat):
+        fantasy_team = FantasyTeam.objects.filter(competition=competition).select_related('user').first()
+        ids = {'competition': competition.id, 'tour': competition.active_tour_id, 'fantasy_team': fantasy_team.id}
+        client = APIClient()
+        client.force_authenticate(fantasy_team.user)
+
+        def get(url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: {response.status_code}')
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for endpoint in ENDPOINTS:
+                url = endpoint.format(**ids)
+                metrics = self.measure(lambda: get(url))
+                warm_times = [self.measure(lambda: get(url), trace_memory=False)['time'] for _ in range(repeat)]
+                metrics['warm_time'] = statistics.median(warm_times) if warm_times else 0
+                results[f'GET {endpoint}'] = metrics
+        return results
+
+    @staticmethod
+    def reset_caches(competitions):
+        keys = [f'leaderboard:competition:{competition.id}' for competition in competitions]
+        keys += [f'leaderboard:tour:{tour_id}' for tour_id in
+                 CompetitionTour.objects.filter(competition__in=competitions).values_list('id', flat=True)]
+        get_redis_connection('default').delete(*keys, *[f'{key}:ready' for key in keys])
+        bump_versions(Competition, CompetitionTour, Player, Team)
+
+    def report(self, results, baseline, threshold):
+        regressions = []
+        for name, metrics in results['stages'].items():
+            line = f'{name:<60} {metrics["time"]:>8.3f}s {metrics["queries"]:>7} queries'
+            if metrics['peak_memory'] is not None:
+                line += f' {metrics["peak_memory"] / 1024 ** 2:>8.1f} MB'
+            if 'warm_time' in metrics:
+                line += f' warm {metrics["warm_time"]:.3f}s'
+            base_metrics = (baseline or {}).get('stages', {}).get(name)
+            if base_metrics:
+                deltas = []
+                for metric, value in metrics.items():
+                    base_value = base_metrics.get(metric)
+                    if not base_value or value is None:
+                        continue
+                    deltas.append(f'{metric} {(value - base_value) / base_value * 100:+.0f}%')
+                    if value > base_value * (1 + threshold / 100) and value - base_value > MIN_REGRESSION[metric]:
+                        regressions.append(f'{name} {metric}')
+                line += f' ({", ".join(deltas)})'
+            self.stdout.write(line)
+        if baseline:
+            style = self.style.ERROR if regressions else self.style.SUCCESS
+            self.stdout.write(style(f'regressions over {threshold:g}%: {len(regressions)}'))
+            for regression in regressions:
+                self.stdout.write(style(f'  {regression}'))
+        return regressions
@@ -0,0 +1,76 @@
+import json
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from fantasy.constants import GameRoleEnum
+from fantasy.models import Match, Player
+from fantasy.scoring import ScoringEngine
+from fantasy.tasks import extract_player_match_stats, get_result
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-player scoring path with the vectorized scoring engine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=500)
+        parser.add_argument('--from-db', action='store_true', help='Score the latest parsed matches from the database.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['from_db']:
+                matches = list(Match.objects.filter(Q(raw_data__isnull=False) | Q(data__isnull=False), is_parsed=True)
+                               .prefetch_related('raw_data').order_by('-id')[:options['matches']])
+            else:
+                matches = self.build_synthetic_matches(options['matches'])
+
+            started = time.perf_counter()
+            expected = [get_result(match) for match in matches]
+            current_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            results = ScoringEngine().score_matches([match.payload for match in matches])
+            engine_time = time.perf_counter() - started
+
+            match_ids = [match.id for match in matches]
+            extract_player_match_stats(match_ids)
+            started = time.perf_counter()
+            stats_results = ScoringEngine().score_match_stats(match_ids)
+            stats_time = time.perf_counter() - started
+
+            transaction.set_rollback(True)
+
+        expected = json.dumps(expected)
+        self.stdout.write(f'matches: {len(matches)}')
+        self.stdout.write(f'current path: {current_time:.3f}s')
+        self.stdout.write(f'scoring engine: {engine_time:.3f}s ({current_time / max(engine_time, 1e-9):.1f}x)')
+        self.stdout.write(f'identical output: {expected == json.dumps(results)}')
+        self.stdout.write(f'scoring engine, stats table: {stats_time:.3f}s '
+                          f'({current_time / max(stats_time, 1e-9):.1f}x)')
+        self.stdout.write(f'identical output: {expected == json.dumps([stats_results[i] for i in match_ids])}')
+
+    @staticmethod
+    def build_synthetic_matches(count):
+        roles = [role.value for role in GameRoleEnum]
+        players = Player.objects.bulk_create([
+            Player(nickname=f'benchmark_{i}', game_role=roles[i % len(roles)], dota_id=str(900000000 + i))
+            for i in range(200)
+        ])
+        actions = list(settings.FANTASY_FORMULA.keys())
+        matches = []
+        for match_id in range(count):
+            players_data = []
+            for slot, player in enumerate(random.sample(players, 10)):
+                player_data = {action: random.choice([random.randint(0, 30), random.random() * 20000, None])
+                               for action in actions}
+                player_data.update({'account_id': int(player.dota_id), 'win': int(slot < 5)})
+                players_data.append(player_data)
+            match = Match(dota_id=f'benchmark_{match_id}', data={'players': players_data})
+            match.payload = match.data
+            matches.append(match)
+        Match.objects.bulk_create(matches)
+        return matches
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Max
+
+from fantasy.models import PlayerMatchResult
+
+
+class Command(BaseCommand):
+    help = 'Delete duplicate player match results, keeping the latest row of each player and match.'
+
+    def handle(self, *args, **options):
+        if PlayerMatchResult._meta.db_table not in connection.introspection.table_names():
+            return
+        duplicates = (PlayerMatchResult.objects.values('player', 'match').annotate(count=Count('id'), last_id=Max('id'))
+                      .filter(count__gt=1).order_by())
+        deleted_count = 0
+        for duplicate in duplicates.iterator():
+            deleted_count += PlayerMatchResult.objects.filter(player=duplicate['player'], match=duplicate['match']) \
+                .exclude(id=duplicate['last_id']).delete()[0]
+        self.stdout.write(f'deleted: {deleted_count}')
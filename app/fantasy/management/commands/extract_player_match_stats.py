@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from fantasy.models import Match
+from fantasy.tasks import extract_player_match_stats
+
+
+class Command(BaseCommand):
+    help = 'Fill player match stats for parsed matches that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        match_ids = Match.objects.filter(is_parsed=True).values_list('id', flat=True)
+        extracted_count = extract_player_match_stats(match_ids, options['batch_size'])
+        self.stdout.write(f'extracted: {extracted_count}')
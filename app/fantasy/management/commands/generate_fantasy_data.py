@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from fantasy.synthetic import DatasetGenerator, clear_dataset, get_default_cache_dir, get_synthetic_competitions
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic fantasy dataset and prime the OpenDota response cache with its matches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--competitions', type=int, default=1)
+        parser.add_argument('--tours', type=int, default=4)
+        parser.add_argument('--teams', type=int, default=16)
+        parser.add_argument('--series', type=int, default=8, help='Series per tour.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cache-dir', default=get_default_cache_dir())
+        parser.add_argument('--clear', action='store_true', help='Remove a previously generated dataset first.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear_dataset()
+        elif get_synthetic_competitions().exists():
+            raise CommandError('Synthetic dataset already exists, use --clear to regenerate it.')
+
+        started = time.perf_counter()
+        generator = DatasetGenerator(options['competitions'], options['tours'], options['teams'], options['series'],
+                                     options['users'], options['seed'], options['cache_dir'])
+        with transaction.atomic():
+            counts = generator.generate()
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count}')
+        self.stdout.write(f'responses cached in {options["cache_dir"]}')
+        self.stdout.write(f'generated in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,209 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from fantasy.models import Competition, FantasyTeam
+from fantasy.synthetic import get_synthetic_competitions
+
+READ_ENDPOINTS = [
+    '/api/competition/{competition}/',
+    '/api/competition/{competition}/edit_status/',
+    '/api/competition/{competition}/leaderboard/?limit=50',
+    '/api/competition/{competition}/my-rating/',
+    '/api/competition-tour/{tour}/',
+    '/api/competition-tour/{tour}/leaderboard/?limit=50',
+    '/api/app-info/',
+]
+SLOW_ENDPOINT = '/api/competition/{competition}/rating/'
+SERVERS = {
+    'sync': ['core.wsgi:application'],
+    'async': ['--worker-class', 'uvicorn.workers.UvicornWorker', 'core.asgi:application'],
+}
+
+
+class HttpClient:
+    def __init__(self, host, port, host_header, headers):
+        self.host = host
+        self.port = port
+        self.request_head = ''.join(f'{name}: {value}\r\n' for name, value in {'Host': host_header, **headers}.items())
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f'GET {path} HTTP/1.1\r\n{self.request_head}\r\n'.encode())
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await self.reader.readline()).decode().strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.lower()] = value.strip().lower()
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await self.reader.read()
+            headers['connection'] = 'close'
+        if headers.get('connection') == 'close':
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Command(BaseCommand):
+    help = 'Poll the read endpoints with many concurrent clients and compare the sync and async deployments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Load an already running server instead of starting both deployments.')
+        parser.add_argument('--competition', type=int, help='Competition id, the synthetic dataset by default.')
+        parser.add_argument('--concurrency', type=int, default=200, help='Concurrent polling clients.')
+        parser.add_argument('--slow-clients', type=int, default=4, help='Concurrent clients on the slow rating query.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of load per server.')
+        parser.add_argument('--sync-workers', type=int, default=4, help='Worker processes of the started sync server.')
+        parser.add_argument('--async-workers', type=int, default=os.cpu_count(),
+                            help='Worker processes of the started async server, one event loop per CPU.')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout, seconds.')
+
+    def handle(self, *args, **options):
+        competition = self.get_competition(options['competition'])
+        fantasy_team = FantasyTeam.objects.filter(competition=competition).select_related('user').first()
+        if competition.active_tour_id is None or fantasy_team is None:
+            raise CommandError('Competition needs an active tour and fantasy teams.')
+        token, _ = Token.objects.get_or_create(user=fantasy_team.user)
+        ids = {'competition': competition.id, 'tour': competition.active_tour_id}
+        paths = [endpoint.format(**ids) for endpoint in READ_ENDPOINTS]
+        slow_paths = [SLOW_ENDPOINT.format(**ids)] if options['slow_clients'] else []
+        headers = {'Authorization': f'Token {token.key}'}
+
+        if options['url']:
+            url = urlsplit(options['url'])
+            results = {url.netloc: self.run_load(url.hostname, url.port or 80, url.netloc, headers, paths, slow_paths,
+                                                 options)}
+        else:
+            results = {}
+            for mode, arguments in SERVERS.items():
+                port = self.get_free_port()
+                process = self.start_server(mode, arguments, port, options[f'{mode}_workers'])
+                try:
+                    results[mode] = self.run_load('127.0.0.1', port, self.get_host_header(port), headers, paths,
+                                                  slow_paths, options)
+                finally:
+                    process.terminate()
+                    process.wait()
+        self.report(results)
+
+    @staticmethod
+    def get_competition(competition_id):
+        if competition_id:
+            competition = Competition.objects.filter(id=competition_id).first()
+        else:
+            competition = get_synthetic_competitions().first()
+        if competition is None:
+            raise CommandError('No competition, run generate_fantasy_data first or pass --competition.')
+        return competition
+
+    @staticmethod
+    def get_free_port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    @staticmethod
+    def get_host_header(port):
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host and '*' not in host), '127.0.0.1')
+        return f'{host}:{port}'
+
+    def start_server(self, mode, arguments, port, workers):
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--timeout', '120',
+                   '--bind', f'127.0.0.1:{port}', *arguments]
+        env = dict(os.environ, ASYNC_READ_VIEWS='1' if mode == 'async' else '0')
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'{mode} server exited with code {process.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                self.stdout.write(f'{mode} server started on port {port}')
+                return process
+            except OSError:
+                time.sleep(0.2)
+        process.terminate()
+        raise CommandError(f'{mode} server did not start')
+
+    def run_load(self, host, port, host_header, headers, paths, slow_paths, options):
+        return asyncio.run(self.load(host, port, host_header, headers, paths, slow_paths, options))
+
+    async def load(self, host, port, host_header, headers, paths, slow_paths, options):
+        results = {'read': [], 'slow': [], 'errors': 0}
+        warm_client = HttpClient(host, port, host_header, headers)
+        for path in paths:
+            await warm_client.get(path)
+        warm_client.close()
+
+        deadline = time.monotonic() + options['duration']
+        started = time.monotonic()
+
+        async def poll(n, kind, client_paths):
+            client = HttpClient(host, port, host_header, headers)
+            i = n
+            while time.monotonic() < deadline:
+                path = client_paths[i % len(client_paths)]
+                i += 1
+                request_started = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(client.get(path), options['timeout'])
+                except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    client.close()
+                    status = None
+                if status == 200:
+                    results[kind].append(time.perf_counter() - request_started)
+                else:
+                    results['errors'] += 1
+            client.close()
+
+        await asyncio.gather(*[poll(n, 'read', paths) for n in range(options['concurrency'])],
+                             *[poll(n, 'slow', slow_paths) for n in range(options['slow_clients'])])
+        results['elapsed'] = time.monotonic() - started
+        return results
+
+    def report(self, results):
+        self.stdout.write(f'{"server":<24} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"slow req":>8} '
+                          f'{"errors":>7}')
+        for name, result in results.items():
+            latencies = sorted(result['read'])
+            if len(latencies) > 1:
+                quantiles = statistics.quantiles(latencies, n=100)
+                p50, p95, p99 = (quantiles[q - 1] * 1000 for q in (50, 95, 99))
+            else:
+                p50 = p95 = p99 = latencies[0] * 1000 if latencies else 0
+            self.stdout.write(f'{name:<24} {len(latencies) / result["elapsed"]:>8.1f} {p50:>8.1f} {p95:>8.1f} '
+                              f'{p99:>8.1f} {len(result["slow"]):>8} {result["errors"]:>7}')
+        if {'sync', 'async'} <= results.keys() and results['sync']['read']:
+            sync_rate, async_rate = (len(results[mode]['read']) / results[mode]['elapsed']
+                                     for mode in ('sync', 'async'))
+            gain = async_rate / sync_rate
+            self.stdout.write(f'async serves {gain:.2f}x the read requests of sync')
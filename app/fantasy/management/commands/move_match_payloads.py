@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from fantasy.tasks import move_match_payloads, purge_match_payloads
+
+
+class Command(BaseCommand):
+    help = 'Move inline match data to the compressed match data table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--purge', action='store_true',
+                            help='Also drop raw data of finished competitions past the retention period.')
+
+    def handle(self, *args, **options):
+        moved_count = move_match_payloads(options['batch_size'])
+        self.stdout.write(f'moved: {moved_count}')
+        if options['purge']:
+            self.stdout.write(f'purged: {purge_match_payloads()}')
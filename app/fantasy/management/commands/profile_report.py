@@ -0,0 +1,56 @@
+import json
+import os
+import pstats
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fantasy.profiling import get_profile_ids
+
+
+class Command(BaseCommand):
+    help = 'List stored request and task profiles or show one of them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?')
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if not options['profile_id']:
+            for profile_id in get_profile_ids()[-options['limit']:]:
+                summary = self.load_summary(profile_id)
+                self.stdout.write(f'{profile_id}  {summary["name"]}  {summary["duration_ms"]}ms  '
+                                  f'{summary["sql_count"]} queries / {summary["sql_time_ms"]}ms')
+            return
+
+        path = os.path.join(settings.PROFILING_DIR, options['profile_id'])
+        summary = self.load_summary(options['profile_id'])
+        self.stdout.write(f'{summary["name"]} ({summary["outcome"]}): {summary["duration_ms"]}ms, '
+                          f'{summary["sql_count"]} queries / {summary["sql_time_ms"]}ms')
+        for title, key in (('repeated queries', 'repeated_queries'), ('top queries', 'top_queries')):
+            self.stdout.write(f'\n{title}:')
+            for shape in summary[key][:options['limit']]:
+                self.stdout.write(f'  {shape["count"]:>6}x {shape["time_ms"]:>9}ms  {shape["sql"][:200]}')
+
+        if os.path.exists(f'{path}.prof'):
+            self.stdout.write('\ncProfile:')
+            pstats.Stats(f'{path}.prof', stream=self.stdout).sort_stats('cumulative').print_stats(options['limit'])
+        if os.path.exists(f'{path}.folded'):
+            self.stdout.write('\nsampled frames:')
+            frames = Counter()
+            with open(f'{path}.folded') as f:
+                for line in f:
+                    stack, count = line.rsplit(' ', 1)
+                    for frame in set(stack.split(';')):
+                        frames[frame] += int(count)
+            for frame, count in frames.most_common(options['limit']):
+                self.stdout.write(f'  {count:>6}  {frame}')
+
+    @staticmethod
+    def load_summary(profile_id):
+        try:
+            with open(os.path.join(settings.PROFILING_DIR, f'{profile_id}.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f'Profile {profile_id} not found.')
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fantasy.rescoring import rescore_competition
+
+
+class Command(BaseCommand):
+    help = 'Rescore all parsed matches of a competition with a formula version and switch to it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('formula_id', type=int)
+        parser.add_argument('--workers', type=int)
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rescored_count = rescore_competition(options['formula_id'], options['workers'], options['chunk_size'])
+        self.stdout.write(f'rescored: {rescored_count} matches in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from api.fake_opendota import FakeOpenDotaServer
+
+
+class Command(BaseCommand):
+    help = 'Serve league listings and matches on a local OpenDota stand-in for offline load and fault testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8800)
+        parser.add_argument('--cache-dir', help='Serve responses recorded in a response cache, '
+                                                'e.g. by generate_fantasy_data. Generated on the fly otherwise.')
+        parser.add_argument('--source-url', help='Base URL the cache was recorded against.')
+        parser.add_argument('--league-size', type=int, default=100, help='Matches per generated league.')
+        parser.add_argument('--latency', type=float, default=0, help='Seconds.')
+        parser.add_argument('--jitter', type=float, default=0, help='Seconds.')
+        parser.add_argument('--error-rate', type=float, default=0, help='Share of 5xx responses.')
+        parser.add_argument('--throttle-rate', type=float, default=0, help='Share of injected 429 responses.')
+        parser.add_argument('--rate-limit', type=float, help='Requests per second before answering 429.')
+        parser.add_argument('--burst', type=int, default=1)
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        server = FakeOpenDotaServer(
+            (options['host'], options['port']), options['cache_dir'], options['source_url'], options['latency'],
+            options['jitter'], options['error_rate'], options['throttle_rate'], options['rate_limit'],
+            options['burst'], options['league_size'], options['seed'],
+        )
+        self.stdout.write(f'serving on {server.url}, set OPENDOTA_API_URL to use it')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'responses: {dict(server.stats)}')
@@ -1,9 +1,17 @@
-from django.db import models
+import copy
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.db.models import Sum
 from django.utils import timezone
 
 
-from fantasy.constants import CompetitionStatusEnum, GameRoleEnum, MatchSeriesBOFormatEnum
+from fantasy.constants import (CompetitionStatusEnum, GameRoleEnum, MatchSeriesBOFormatEnum, PipelineJobKindEnum,
+                               PipelineJobStatusEnum)
 from users.models import CustomUser
 
 
@@ -28,16 +36,96 @@ class Competition(models.Model):
     team = models.ManyToManyField(to=Team, related_name='competitions')
     active_tour = models.OneToOneField(to='CompetitionTour', related_name='parent_competition',
                                        on_delete=models.SET_NULL, null=True, blank=True)
+    sync_start_time = models.BigIntegerField(default=0)
+    full_synced_at = models.DateTimeField(null=True, blank=True)
 
     @property
     def is_editing_allowed(self):
         return self.active_tour.is_editing_allowed if self.active_tour else False
 
+    @property
+    def is_full_sync_required(self):
+        if not self.full_synced_at:
+            return True
+        return timezone.now() - self.full_synced_at >= timedelta(seconds=settings.LEAGUE_FULL_SYNC_INTERVAL)
+
+    def get_formula(self):
+        formula = self.formulas.filter(is_active=True).values_list('formula', flat=True).first()
+        return formula or settings.FANTASY_FORMULA
+
     def __str__(self):
         return self.name
 
 
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def get_default_formula():
+    return copy.deepcopy(settings.FANTASY_FORMULA)
+
+
+class CompetitionFormula(models.Model):
+    class Meta:
+        ordering = ['competition', '-version']
+        constraints = [
+            models.UniqueConstraint(fields=['competition', 'version'], name='competition and version unique'),
+            models.UniqueConstraint(fields=['competition'], condition=models.Q(is_active=True),
+                                    name='competition active formula unique'),
+        ]
+
+    competition = models.ForeignKey(to=Competition, on_delete=models.CASCADE, related_name='formulas')
+    version = models.PositiveIntegerField(blank=True)
+    formula = models.JSONField(default=get_default_formula)
+    is_active = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    FORMULA_TYPES = ('+', '-')
+    FORMULA_ROLES = ('core', 'support')
+
+    def clean(self):
+        errors = self.get_formula_errors(self.formula)
+        if errors:
+            raise ValidationError({'formula': errors})
+
+    @classmethod
+    def get_formula_errors(cls, formula):
+        if not isinstance(formula, dict) or not formula:
+            return ['Formula must be a non-empty object.']
+        errors = [cls.get_action_error(action, details) for action, details in formula.items()]
+        return [f'{action}: {error}' for action, error in zip(formula, errors) if error]
+
+    @classmethod
+    def get_action_error(cls, action, details):
+        if action not in PlayerMatchStat.STAT_FIELDS:
+            return f'unknown action, use one of {", ".join(PlayerMatchStat.STAT_FIELDS)}.'
+        if not isinstance(details, dict) or set(details) - {'type', 'coef', 'cap'}:
+            return 'expected an object with type, coef and cap.'
+        if details.get('type') not in cls.FORMULA_TYPES:
+            return f'type must be one of {", ".join(cls.FORMULA_TYPES)}.'
+        coef = details.get('coef', {})
+        if not isinstance(coef, dict) or set(coef) - set(cls.FORMULA_ROLES) or not all(map(is_number, coef.values())):
+            return f'coef must map {", ".join(cls.FORMULA_ROLES)} to numbers.'
+        if details.get('cap') is not None and not is_number(details['cap']):
+            return 'cap must be a number.'
+        return None
+
+    def save(self, *args, **kwargs):
+        if self.version is None:
+            last_version = self.competition.formulas.aggregate(models.Max('version'))['version__max']
+            self.version = (last_version or 0) + 1
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f'{self.competition} v{self.version}'
+
+
 class CompetitionTour(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['competition', 'start_date', 'end_date'], name='competition_tour_dates_idx'),
+        ]
+
     STATUSES = (
         ('expected', 'expected'),
         ('ongoing', 'ongoing'),
@@ -84,6 +172,9 @@ class FantasyTeam(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'competition'], name='competition and user unique'),
         ]
+        indexes = [
+            models.Index(fields=['competition', '-result'], name='fantasy_team_rating_idx'),
+        ]
 
     user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE,
                              related_name='fantasy_teams', null=True, blank=True)
@@ -126,6 +217,9 @@ class FantasyTeamTour(models.Model):
             models.UniqueConstraint(fields=['fantasy_team', 'competition_tour'],
                                     name='fantasy_team and competition_tour unique'),
         ]
+        indexes = [
+            models.Index(fields=['competition_tour', '-result'], name='fantasy_team_tour_rating_idx'),
+        ]
     fantasy_team = models.ForeignKey(to=FantasyTeam, on_delete=models.CASCADE, related_name='child_teams')
     competition_tour = models.ForeignKey(to=CompetitionTour,  on_delete=models.CASCADE,
                                          related_name='fantasy_teams', null=True, blank=True)
@@ -147,6 +241,11 @@ class FantasyTeamTour(models.Model):
 
 
 class FantasyPlayer(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['player', 'fantasy_team_tour'], name='fantasy_player_player_tour_idx'),
+        ]
+
     player = models.ForeignKey(to=Player, on_delete=models.SET_NULL,
                                null=True, blank=True)
     fantasy_team_tour = models.ForeignKey(to=FantasyTeamTour, on_delete=models.SET_NULL,
@@ -200,7 +299,23 @@ class MatchSeries(models.Model):
         return f'{self.dota_id} - {self.bo_format}'
 
 
+class MatchManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().defer('data')
+
+
 class Match(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['competition'], condition=models.Q(is_parsed=False), name='match_not_parsed_idx'),
+            models.Index(fields=['competition'], condition=models.Q(is_parsed=True, is_rated=False),
+                         name='match_not_rated_idx'),
+            models.Index(fields=['competition'], condition=models.Q(is_saved_to_players=False),
+                         name='match_not_saved_idx'),
+        ]
+
+    objects = MatchManager()
+
     dota_id = models.CharField(max_length=128, default='', unique=True)
     series = models.ForeignKey(to=MatchSeries, related_name='matches',
                                blank=True, null=True, on_delete=models.CASCADE)
@@ -249,11 +364,111 @@ class Match(models.Model):
         return (f"{self.get_competition_name()}/{self.get_competition_tour_name()}: "
                 f"{self.get_team_radiant_name()} - {self.get_team_dire_name()}")
 
+    @property
+    def payload(self):
+        if not hasattr(self, '_payload'):
+            try:
+                self._payload = self.raw_data.get_payload()
+            except MatchData.DoesNotExist:
+                self._payload = self.data
+        return self._payload
+
+    @payload.setter
+    def payload(self, value):
+        self._payload = value
+
     def __str__(self):
         return self.full_name
 
 
+class MatchData(models.Model):
+    match = models.OneToOneField(to=Match, on_delete=models.CASCADE, primary_key=True, related_name='raw_data')
+    payload = models.BinaryField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def get_payload(self):
+        return json.loads(zlib.decompress(self.payload))
+
+    @staticmethod
+    def compress(data):
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode(),
+                             settings.MATCH_PAYLOAD_COMPRESSION_LEVEL)
+
+    @classmethod
+    def store(cls, payloads, batch_size=100):
+        cls.objects.bulk_create(
+            [cls(match_id=match_id, payload=cls.compress(data)) for match_id, data in payloads.items()],
+            batch_size=batch_size, update_conflicts=True, unique_fields=['match'], update_fields=['payload'],
+        )
+
+    def __str__(self):
+        return f'{self.match_id}'
+
+
+class PlayerMatchStat(models.Model):
+    STAT_FIELDS = (
+        'kills', 'deaths', 'assists', 'last_hits', 'denies', 'hero_damage', 'tower_damage',
+        'camps_stacked', 'rune_pickups', 'obs_placed', 'sen_placed', 'observer_kills',
+        'sentry_kills', 'courier_kills', 'stuns', 'hero_healing', 'buyback_count',
+        'teamfight_participation',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['match', 'slot'], name='match and slot unique'),
+        ]
+
+    match = models.ForeignKey(to=Match, on_delete=models.CASCADE, related_name='player_stats')
+    slot = models.PositiveSmallIntegerField()
+    account_id = models.BigIntegerField(db_index=True)
+    hero_id = models.IntegerField(null=True, blank=True)
+    win = models.BooleanField(default=False)
+    kills = models.FloatField(null=True, blank=True)
+    deaths = models.FloatField(null=True, blank=True)
+    assists = models.FloatField(null=True, blank=True)
+    last_hits = models.FloatField(null=True, blank=True)
+    denies = models.FloatField(null=True, blank=True)
+    hero_damage = models.FloatField(null=True, blank=True)
+    tower_damage = models.FloatField(null=True, blank=True)
+    camps_stacked = models.FloatField(null=True, blank=True)
+    rune_pickups = models.FloatField(null=True, blank=True)
+    obs_placed = models.FloatField(null=True, blank=True)
+    sen_placed = models.FloatField(null=True, blank=True)
+    observer_kills = models.FloatField(null=True, blank=True)
+    sentry_kills = models.FloatField(null=True, blank=True)
+    courier_kills = models.FloatField(null=True, blank=True)
+    stuns = models.FloatField(null=True, blank=True)
+    hero_healing = models.FloatField(null=True, blank=True)
+    buyback_count = models.FloatField(null=True, blank=True)
+    teamfight_participation = models.FloatField(null=True, blank=True)
+
+    @classmethod
+    def from_player_data(cls, match_id, slot, player_data):
+        stats = {field: None if player_data.get(field) is None else float(player_data.get(field))
+                 for field in cls.STAT_FIELDS}
+        return cls(match_id=match_id, slot=slot, account_id=player_data['account_id'],
+                   hero_id=player_data.get('hero_id'), win=bool(player_data.get('win', 0)), **stats)
+
+    @classmethod
+    def store(cls, payloads, batch_size=1000):
+        stats = [cls.from_player_data(match_id, slot, player_data)
+                 for match_id, data in payloads.items()
+                 for slot, player_data in enumerate(data.get('players', []))
+                 if player_data.get('account_id')]
+        with transaction.atomic():
+            cls.objects.filter(match_id__in=payloads.keys()).delete()
+            cls.objects.bulk_create(stats, batch_size=batch_size)
+
+    def __str__(self):
+        return f'{self.account_id} - {self.match_id}'
+
+
 class PlayerMatchResult(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['player', 'match'], name='player and match unique'),
+        ]
+
     player = models.ForeignKey(to=Player, on_delete=models.CASCADE,
                                related_name='players_res', null=True, blank=True)
     match = models.ForeignKey(to=Match, on_delete=models.CASCADE,
@@ -264,6 +479,98 @@ class PlayerMatchResult(models.Model):
         return f'{self.player.nickname} - {self.match}'
 
 
+class RescoredMatchResult(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['formula', 'match'], name='formula and match unique'),
+        ]
+
+    formula = models.ForeignKey(to=CompetitionFormula, on_delete=models.CASCADE, related_name='rescored_results')
+    match = models.ForeignKey(to=Match, on_delete=models.CASCADE, related_name='rescored_results')
+    result_data = models.JSONField()
+
+
+class RescoredPlayerResult(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['formula', 'match', 'player'], name='formula, match and player unique'),
+        ]
+
+    formula = models.ForeignKey(to=CompetitionFormula, on_delete=models.CASCADE, related_name='rescored_players')
+    match = models.ForeignKey(to=Match, on_delete=models.CASCADE, related_name='rescored_players')
+    player = models.ForeignKey(to=Player, on_delete=models.CASCADE, related_name='rescored_results')
+    result = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+
+class PlayerResultChange(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['player', 'competition_tour'],
+                                    name='player and competition_tour unique'),
+        ]
+
+    player = models.ForeignKey(to=Player, on_delete=models.CASCADE, related_name='result_changes')
+    competition_tour = models.ForeignKey(to=CompetitionTour, on_delete=models.CASCADE, related_name='result_changes')
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.player} - {self.competition_tour}'
+
+
+class PipelineJob(models.Model):
+    ACTIVE_STATUSES = (PipelineJobStatusEnum.PENDING, PipelineJobStatusEnum.RUNNING)
+
+    class Meta:
+        ordering = ['-id']
+        constraints = [
+            models.UniqueConstraint(fields=['dedup_key'], condition=models.Q(status__in=['PENDING', 'RUNNING']),
+                                    name='active pipeline job unique'),
+        ]
+
+    kind = models.CharField(max_length=64, choices=PipelineJobKindEnum.choices())
+    args = models.JSONField(default=list)
+    dedup_key = models.CharField(max_length=64)
+    status = models.CharField(max_length=16, choices=PipelineJobStatusEnum.choices(),
+                              default=PipelineJobStatusEnum.PENDING.value)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_by = models.ForeignKey(to=CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def progress(self):
+        return round(self.processed / self.total * 100) if self.total else 100
+
+    def __str__(self):
+        return f'{self.kind} #{self.id}'
+
+
+class ProfilingConfig(models.Model):
+    is_enabled = models.BooleanField(default=False, help_text='Record SQL accounting and dump slow runs.')
+    profile_requests = models.BooleanField(default=False, help_text='cProfile every matching request.')
+    profile_tasks = models.BooleanField(default=False, help_text='cProfile every matching task.')
+    path_prefix = models.CharField(max_length=128, blank=True, default='')
+    task_names = models.CharField(max_length=512, blank=True, default='', help_text='Comma separated, empty for all.')
+    slow_threshold_ms = models.PositiveIntegerField(default=1000)
+    sampling_interval_ms = models.PositiveSmallIntegerField(default=10, help_text='Stack sampling for slow runs, '
+                                                                                   '0 disables it.')
+    updated = models.DateTimeField(auto_now=True)
+
+    def matches_path(self, path):
+        return path.startswith(self.path_prefix)
+
+    def matches_task(self, task_name):
+        names = [name.strip() for name in self.task_names.split(',') if name.strip()]
+        return not names or task_name in names
+
+    def __str__(self):
+        return 'Profiling'
+
+
 class IgnoreMatch(models.Model):
     dota_id = models.CharField(max_length=128, default='', unique=True)
 
@@ -0,0 +1,263 @@
+import cProfile
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+from fantasy.models import ProfilingConfig
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+VALUES_LIST = re.compile(r'VALUES (\((?:%s, )*%s\))(?:, \1)+')
+config_cache = {'expires': 0, 'value': None}
+task_sessions = {}
+
+
+def get_config():
+    if not settings.PROFILING_ENABLED:
+        return None
+    now = time.monotonic()
+    if now >= config_cache['expires']:
+        try:
+            config_cache['value'] = ProfilingConfig.objects.filter(is_enabled=True).first()
+        except DatabaseError:
+            config_cache['value'] = None
+        config_cache['expires'] = now + settings.PROFILING_CONFIG_TTL
+    return config_cache['value']
+
+
+def get_query_shape(sql):
+    return VALUES_LIST.sub(r'VALUES \1, ...', IN_LIST.sub('IN (...)', sql))
+
+
+class SqlRecorder:
+    def __init__(self):
+        self.count = 0
+        self.time = 0
+        self.shapes = defaultdict(lambda: [0, 0])
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.time += elapsed
+            shape = self.shapes[get_query_shape(sql)]
+            shape[0] += 1
+            shape[1] += elapsed
+
+    def get_top_shapes(self, limit):
+        shapes = sorted(self.shapes.items(), key=lambda item: (item[1][0], item[1][1]), reverse=True)[:limit]
+        return [{'sql': sql, 'count': count, 'time_ms': round(elapsed * 1000, 2)} for sql, (count, elapsed) in shapes]
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_filename}:{frame.f_code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def get_folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class ProfileSession:
+    def __init__(self, kind, name, profile=False, slow_threshold_ms=None, sampling_interval_ms=0):
+        self.kind = kind
+        self.name = name
+        self.profile = profile
+        self.slow_threshold_ms = slow_threshold_ms
+        self.sampling_interval_ms = sampling_interval_ms
+        self.sql = SqlRecorder()
+        self.profiler = None
+        self.sampler = None
+        self.duration = 0
+
+    @classmethod
+    def for_request(cls, request):
+        token = settings.PROFILING_TOKEN
+        if token and request.headers.get('X-Profile') == token:
+            return cls('request', f'{request.method} {request.path}', profile=True)
+        config = get_config()
+        if config is None or not config.matches_path(request.path):
+            return None
+        return cls('request', f'{request.method} {request.path}', config.profile_requests, config.slow_threshold_ms,
+                   config.sampling_interval_ms)
+
+    @classmethod
+    def for_task(cls, task):
+        config = get_config()
+        if config is None or not config.matches_task(task.name):
+            return None
+        return cls('task', task.name, config.profile_tasks, config.slow_threshold_ms, config.sampling_interval_ms)
+
+    def start(self):
+        self.exit_stack = ExitStack()
+        for connection in connections.all():
+            self.exit_stack.enter_context(connection.execute_wrapper(self.sql))
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.sampling_interval_ms:
+            self.sampler = StackSampler(threading.get_ident(), self.sampling_interval_ms / 1000)
+            self.sampler.start()
+        self.started = time.perf_counter()
+
+    def stop(self, outcome=None):
+        self.duration = time.perf_counter() - self.started
+        if self.profiler:
+            self.profiler.disable()
+        if self.sampler:
+            self.sampler.stop()
+        self.exit_stack.close()
+
+        is_slow = self.slow_threshold_ms is not None and self.duration * 1000 >= self.slow_threshold_ms
+        if self.profile or is_slow:
+            return self.dump(outcome)
+        return None
+
+    def get_summary(self, outcome):
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'outcome': outcome,
+            'created': timezone.now().isoformat(),
+            'duration_ms': round(self.duration * 1000, 2),
+            'sql_count': self.sql.count,
+            'sql_time_ms': round(self.sql.time * 1000, 2),
+            'repeated_queries': [shape for shape in self.sql.get_top_shapes(settings.PROFILING_TOP_QUERIES)
+                                 if shape['count'] >= settings.PROFILING_REPEAT_THRESHOLD],
+            'top_queries': self.sql.get_top_shapes(settings.PROFILING_TOP_QUERIES),
+        }
+
+    def dump(self, outcome):
+        profile_id = f'{timezone.now():%Y%m%d-%H%M%S}-{self.kind}-{uuid.uuid4().hex[:8]}'
+        path = os.path.join(settings.PROFILING_DIR, profile_id)
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        summary = self.get_summary(outcome)
+        with open(f'{path}.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+        if self.profiler:
+            self.profiler.dump_stats(f'{path}.prof')
+        if self.sampler:
+            with open(f'{path}.folded', 'w') as f:
+                f.write(self.sampler.get_folded())
+        prune_profiles()
+        logger.info('profile stored', extra={'profile_id': profile_id, 'target': self.name,
+                                             'duration_ms': summary['duration_ms'], 'sql_count': summary['sql_count'],
+                                             'sql_time_ms': summary['sql_time_ms']})
+        return profile_id
+
+    def get_server_timing(self):
+        return (f'sql;desc="{self.sql.count} queries";dur={self.sql.time * 1000:.1f}, '
+                f'total;dur={self.duration * 1000:.1f}')
+
+
+def get_profile_ids():
+    if not os.path.isdir(settings.PROFILING_DIR):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(settings.PROFILING_DIR) if name.endswith('.json'))
+
+
+def prune_profiles():
+    profile_ids = get_profile_ids()
+    for profile_id in profile_ids[:-settings.PROFILING_MAX_PROFILES]:
+        for extension in ('.json', '.prof', '.folded'):
+            try:
+                os.remove(os.path.join(settings.PROFILING_DIR, f'{profile_id}{extension}'))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        session = ProfileSession.for_request(request)
+        if session is None:
+            return self.get_response(request)
+
+        session.start()
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            profile_id = session.stop(response.status_code if response is not None else 'error')
+        return self.add_headers(response, session, profile_id)
+
+    async def __acall__(self, request):
+        session = None
+        if settings.PROFILING_ENABLED or settings.PROFILING_TOKEN:
+            session = await sync_to_async(ProfileSession.for_request)(request)
+        if session is None:
+            return await self.get_response(request)
+
+        # async ORM queries run in worker threads, so only the request duration is measured here
+        session.start()
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile_id = session.stop(response.status_code if response is not None else 'error')
+        return self.add_headers(response, session, profile_id)
+
+    @staticmethod
+    def add_headers(response, session, profile_id):
+        response['Server-Timing'] = session.get_server_timing()
+        if profile_id:
+            response['X-Profile-Id'] = profile_id
+        return response
+
+
+@task_prerun.connect
+def start_task_profiling(task_id=None, task=None, **kwargs):
+    session = ProfileSession.for_task(task)
+    if session is not None:
+        session.start()
+        task_sessions[task_id] = session
+
+
+@task_postrun.connect
+def stop_task_profiling(task_id=None, state=None, **kwargs):
+    session = task_sessions.pop(task_id, None)
+    if session is not None:
+        session.stop(state)
@@ -0,0 +1,102 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import django
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from fantasy.models import (Competition, CompetitionFormula, CompetitionTour, Match, Player, PlayerMatchResult,
+                            RescoredMatchResult, RescoredPlayerResult)
+from fantasy.results import BATCH_SIZE, update_tour_fantasy_results
+from fantasy.scoring import ScoringEngine
+from fantasy.tasks import chunked, extract_player_match_stats
+
+
+def rescore_competition(formula_id, workers=None, chunk_size=None):
+    formula = CompetitionFormula.objects.select_related('competition').get(id=formula_id)
+    formula.clean()
+    workers = workers or settings.RESCORE_WORKERS
+    chunk_size = chunk_size or settings.RESCORE_CHUNK_SIZE
+
+    match_ids = list(Match.objects.filter(competition_id=formula.competition_id, is_parsed=True)
+                     .values_list('id', flat=True))
+    extract_player_match_stats(match_ids)
+    RescoredMatchResult.objects.filter(formula=formula).delete()
+    RescoredPlayerResult.objects.filter(formula=formula).delete()
+
+    chunks = list(chunked(match_ids, chunk_size))
+    if workers > 1 and len(chunks) > 1 and not multiprocessing.current_process().daemon:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as executor:
+            rescored_count = sum(executor.map(rescore_matches, repeat(formula.id), chunks))
+    else:
+        rescored_count = sum(map(rescore_matches, repeat(formula.id), chunks))
+
+    switch_formula(formula)
+    return rescored_count
+
+
+def rescore_matches(formula_id, match_ids):
+    formula = CompetitionFormula.objects.only('formula').get(id=formula_id)
+    results = ScoringEngine(formula.formula).score_match_stats(match_ids)
+    players = dict(Player.objects.filter(dota_id__in={str(account_id) for result_data in results.values()
+                                                      for account_id in result_data})
+                   .values_list('dota_id', 'id'))
+
+    RescoredMatchResult.objects.bulk_create(
+        [RescoredMatchResult(formula_id=formula_id, match_id=match_id, result_data=result_data)
+         for match_id, result_data in results.items()],
+        batch_size=BATCH_SIZE,
+    )
+    RescoredPlayerResult.objects.bulk_create(
+        [RescoredPlayerResult(formula_id=formula_id, match_id=match_id, player_id=players[str(account_id)],
+                              result=result.get('TOTAL', 0))
+         for match_id, result_data in results.items()
+         for account_id, result in result_data.items() if str(account_id) in players],
+        batch_size=BATCH_SIZE,
+    )
+    return len(results)
+
+
+def switch_formula(formula):
+    rescored_matches = RescoredMatchResult.objects.filter(formula=formula)
+    rescored_players = RescoredPlayerResult.objects.filter(formula=formula)
+    with transaction.atomic():
+        Competition.objects.select_for_update().get(id=formula.competition_id)
+        missed_match_ids = list(Match.objects.filter(competition_id=formula.competition_id, is_rated=True)
+                                .exclude(Exists(rescored_matches.filter(match=OuterRef('pk'))))
+                                .values_list('id', flat=True))
+        if missed_match_ids:
+            extract_player_match_stats(missed_match_ids)
+            rescore_matches(formula.id, missed_match_ids)
+
+        Match.objects.filter(rescored_results__formula=formula).update(
+            result_data=Subquery(rescored_matches.filter(match=OuterRef('pk')).values('result_data')[:1]),
+            is_rated=True,
+        )
+
+        saved_match_ids = rescored_matches.filter(match__is_saved_to_players=True).values('match_id')
+        player_results = PlayerMatchResult.objects.filter(match_id__in=saved_match_ids)
+        player_results.filter(~Exists(rescored_players.filter(match=OuterRef('match'), player=OuterRef('player')))) \
+            .delete()
+        player_results.update(result=Subquery(rescored_players.filter(match=OuterRef('match'), player=OuterRef('player'))
+                                              .values('result')[:1]))
+        PlayerMatchResult.objects.bulk_create(
+            [PlayerMatchResult(match_id=match_id, player_id=player_id, result=result)
+             for match_id, player_id, result in rescored_players.filter(match_id__in=saved_match_ids)
+             .exclude(Exists(PlayerMatchResult.objects.filter(match=OuterRef('match'), player=OuterRef('player'))))
+             .values_list('match_id', 'player_id', 'result')],
+            batch_size=BATCH_SIZE,
+        )
+
+        CompetitionFormula.objects.filter(competition_id=formula.competition_id).exclude(id=formula.id) \
+            .update(is_active=False)
+        CompetitionFormula.objects.filter(id=formula.id).update(is_active=True)
+
+        for tour_id in CompetitionTour.objects.filter(competition_id=formula.competition_id) \
+                .values_list('id', flat=True):
+            update_tour_fantasy_results(tour_id)
+        rescored_matches.delete()
+        rescored_players.delete()
@@ -0,0 +1,119 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from core import metrics
+from fantasy.constants import MatchSeriesBOFormatEnum
+from fantasy.leaderboards import get_competition_leaderboard, get_tour_leaderboard, update_leaderboards
+from fantasy.models import (FantasyPlayer, FantasyTeam, FantasyTeamTour, Match, MatchSeries, PlayerMatchResult,
+                            PlayerResultChange)
+
+BATCH_SIZE = 1000
+
+
+def normalize_series_result(series_result, bo_format, match_count):
+    if bo_format == MatchSeriesBOFormatEnum.BO3 and match_count == 3:
+        return series_result / 3 * 2
+    if bo_format == MatchSeriesBOFormatEnum.BO5 and match_count <= 3:
+        return series_result / match_count * 3
+    return series_result
+
+
+def get_players_tour_results(tour_id, player_ids):
+    played_series = set(PlayerMatchResult.objects
+                        .filter(match__competition_tour_id=tour_id, match__series__isnull=False,
+                                player_id__in=player_ids)
+                        .values_list('player_id', 'match__series_id').distinct())
+    series_ids = {series_id for _, series_id in played_series}
+
+    series_formats = {series_id: (bo_format, match_count) for series_id, bo_format, match_count in
+                      MatchSeries.objects.filter(id__in=series_ids).annotate(match_count=Count('matches'))
+                      .values_list('id', 'bo_format', 'match_count')}
+    series_results = {(player_id, series_id): total for player_id, series_id, total in
+                      PlayerMatchResult.objects.filter(match__series_id__in=series_ids, player_id__in=player_ids)
+                      .values_list('player_id', 'match__series_id').annotate(total=Sum('result'))}
+
+    results = defaultdict(int)
+    for player_id, series_id in sorted(played_series, key=lambda pair: pair[1]):
+        bo_format, match_count = series_formats[series_id]
+        results[player_id] += normalize_series_result(series_results[(player_id, series_id)], bo_format, match_count)
+    return results
+
+
+def update_tour_fantasy_results(tour_id, player_ids=None):
+    fantasy_players = FantasyPlayer.objects.filter(fantasy_team_tour__competition_tour_id=tour_id,
+                                                   player__isnull=False)
+    if player_ids is not None:
+        fantasy_players = fantasy_players.filter(player_id__in=player_ids)
+
+    with transaction.atomic():
+        fantasy_players = list(fantasy_players.only('id', 'player', 'fantasy_team_tour'))
+        results = get_players_tour_results(tour_id, {fan_player.player_id for fan_player in fantasy_players})
+        for fan_player in fantasy_players:
+            fan_player.result = results.get(fan_player.player_id) or 0
+        FantasyPlayer.objects.bulk_update(fantasy_players, ['result'], batch_size=BATCH_SIZE)
+
+        if player_ids is None:
+            fan_team_tour_ids = FantasyTeamTour.objects.filter(competition_tour_id=tour_id).values_list('id', flat=True)
+        else:
+            fan_team_tour_ids = {fan_player.fantasy_team_tour_id for fan_player in fantasy_players}
+        fan_team_ids = update_fantasy_team_tours_results(fan_team_tour_ids)
+        update_fantasy_teams_results(fan_team_ids)
+
+
+def update_fantasy_team_tours_results(fan_team_tour_ids):
+    fan_team_tours = list(FantasyTeamTour.objects.filter(id__in=fan_team_tour_ids)
+                          .only('id', 'fantasy_team', 'competition_tour'))
+    totals = dict(FantasyPlayer.objects.filter(fantasy_team_tour_id__in=[obj.id for obj in fan_team_tours])
+                  .values_list('fantasy_team_tour_id').annotate(total=Sum('result')).order_by())
+    leaderboards_results = defaultdict(dict)
+    for fan_team_tour in fan_team_tours:
+        fan_team_tour.result = totals.get(fan_team_tour.id) or 0
+        leaderboards_results[fan_team_tour.competition_tour_id][fan_team_tour.id] = fan_team_tour.result
+    FantasyTeamTour.objects.bulk_update(fan_team_tours, ['result'], batch_size=BATCH_SIZE)
+    transaction.on_commit(lambda: update_leaderboards(get_tour_leaderboard, leaderboards_results))
+    return {fan_team_tour.fantasy_team_id for fan_team_tour in fan_team_tours}
+
+
+def update_fantasy_teams_results(fan_team_ids):
+    fan_teams = list(FantasyTeam.objects.filter(id__in=fan_team_ids).only('id', 'competition'))
+    totals = dict(FantasyTeamTour.objects.filter(fantasy_team_id__in=fan_team_ids)
+                  .values_list('fantasy_team_id').annotate(total=Sum('result')).order_by())
+    leaderboards_results = defaultdict(dict)
+    for fan_team in fan_teams:
+        fan_team.result = totals.get(fan_team.id) or 0
+        leaderboards_results[fan_team.competition_id][fan_team.id] = fan_team.result
+    FantasyTeam.objects.bulk_update(fan_teams, ['result'], batch_size=BATCH_SIZE)
+    transaction.on_commit(lambda: update_leaderboards(get_competition_leaderboard, leaderboards_results))
+    return fan_teams
+
+
+def record_results_changes(match_ids):
+    series_ids = Match.objects.filter(id__in=match_ids, series__isnull=False).values('series_id')
+    changes = (PlayerMatchResult.objects
+               .filter(match__series_id__in=series_ids, match__competition_tour__isnull=False)
+               .values_list('player_id', 'match__competition_tour_id').distinct())
+    PlayerResultChange.objects.bulk_create(
+        [PlayerResultChange(player_id=player_id, competition_tour_id=tour_id) for player_id, tour_id in changes],
+        batch_size=BATCH_SIZE, update_conflicts=True, unique_fields=['player', 'competition_tour'],
+        update_fields=['updated'],
+    )
+
+
+@metrics.stage('propagate_results_changes')
+def propagate_results_changes():
+    with transaction.atomic():
+        changes = list(PlayerResultChange.objects.select_for_update(skip_locked=True)
+                       .values_list('id', 'player_id', 'competition_tour_id', 'updated'))
+        tours_players = defaultdict(set)
+        for _, player_id, tour_id, _ in changes:
+            tours_players[tour_id].add(player_id)
+
+        for tour_id, player_ids in tours_players.items():
+            update_tour_fantasy_results(tour_id, player_ids)
+        if changes:
+            PlayerResultChange.objects.filter(id__in=[change_id for change_id, _, _, _ in changes],
+                                              updated__lte=max(updated for _, _, _, updated in changes)).delete()
+    metrics.inc('fantasy_pipeline_items_total', len(changes), stage='propagate_results_changes')
+    return len(changes)
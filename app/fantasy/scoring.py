@@ -0,0 +1,151 @@
+import math
+
+import numpy as np
+from django.conf import settings
+
+from fantasy.constants import GameRoleEnum
+from fantasy.models import CompetitionFormula, Player, PlayerMatchStat
+
+ROLES = CompetitionFormula.FORMULA_ROLES
+CORE_ROLES = (GameRoleEnum.CARRY, GameRoleEnum.MID, GameRoleEnum.HARD)
+
+
+def get_role_index(game_role):
+    return 0 if game_role in CORE_ROLES else 1
+
+
+def round_2(values):
+    # np.round differs from round() only next to a .5 boundary, resolve those in python
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-9 * np.maximum(1, np.abs(scaled))
+    if near_half.any():
+        rounded[near_half] = [round(value, 2) for value in values[near_half].tolist()]
+    return rounded
+
+
+class ScoringFormula:
+    def __init__(self, formula):
+        self.actions = list(formula.keys())
+        self.coefs = np.zeros((len(ROLES), len(self.actions)))
+        self.caps = np.full(len(self.actions), np.inf)
+        self.cap_values = []
+        self.default_results = []
+
+        for j, (action, details) in enumerate(formula.items()):
+            sign = {'+': 1, '-': -1}.get(details['type'], 0)
+            for i, role in enumerate(ROLES):
+                self.coefs[i, j] = sign * details.get('coef', {}).get(role, 0)
+            if details.get('cap') is not None:
+                self.caps[j] = details['cap']
+            self.cap_values.append(details.get('cap'))
+
+        # results of actions missing from player data (or with unknown type), as the python formula gives them
+        for role in ROLES:
+            role_results = []
+            for details in formula.values():
+                coef = details.get('coef', {}).get(role, 0)
+                action_res = {'+': round(coef * 0, 2), '-': round(coef * -0, 2)}.get(details['type'], 0)
+                if details.get('cap') is not None and action_res > details['cap']:
+                    action_res = details['cap']
+                role_results.append(action_res)
+            self.default_results.append(role_results)
+        self.known_types = np.array([details['type'] in ('+', '-') for details in formula.values()])
+
+    def extract_stats(self, players_data):
+        stats = np.full((len(players_data), len(self.actions)), np.nan)
+        for i, player_data in enumerate(players_data):
+            stats[i] = [math.nan if player_data.get(action) is None else float(player_data.get(action))
+                        for action in self.actions]
+        return stats
+
+    def score(self, stats, role_indexes, wins):
+        missing = np.isnan(stats) | ~self.known_types
+        action_results = round_2(self.coefs[role_indexes] * np.where(missing, 0.0, stats))
+        capped = action_results > self.caps
+        action_results = np.where(capped, self.caps, action_results)
+
+        totals = np.zeros(len(stats))
+        for j in range(len(self.actions)):
+            totals += np.where(missing[:, j], 0.0, action_results[:, j])
+
+        win_bonuses = round_2(np.abs(totals) * 0.1)
+        totals = round_2(np.where(wins, totals + np.abs(totals) * 0.1, totals))
+        return action_results, missing, capped, win_bonuses, totals
+
+
+class ScoringEngine:
+    def __init__(self, formula=None):
+        self.formula = ScoringFormula(formula or settings.FANTASY_FORMULA)
+
+    @staticmethod
+    def get_players_map(account_ids):
+        players = Player.objects.filter(dota_id__in=[str(account_id) for account_id in account_ids])
+        return {dota_id: (nickname, game_role)
+                for dota_id, nickname, game_role in players.values_list('dota_id', 'nickname', 'game_role')}
+
+    def score_matches(self, matches_data):
+        rows = []
+        for match_index, match_data in enumerate(matches_data):
+            for player_data in match_data.get('players', []):
+                if player_data.get('account_id'):
+                    rows.append((match_index, player_data))
+
+        account_ids = [player_data['account_id'] for _, player_data in rows]
+        wins = [bool(player_data.get('win', 0)) for _, player_data in rows]
+        rows_results = self.score_rows(account_ids, wins, lambda indexes: self.formula.extract_stats(
+            [rows[k][1] for k in indexes]))
+
+        results = [{} for _ in matches_data]
+        for (match_index, _), account_id, row_result in zip(rows, account_ids, rows_results):
+            results[match_index][account_id] = row_result
+        return results
+
+    def score_match_stats(self, match_ids):
+        fields = [action for action in self.formula.actions if action in PlayerMatchStat.STAT_FIELDS]
+        rows = list(PlayerMatchStat.objects.filter(match_id__in=match_ids).order_by('match_id', 'slot')
+                    .values_list('match_id', 'account_id', 'win', *fields))
+        columns = [self.formula.actions.index(field) for field in fields]
+
+        def get_stats(indexes):
+            stats = np.full((len(indexes), len(self.formula.actions)), np.nan)
+            if indexes and fields:
+                stats[:, columns] = np.array([rows[k][3:] for k in indexes], dtype=float)
+            return stats
+
+        rows_results = self.score_rows([row[1] for row in rows], [row[2] for row in rows], get_stats)
+
+        results = {match_id: {} for match_id in match_ids}
+        for row, row_result in zip(rows, rows_results):
+            results[row[0]][row[1]] = row_result
+        return results
+
+    def score_rows(self, account_ids, wins, get_stats):
+        players_map = self.get_players_map(set(account_ids))
+        scored_rows = [k for k, account_id in enumerate(account_ids) if str(account_id) in players_map]
+        players_info = [players_map[str(account_ids[k])] for k in scored_rows]
+        role_indexes = np.array([get_role_index(game_role) for _, game_role in players_info], dtype=int)
+        wins = np.array([wins[k] for k in scored_rows], dtype=bool)
+
+        action_results, missing, capped, win_bonuses, totals = self.formula.score(
+            get_stats(scored_rows), role_indexes, wins)
+
+        rows_results = [{} for _ in account_ids]
+        for n, k in enumerate(scored_rows):
+            rows_results[k] = self.build_result_dict(
+                players_info[n][0], role_indexes[n], action_results[n].tolist(), missing[n].tolist(),
+                capped[n].tolist(), float(win_bonuses[n]) if wins[n] else 0, float(totals[n]))
+        return rows_results
+
+    def build_result_dict(self, nickname, role_index, action_results, missing, capped, win_bonus, total):
+        result_dict = {'NICKNAME': nickname, 'TOTAL': total}
+        default_results = self.formula.default_results[role_index]
+        for j, action in enumerate(self.formula.actions):
+            if missing[j]:
+                result_dict[action] = default_results[j]
+            elif capped[j]:
+                result_dict[action] = self.formula.cap_values[j]
+            else:
+                result_dict[action] = action_results[j]
+        result_dict['win_bonus'] = win_bonus
+        return result_dict
@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django_redis import get_redis_connection
+from rest_framework.authtoken.models import Token
+
+from api.caching import bump_versions, get_token_cache_key
+from fantasy.leaderboards import get_competition_leaderboard, get_tour_leaderboard
+from fantasy.models import AppScreenInfo, Competition, CompetitionTour, FantasyTeam, FantasyTeamTour, Player, Team
+from users.models import CustomUser
+
+
+@receiver(post_save, sender=FantasyTeam)
+def update_competition_leaderboard(sender, instance, **kwargs):
+    if instance.competition_id:
+        transaction.on_commit(
+            lambda: get_competition_leaderboard(instance.competition_id).update({instance.id: instance.result}))
+
+
+@receiver(post_delete, sender=FantasyTeam)
+def remove_from_competition_leaderboard(sender, instance, **kwargs):
+    if instance.competition_id:
+        transaction.on_commit(lambda: get_competition_leaderboard(instance.competition_id).remove(instance.id))
+
+
+@receiver(post_save, sender=FantasyTeamTour)
+def update_tour_leaderboard(sender, instance, **kwargs):
+    if instance.competition_tour_id:
+        transaction.on_commit(
+            lambda: get_tour_leaderboard(instance.competition_tour_id).update({instance.id: instance.result}))
+
+
+@receiver(post_delete, sender=FantasyTeamTour)
+def remove_from_tour_leaderboard(sender, instance, **kwargs):
+    if instance.competition_tour_id:
+        transaction.on_commit(lambda: get_tour_leaderboard(instance.competition_tour_id).remove(instance.id))
+
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+@receiver(post_save, sender=Competition)
+@receiver(post_delete, sender=Competition)
+@receiver(post_save, sender=CompetitionTour)
+@receiver(post_delete, sender=CompetitionTour)
+@receiver(post_save, sender=AppScreenInfo)
+@receiver(post_delete, sender=AppScreenInfo)
+def bump_cache_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_versions(sender))
+
+
+@receiver(m2m_changed, sender=Competition.team.through)
+def bump_competition_teams_cache_version(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: bump_versions(Competition))
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    get_redis_connection('default').delete(get_token_cache_key(instance.key))
+
+
+@receiver(post_save, sender=CustomUser)
+def forget_inactive_user_tokens(sender, instance, **kwargs):
+    if not instance.is_active:
+        keys = [get_token_cache_key(key) for key in Token.objects.filter(user=instance).values_list('key', flat=True)]
+        if keys:
+            get_redis_connection('default').delete(*keys)
@@ -0,0 +1,222 @@
+import json
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.response_cache import ResponseCache
+from fantasy.constants import CompetitionStatusEnum, GameRoleEnum
+from fantasy.models import (Competition, CompetitionTour, FantasyPlayer, FantasyTeam, FantasyTeamTour, Player, Team)
+from users.models import CustomUser
+
+SYNTHETIC_PREFIX = 'synthetic'
+SYNTHETIC_DOTA_ID_BASE = 9000000000
+CORE_ROLES = [GameRoleEnum.CARRY, GameRoleEnum.MID, GameRoleEnum.HARD]
+STAT_RANGES = {
+    'kills': (0, 20),
+    'deaths': (0, 12),
+    'assists': (0, 30),
+    'last_hits': (10, 700),
+    'denies': (0, 30),
+    'hero_damage': (2000, 60000),
+    'tower_damage': (0, 15000),
+    'camps_stacked': (0, 10),
+    'rune_pickups': (0, 20),
+    'obs_placed': (0, 20),
+    'sen_placed': (0, 25),
+    'observer_kills': (0, 6),
+    'sentry_kills': (0, 8),
+    'courier_kills': (0, 2),
+    'hero_healing': (0, 10000),
+    'buyback_count': (0, 2),
+}
+SERIES_MATCHES = {0: (1, 1), 1: (2, 3), 2: (3, 5)}
+LEAGUE_MATCH_FIELDS = ['match_id', 'start_time', 'duration', 'radiant_win', 'leagueid', 'series_id', 'series_type',
+                       'radiant_team_id', 'dire_team_id']
+
+
+def build_player_data(rnd, account_id, is_core, slot, is_radiant, win, duration):
+    minutes = duration // 60 + 1
+    data = {
+        'account_id': account_id,
+        'player_slot': slot if is_radiant else 123 + slot,
+        'isRadiant': is_radiant,
+        'win': int(win),
+        'hero_id': rnd.randint(1, 138),
+        'gold_t': sorted(rnd.randint(0, 40000) for _ in range(minutes)),
+        'xp_t': sorted(rnd.randint(0, 40000) for _ in range(minutes)),
+        'lh_t': sorted(rnd.randint(0, 700) for _ in range(minutes)),
+    }
+    for action in settings.FANTASY_FORMULA:
+        low, high = STAT_RANGES.get(action, (0, 10))
+        if action == 'last_hits' and not is_core:
+            high //= 5
+        data[action] = rnd.randint(low, high)
+    data['stuns'] = round(rnd.uniform(0, 60), 3)
+    data['teamfight_participation'] = round(rnd.random(), 3)
+    return data
+
+
+def build_match_data(rnd, match_id, league_id, series_id, series_type, radiant, dire, start_time):
+    duration = rnd.randint(20 * 60, 60 * 60)
+    radiant_win = rnd.random() < 0.5
+    players = []
+    for slot, ((_, lineup), is_radiant) in enumerate([(radiant, True)] * 5 + [(dire, False)] * 5):
+        account_id, is_core = lineup[slot % 5]
+        players.append(build_player_data(rnd, account_id, is_core, slot, is_radiant, is_radiant == radiant_win,
+                                         duration))
+    return {
+        'match_id': match_id,
+        'start_time': start_time,
+        'duration': duration,
+        'radiant_win': radiant_win,
+        'leagueid': league_id,
+        'series_id': series_id,
+        'series_type': series_type,
+        'radiant_team_id': radiant[0],
+        'dire_team_id': dire[0],
+        'version': 21,
+        'players': players,
+    }
+
+
+def get_league_match(match_data):
+    return {key: match_data[key] for key in LEAGUE_MATCH_FIELDS}
+
+
+def get_synthetic_competitions():
+    return Competition.objects.filter(name__startswith=SYNTHETIC_PREFIX)
+
+
+def get_default_cache_dir():
+    return str(settings.BASE_DIR / 'cache' / 'synthetic')
+
+
+def clear_dataset():
+    get_synthetic_competitions().delete()
+    Player.objects.filter(nickname__startswith=SYNTHETIC_PREFIX).delete()
+    Team.objects.filter(name__startswith=SYNTHETIC_PREFIX).delete()
+    CustomUser.objects.filter(username__startswith=SYNTHETIC_PREFIX).delete()
+
+
+class DatasetGenerator:
+    def __init__(self, competitions=1, tours=4, teams=16, series=8, users=1000, seed=0, cache_dir=None,
+                 batch_size=1000):
+        self.competitions = competitions
+        self.tours = tours
+        self.teams = teams
+        self.series = series
+        self.users = users
+        self.random = random.Random(seed)
+        self.cache = ResponseCache(cache_dir or get_default_cache_dir(), settings.OPENDOTA_CACHE_MAX_SIZE,
+                                   evict_every=10 ** 9)
+        self.batch_size = batch_size
+        self.next_dota_id = SYNTHETIC_DOTA_ID_BASE
+        self.counts = {'competitions': 0, 'tours': 0, 'teams': 0, 'players': 0, 'series': 0, 'matches': 0,
+                       'users': 0, 'fantasy_players': 0}
+
+    def get_dota_id(self):
+        self.next_dota_id += 1
+        return self.next_dota_id
+
+    def generate(self):
+        teams = self.create_teams()
+        users = self.create_users()
+        for n in range(1, self.competitions + 1):
+            competition = Competition.objects.create(name=f'{SYNTHETIC_PREFIX} {n}', dota_id=str(self.get_dota_id()),
+                                                     status=CompetitionStatusEnum.STARTED)
+            competition.team.set(teams)
+            tours = self.create_tours(competition)
+            self.prime_league(competition, tours, teams)
+            self.create_lineups(competition, tours, users)
+            self.counts['competitions'] += 1
+        return self.counts
+
+    def create_teams(self):
+        teams = Team.objects.bulk_create([
+            Team(name=f'{SYNTHETIC_PREFIX} {n}', short_name=f'S{n}', dota_id=str(self.get_dota_id()))
+            for n in range(1, self.teams + 1)
+        ])
+        players = Player.objects.bulk_create([
+            Player(nickname=f'{SYNTHETIC_PREFIX} {team.short_name}.{role.value}', team=team, game_role=role,
+                   cost=self.random.choice(range(5, 16)), dota_id=str(self.get_dota_id()))
+            for team in teams for role in GameRoleEnum
+        ], batch_size=self.batch_size)
+        self.counts['teams'] += len(teams)
+        self.counts['players'] += len(players)
+        self.players = {team.id: [player for player in players if player.team_id == team.id] for team in teams}
+        return teams
+
+    def create_users(self):
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'{SYNTHETIC_PREFIX}_{n}', email=f'{SYNTHETIC_PREFIX}_{n}@example.com',
+                       password='!')
+            for n in range(1, self.users + 1)
+        ], batch_size=self.batch_size)
+        self.counts['users'] += len(users)
+        return users
+
+    def create_tours(self, competition):
+        now = timezone.now()
+        first_start = now - timedelta(days=7 * (self.tours - 1) + 3)
+        tours = []
+        for n in range(self.tours):
+            start_date = first_start + timedelta(days=7 * n)
+            end_date = start_date + timedelta(days=7) - timedelta(seconds=1)
+            tours.append(CompetitionTour(
+                competition=competition, name=f'Tour {n + 1}', start_date=start_date, end_date=end_date,
+                status='ongoing' if start_date <= now <= end_date else 'finished',
+                editing_start=start_date - timedelta(days=1), editing_end=start_date,
+            ))
+        tours = CompetitionTour.objects.bulk_create(tours)
+        competition.active_tour = tours[-1]
+        competition.date_start = tours[0].start_date.date()
+        competition.date_finish = tours[-1].end_date.date()
+        competition.save()
+        self.counts['tours'] += len(tours)
+        return tours
+
+    def prime_league(self, competition, tours, teams):
+        now = timezone.now()
+        league_matches = []
+        for tour in tours:
+            start_time = int(tour.start_date.timestamp())
+            end_time = int(min(tour.end_date, now).timestamp())
+            for _ in range(self.series):
+                series_id = self.get_dota_id()
+                series_type = self.random.choice(list(SERIES_MATCHES))
+                radiant, dire = self.random.sample(teams, 2)
+                series_start = self.random.randint(start_time, max(start_time, end_time - 5 * 3600))
+                for game in range(self.random.randint(*SERIES_MATCHES[series_type])):
+                    match = build_match_data(self.random, self.get_dota_id(), int(competition.dota_id), series_id,
+                                             series_type, self.get_lineup(radiant), self.get_lineup(dire),
+                                             series_start + game * 3600)
+                    self.cache.put(f'{settings.OPENDOTA_API_URL}matches/{match["match_id"]}',
+                                   json.dumps(match).encode())
+                    league_matches.append(get_league_match(match))
+                self.counts['series'] += 1
+        self.cache.put(f'{settings.OPENDOTA_API_URL}leagues/{competition.dota_id}/matches',
+                       json.dumps(league_matches).encode())
+        self.counts['matches'] += len(league_matches)
+
+    def get_lineup(self, team):
+        return int(team.dota_id), [(int(player.dota_id), player.game_role in CORE_ROLES)
+                                   for player in self.players[team.id]]
+
+    def create_lineups(self, competition, tours, users):
+        players_by_role = {role: [player for players in self.players.values() for player in players
+                                  if player.game_role == role] for role in GameRoleEnum}
+        fantasy_teams = FantasyTeam.objects.bulk_create([
+            FantasyTeam(user=user, competition=competition, name_extended=f'{user.username} {competition.dota_id}')
+            for user in users
+        ], batch_size=self.batch_size)
+        for tour in tours:
+            fantasy_team_tours = FantasyTeamTour.objects.bulk_create([
+                FantasyTeamTour(fantasy_team=fantasy_team, competition_tour=tour) for fantasy_team in fantasy_teams
+            ], batch_size=self.batch_size)
+            fantasy_players = FantasyPlayer.objects.bulk_create([
+                FantasyPlayer(fantasy_team_tour=fantasy_team_tour, player=self.random.choice(players_by_role[role]))
+                for fantasy_team_tour in fantasy_team_tours for role in GameRoleEnum
+            ], batch_size=self.batch_size)
+            self.counts['fantasy_players'] += len(fantasy_players)
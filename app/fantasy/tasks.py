@@ -1,118 +1,244 @@
+import logging
 import random
-import time
-from datetime import datetime
+from collections import defaultdict
+from datetime import datetime, timedelta
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
 
-from celery import shared_task
-from api.connectors import DotaApiConnector
+from celery import chain, shared_task
+from api.connectors import ApiRetryError, DotaApiConnector, RetryPolicy
+from core import metrics
 from core.celery_app import app
 from fantasy.constants import CompetitionStatusEnum, GameRoleEnum, MatchSeriesBOFormatEnum
 from fantasy.models import (Competition, Match, Player, PlayerMatchResult, CompetitionTour, MatchSeries, Team,
-                            IgnoreMatch)
+                            IgnoreMatch, MatchData, PlayerMatchStat, CompetitionFormula)
+from fantasy.results import update_tour_fantasy_results, record_results_changes, propagate_results_changes
+from fantasy.scoring import ScoringEngine
 
+logger = logging.getLogger(__name__)
 api_connector = DotaApiConnector()
+retry_policy = RetryPolicy()
 
 
 @shared_task(name='1. Збір та групування матчів.')
 def competitions_parse_match_ids_celery_task():
-    print('--- START competitions_parse_match_ids_task')
     obj_ids = Competition.objects.filter(status=CompetitionStatusEnum.STARTED).values_list('dota_id', flat=True)
-    print(f'В обробку йде: {obj_ids.count()} ліг.')
-    competitions_parse_match_ids(obj_ids)
-    print('--- END competitions_parse_match_ids_task')
+    logger.info('В обробку йдуть ліги.',
+                extra={'task': 'competitions_parse_match_ids', 'competitions': obj_ids.count()})
+    match_dota_ids = competitions_parse_match_ids(obj_ids)
+    logger.info('Знайдено нові матчі.', extra={'task': 'competitions_parse_match_ids', 'matches': len(match_dota_ids),
+                                              'started': start_matches_pipeline(match_dota_ids)})
+
+
+@shared_task(name='0. Контроль обробки матчів.')
+def sweep_matches_pipeline_celery_task():
+    obj_ids = Match.objects.filter(competition__status=CompetitionStatusEnum.STARTED,
+                                   is_saved_to_players=False).values_list('dota_id', flat=True)
+    logger.info('Перевірено незавершені матчі.', extra={'task': 'sweep_matches_pipeline', 'matches': obj_ids.count(),
+                                                       'started': start_matches_pipeline(obj_ids)})
+    propagate_results_changes_celery_task.delay()
+
+
+@shared_task(name='2.1. Парсинг матчу.', bind=True, max_retries=settings.PIPELINE_FETCH_MAX_RETRIES,
+             default_retry_delay=settings.PIPELINE_FETCH_RETRY_DELAY)
+def fetch_match_celery_task(self, match_dota_id):
+    if Match.objects.filter(dota_id=match_dota_id, is_parsed=False).exists():
+        failed = parse_matches_data([match_dota_id])
+        if match_dota_id in failed:
+            raise self.retry(countdown=retry_policy.get_delay(self.request.retries, failed[match_dota_id]))
+        if not Match.objects.filter(dota_id=match_dota_id, is_parsed=True).exists():
+            raise self.retry()
+
+
+@shared_task(name='3.1. Оцінка матчу.')
+def rate_match_celery_task(match_dota_id):
+    if Match.objects.filter(dota_id=match_dota_id, is_parsed=True, is_rated=False).exists():
+        rate_matches([match_dota_id])
+
+
+@shared_task(name='4.1. Збереження результатів матчу.')
+def save_match_results_celery_task(match_dota_id):
+    if Match.objects.filter(dota_id=match_dota_id, is_rated=True, is_saved_to_players=False).exists():
+        save_results_to_player([match_dota_id])
+    cache.delete(get_match_pipeline_key(match_dota_id))
+
+
+@shared_task(name='5.2. Оновлення фентезі балів за змінами.')
+def propagate_results_changes_celery_task():
+    propagate_results_changes()
 
 
 @shared_task(name='2. Детальний парсинг матчів.')
 def parse_matches_data_celery_task():
-    print('--- START parse_matches_data_celery_task')
     obj_ids = Match.objects.filter(is_parsed=False).values_list('dota_id', flat=True)
-    print(f'В обробку йде: {obj_ids.count()} матчів.')
+    logger.info('В обробку йдуть матчі.', extra={'task': 'parse_matches_data', 'matches': obj_ids.count()})
     parse_matches_data(obj_ids)
-    print('--- END parse_matches_data_celery_task')
 
 
 @shared_task(name='3. Оцінка матчів та формування результату гравців.')
 def rate_matches_celery_task():
-    print('--- START rate_matches_celery_task')
     obj_ids = Match.objects.filter(is_parsed=True, is_rated=False).values_list('dota_id', flat=True)
-    print(f'В обробку йде: {obj_ids.count()} матчів.')
+    logger.info('В обробку йдуть матчі.', extra={'task': 'rate_matches', 'matches': obj_ids.count()})
     rate_matches(obj_ids)
-    print('--- END rate_matches_celery_task')
 
 
 @shared_task(name='4. Збереження результатів гравців в систему.')
 def save_results_to_player_celery_task():
-    print('--- START save_results_to_player_celery_task')
     obj_ids = Match.objects.filter(is_rated=True, is_saved_to_players=False).values_list('dota_id', flat=True)
-    print(f'В обробку йде: {obj_ids.count()} матчів.')
+    logger.info('В обробку йдуть матчі.', extra={'task': 'save_results_to_player', 'matches': obj_ids.count()})
     save_results_to_player(obj_ids)
-    print('--- END save_results_to_player_celery_task')
 
 
 @shared_task(name='5. Оновлення фентезі балів.')
 def update_fantasy_results_celery_task():
-    print('--- START update_fantasy_results')
+    changes_count = propagate_results_changes()
+    logger.info('Оброблено зміни.', extra={'task': 'update_fantasy_results', 'changes': changes_count})
+
+
+@shared_task(name='6. Очищення сирих даних завершених ліг.')
+def purge_match_payloads_celery_task():
+    deleted_count = purge_match_payloads()
+    logger.info('Видалено сирі дані матчів.', extra={'task': 'purge_match_payloads', 'deleted': deleted_count})
+
+
+@shared_task(name='7. Виконання задачі з адмінки.', acks_late=True)
+def run_pipeline_job_celery_task(job_id):
+    from fantasy.jobs import run_job
+
+    job = run_job(job_id)
+    logger.info('Задачу виконано.', extra={'task': 'run_pipeline_job', 'job': job.id, 'kind': job.kind,
+                                          'status': job.status, 'failed': job.failed})
+
+
+@shared_task(name='5.1. Повний перерахунок фентезі балів.')
+def recalculate_fantasy_results_celery_task():
     obj_ids = CompetitionTour.objects.filter(status='ongoing').values_list('id', flat=True)
-    print(f'В обробку йде: {obj_ids.count()} ігрових турів.')
+    logger.info('В обробку йдуть ігрові тури.', extra={'task': 'recalculate_fantasy_results', 'tours': obj_ids.count()})
     update_fantasy_results(obj_ids)
-    print('--- END update_fantasy_results')
 
 
-def competitions_parse_match_ids(compt_dota_ids):
+def get_match_pipeline_key(match_dota_id):
+    return f'match_pipeline:{match_dota_id}'
+
+
+def start_matches_pipeline(match_dota_ids):
+    lock_timeout = settings.PIPELINE_FETCH_RETRY_DELAY * (settings.PIPELINE_FETCH_MAX_RETRIES + 1)
+    started_count = 0
+    for match_dota_id in match_dota_ids:
+        if not cache.add(get_match_pipeline_key(match_dota_id), 1, timeout=lock_timeout):
+            continue
+        chain(
+            fetch_match_celery_task.si(match_dota_id),
+            rate_match_celery_task.si(match_dota_id),
+            save_match_results_celery_task.si(match_dota_id),
+            propagate_results_changes_celery_task.si(),
+        ).delay()
+        started_count += 1
+    return started_count
+
+
+@metrics.stage('competitions_parse_match_ids')
+def competitions_parse_match_ids(compt_dota_ids, batch_size=500):
+    new_match_dota_ids = []
+    ignored_ids = set(IgnoreMatch.objects.values_list('dota_id', flat=True))
+    team_ids = dict(Team.objects.values_list('dota_id', 'id'))
     competitions = Competition.objects.filter(dota_id__in=compt_dota_ids)
     for competition in competitions:
-        matches_data = api_connector.get_league_matches_id(competition_id=competition.dota_id)
-        for match_data in matches_data:
-            match_dota_id = match_data.get('match_id')
-            series_dota_id = match_data.get('series_id')
-            series_type = match_data.get('series_type')
-            start_time = match_data.get('start_time')
-            radiant_team_id = match_data.get('radiant_team_id')
-            dire_team_id = match_data.get('dire_team_id')
-
-            ignore_matches = IgnoreMatch.objects.all().values_list('dota_id', flat=True)
-
-            if str(match_dota_id) in ignore_matches:
-                continue
-
-            if match_dota_id and not Match.objects.filter(dota_id=match_dota_id).exists():
-                match_datetime = datetime.fromtimestamp(start_time) if start_time else None
-                competition_tour = CompetitionTour.objects.filter(
-                    competition=competition,
-                    start_date__lte=match_datetime,
-                    end_date__gte=match_datetime,
-                ).first()
-
-                radiant_team = None
-                dire_team = None
-                if Team.objects.filter(dota_id=radiant_team_id).exists():
-                    radiant_team = Team.objects.get(dota_id=radiant_team_id)
-                if Team.objects.filter(dota_id=dire_team_id).exists():
-                    dire_team = Team.objects.get(dota_id=dire_team_id)
-
-                match_obj = Match.objects.create(
-                    dota_id=match_dota_id,
-                    competition=competition,
-                    competition_tour=competition_tour,
-                    team_radiant=radiant_team,
-                    team_dire=dire_team,
-                    datetime=match_datetime,
-                )
-
-                if series_dota_id and series_type is not None:
-                    series_obj, _ = MatchSeries.objects.get_or_create(
-                        dota_id=series_dota_id,
-                        defaults={
-                            "bo_format": MatchSeriesBOFormatEnum.get_format(series_type),
-                            "competition": competition,
-                            "competition_tour": competition_tour,
-                        }
-                    )
-                    match_obj.series = series_obj
-
-                match_obj.is_filled = True
-                match_obj.save()
+        full_sync = competition.is_full_sync_required
+        league_matches = api_connector.iter_league_matches(competition_id=competition.dota_id)
+        if league_matches is None:
+            continue
+        sync_start_time = competition.sync_start_time
+        min_start_time = competition.sync_start_time - settings.LEAGUE_SYNC_LOOKBACK
+        listed_count = 0
+        try:
+            for matches_data in chunked(league_matches, batch_size):
+                listed_count += len(matches_data)
+                sync_start_time = max([m.start_time or 0 for m in matches_data] + [sync_start_time])
+                if not full_sync:
+                    matches_data = [m for m in matches_data if not m.start_time or m.start_time > min_start_time]
+                new_match_dota_ids += create_competition_matches(competition, matches_data, ignored_ids, team_ids,
+                                                                 batch_size)
+        except ApiRetryError:
+            logger.warning('Список матчів ліги отримано не повністю.',
+                           extra={'task': 'competitions_parse_match_ids', 'competition': competition.dota_id})
+            continue
+        if not listed_count:
+            continue
+
+        sync_fields = {'sync_start_time': sync_start_time}
+        if full_sync:
+            sync_fields['full_synced_at'] = timezone.now()
+        Competition.objects.filter(pk=competition.pk).update(**sync_fields)
+    metrics.inc('fantasy_pipeline_items_total', len(new_match_dota_ids), stage='competitions_parse_match_ids')
+    return new_match_dota_ids
+
+
+def find_competition_tour_id(tours, match_datetime):
+    if match_datetime is None:
+        return None
+    for tour_id, start_date, end_date in tours:
+        if start_date and end_date and start_date <= match_datetime <= end_date:
+            return tour_id
+    return None
+
+
+def create_competition_matches(competition, matches_data, ignored_ids, team_ids, batch_size=500):
+    new_matches_data = {}
+    for match_data in matches_data:
+        match_dota_id = match_data.match_id
+        if match_dota_id and str(match_dota_id) not in ignored_ids:
+            new_matches_data.setdefault(str(match_dota_id), match_data)
+
+    known_ids = set(Match.objects.filter(dota_id__in=new_matches_data.keys()).values_list('dota_id', flat=True))
+    for match_dota_id in known_ids:
+        del new_matches_data[match_dota_id]
+    if not new_matches_data:
+        return []
+
+    tours = list(CompetitionTour.objects.filter(competition=competition)
+                 .order_by('id').values_list('id', 'start_date', 'end_date'))
+
+    matches = []
+    match_series = []
+    series_objs = {}
+    for match_dota_id, match_data in new_matches_data.items():
+        series_dota_id = match_data.series_id
+        series_type = match_data.series_type
+        start_time = match_data.start_time
+        match_datetime = timezone.make_aware(datetime.fromtimestamp(start_time)) if start_time else None
+        competition_tour_id = find_competition_tour_id(tours, match_datetime)
+
+        match_obj = Match(
+            dota_id=match_dota_id,
+            competition=competition,
+            competition_tour_id=competition_tour_id,
+            team_radiant_id=team_ids.get(str(match_data.radiant_team_id)),
+            team_dire_id=team_ids.get(str(match_data.dire_team_id)),
+            datetime=match_datetime,
+            is_filled=True,
+        )
+        if series_dota_id and series_type is not None:
+            match_series.append((match_obj, str(series_dota_id)))
+            series_objs.setdefault(str(series_dota_id), MatchSeries(
+                dota_id=str(series_dota_id),
+                bo_format=MatchSeriesBOFormatEnum.get_format(series_type),
+                competition=competition,
+                competition_tour_id=competition_tour_id,
+            ))
+        matches.append(match_obj)
+
+    if series_objs:
+        MatchSeries.objects.bulk_create(series_objs.values(), batch_size=batch_size, ignore_conflicts=True)
+        series_ids = dict(MatchSeries.objects.filter(dota_id__in=series_objs.keys()).values_list('dota_id', 'id'))
+        for match_obj, series_dota_id in match_series:
+            match_obj.series_id = series_ids[series_dota_id]
+
+    Match.objects.bulk_create(matches, batch_size=batch_size, ignore_conflicts=True)
+    return list(new_matches_data)
 
 
 def is_parse_match_data_full(data):
@@ -122,50 +248,136 @@ def is_parse_match_data_full(data):
     return set(need_keys).issubset(exists_keys)
 
 
-def parse_matches_data(match_dota_ids, parse_full=True):
-    for match_id in match_dota_ids:
-        data = api_connector.get_match_info(match_id)
-        if data:
+@metrics.stage('parse_matches_data')
+def parse_matches_data(match_dota_ids, parse_full=True, batch_size=50):
+    parsed_data = {}
+    failed = {}
+    for match_id, data, error in api_connector.get_matches_info(list(match_dota_ids)):
+        if error:
+            failed[match_id] = error.retry_after
+        elif data:
             if parse_full and not is_parse_match_data_full(data):
                 continue
-            Match.objects.filter(dota_id=match_id).update(is_parsed=True, data=data)
-        time.sleep(1)
-
-
-def rate_matches(match_dota_ids):
-    matches = Match.objects.filter(dota_id__in=match_dota_ids)
+            parsed_data[str(match_id)] = data
+        if len(parsed_data) >= batch_size:
+            save_parsed_matches_data(parsed_data)
+            parsed_data = {}
+    save_parsed_matches_data(parsed_data)
+    if failed:
+        logger.warning('Матчі не отримано, OpenDota недоступна.',
+                       extra={'task': 'parse_matches_data', 'matches': len(failed)})
+    return failed
+
+
+def save_parsed_matches_data(parsed_data):
+    if not parsed_data:
+        return
+    matches = list(Match.objects.only('id', 'dota_id').filter(dota_id__in=parsed_data.keys()))
+    payloads = {match.id: parsed_data[match.dota_id] for match in matches}
+    MatchData.store(payloads)
+    PlayerMatchStat.store(payloads)
     for match in matches:
-        if match.data:
-            result = get_result(match)
-            match.result_data = result
-            match.is_rated = True
-            match.save()
-
-
-def save_results_to_player(match_dota_ids):
-    matches = Match.objects.filter(dota_id__in=match_dota_ids)
-    for match in matches:
-        for account_id, result in match.result_data.items():
-            if Player.objects.filter(dota_id=account_id).exists():
-                player = Player.objects.get(dota_id=account_id)
-                obj, created = PlayerMatchResult.objects.update_or_create(
-                    player=player,
-                    match=match,
-                    defaults={"result": result.get('TOTAL', 0)},
-                )
-        match.is_saved_to_players = True
-        match.save()
-
-
+        match.data = None
+        match.is_parsed = True
+    Match.objects.bulk_update(matches, ['data', 'is_parsed'])
+    metrics.inc('fantasy_pipeline_items_total', len(matches), stage='parse_matches_data')
+
+
+@metrics.stage('rate_matches')
+def rate_matches(match_dota_ids, batch_size=200):
+    competitions_match_ids = defaultdict(list)
+    for match_id, competition_id in Match.objects.filter(dota_id__in=match_dota_ids, is_parsed=True) \
+            .values_list('id', 'competition_id'):
+        competitions_match_ids[competition_id].append(match_id)
+    formulas = dict(CompetitionFormula.objects.filter(competition_id__in=competitions_match_ids.keys(), is_active=True)
+                    .values_list('competition_id', 'formula'))
+
+    for competition_id, match_ids in competitions_match_ids.items():
+        scoring_engine = ScoringEngine(formulas.get(competition_id))
+        extract_player_match_stats(match_ids)
+        for batch_ids in chunked(match_ids, batch_size):
+            results = scoring_engine.score_match_stats(batch_ids)
+            matches = [Match(id=match_id, result_data=results[match_id], is_rated=True) for match_id in batch_ids]
+            empty_match_ids = [match_id for match_id in batch_ids if not results[match_id]]
+            if empty_match_ids:
+                logger.warning('Матчі без статистики гравців оцінено порожнім результатом.',
+                               extra={'task': 'rate_matches', 'competition': competition_id,
+                                      'matches': empty_match_ids})
+            Match.objects.bulk_update(matches, ['result_data', 'is_rated'])
+            metrics.inc('fantasy_pipeline_items_total', len(matches), stage='rate_matches')
+
+
+def extract_player_match_stats(match_ids, batch_size=100):
+    matches = (Match.objects.filter(Q(raw_data__isnull=False) | Q(data__isnull=False), id__in=match_ids,
+                                    player_stats__isnull=True)
+               .only('id').prefetch_related('raw_data'))
+    extracted_count = 0
+    for batch in chunked(matches.iterator(chunk_size=batch_size), batch_size):
+        PlayerMatchStat.store({match.id: match.payload for match in batch if match.payload})
+        extracted_count += len(batch)
+    return extracted_count
+
+
+def move_match_payloads(batch_size=100):
+    moved_count = 0
+    while True:
+        matches = list(Match.objects.filter(data__isnull=False).only('id', 'data')[:batch_size])
+        if not matches:
+            return moved_count
+        MatchData.store({match.id: match.data for match in matches})
+        for match in matches:
+            match.data = None
+        Match.objects.bulk_update(matches, ['data'])
+        moved_count += len(matches)
+
+
+def purge_match_payloads(retention_days=None):
+    if retention_days is None:
+        retention_days = settings.MATCH_PAYLOAD_RETENTION_DAYS
+    finished_before = timezone.localdate() - timedelta(days=retention_days)
+    match_ids = Match.objects.filter(competition__status=CompetitionStatusEnum.FINISHED,
+                                     competition__date_finish__lt=finished_before,
+                                     is_saved_to_players=True).values('id')
+    deleted_count, _ = MatchData.objects.filter(match_id__in=match_ids).delete()
+    deleted_count += Match.objects.filter(id__in=match_ids, data__isnull=False).update(data=None)
+    return deleted_count
+
+
+def chunked(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@metrics.stage('save_results_to_player')
+def save_results_to_player(match_dota_ids, batch_size=1000):
+    matches = list(Match.objects.filter(dota_id__in=match_dota_ids).only('id', 'result_data'))
+    results = [(match.id, str(account_id), result.get('TOTAL', 0))
+               for match in matches for account_id, result in (match.result_data or {}).items()]
+    players = dict(Player.objects.filter(dota_id__in={account_id for _, account_id, _ in results})
+                   .values_list('dota_id', 'id'))
+    PlayerMatchResult.objects.bulk_create(
+        [PlayerMatchResult(player_id=players[account_id], match_id=match_id, result=result)
+         for match_id, account_id, result in results if account_id in players],
+        batch_size=batch_size, update_conflicts=True, unique_fields=['player', 'match'], update_fields=['result'],
+    )
+    match_ids = [match.id for match in matches]
+    Match.objects.filter(id__in=match_ids).update(is_saved_to_players=True)
+    record_results_changes(match_ids)
+    metrics.inc('fantasy_pipeline_items_total', len(match_ids), stage='save_results_to_player')
+
+
+@metrics.stage('update_fantasy_results')
 def update_fantasy_results(competition_tour_ids):
-    qs = CompetitionTour.objects.filter(id__in=competition_tour_ids)
-    for tour in qs:
-        fan_teams_tour = tour.fantasy_teams.all()
-        for fan_team in fan_teams_tour:
-            for fan_player in fan_team.fantasy_players.all():
-                fan_player.set_result()
-            fan_team.set_result()
-            fan_team.fantasy_team.set_result()
+    tour_ids = CompetitionTour.objects.filter(id__in=competition_tour_ids).values_list('id', flat=True)
+    for tour_id in tour_ids:
+        update_tour_fantasy_results(tour_id)
+        metrics.inc('fantasy_pipeline_items_total', stage='update_fantasy_results')
 
 
 def result_from_player_data(player_data):
@@ -210,7 +422,7 @@ def result_from_player_data(player_data):
 
 
 def get_result(match_info):
-    match_data = match_info.data
+    match_data = match_info.payload
     player_results = {}
     players = match_data.get('players', [])
 
@@ -1,3 +1,1045 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api import async_views
+from api.caching import bump_versions
+from api.connectors import (ApiRetryError, CircuitBreaker, DotaApiConnector, RetryPolicy, SharedTokenBucket,
+                            iter_json_array, parse_retry_after)
+from api.fake_opendota import FakeOpenDotaServer
+from api.response_cache import ResponseCache
+from core import metrics
+from core.logging import JsonFormatter
+from fantasy import rescoring, tasks
+from fantasy.constants import (CompetitionStatusEnum, GameRoleEnum, MatchSeriesBOFormatEnum, PipelineJobKindEnum,
+                               PipelineJobStatusEnum)
+from fantasy.jobs import enqueue_job
+from fantasy.models import (AppScreenInfo, Competition, CompetitionFormula, CompetitionTour, FantasyPlayer,
+                            FantasyTeam, FantasyTeamTour, IgnoreMatch, Match, MatchData, MatchSeries, PipelineJob,
+                            Player, PlayerMatchResult, PlayerResultChange, ProfilingConfig, RescoredMatchResult, Team)
+from fantasy.profiling import ProfileSession, get_profile_ids
+from fantasy.results import propagate_results_changes, record_results_changes, update_tour_fantasy_results
+from fantasy.scoring import ScoringEngine
+from fantasy.synthetic import SYNTHETIC_PREFIX, DatasetGenerator
+from fantasy.tasks import (is_parse_match_data_full, rate_match_celery_task, run_pipeline_job_celery_task,
+                           save_match_results_celery_task)
+from users.models import CustomUser
+
+urlpatterns = [
+    path('async/api/', include(async_views.urlpatterns)),
+    path('api/', include('api.urls')),
+]
+
+
+class QueryBudgetTestCase(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='user', email='user@example.com')
+        self.client.force_authenticate(self.user)
+        self.competition = Competition.objects.create(name='Competition', dota_id='1',
+                                                      status=CompetitionStatusEnum.STARTED)
+        self.fantasy_team = FantasyTeam.objects.create(user=self.user, competition=self.competition,
+                                                       name_extended='user team')
+        AppScreenInfo.objects.create(screen='main', text='text')
+        self.rows = 0
+        self.grow()
+        self.tour = self.competition.competition_tours.first()
+        self.fantasy_team_tour = self.fantasy_team.child_teams.first()
+        self.competition.active_tour = self.tour
+        self.competition.save()
+
+    def grow(self):
+        self.rows += 1
+        n = self.rows
+        tour = CompetitionTour.objects.create(competition=self.competition, name=f'Tour {n}')
+        team = Team.objects.create(name=f'Team {n}', dota_id=f'team_{n}')
+        self.competition.team.add(team)
+        players = [Player.objects.create(nickname=f'Player {n}.{role.value}', team=team, game_role=role,
+                                         dota_id=f'player_{n}_{role.value}', cost=5)
+                   for role in GameRoleEnum]
+
+        fantasy_team_tour = FantasyTeamTour.objects.create(fantasy_team=self.fantasy_team, competition_tour=tour)
+        FantasyPlayer.objects.bulk_create([FantasyPlayer(player=player, fantasy_team_tour=fantasy_team_tour)
+                                           for player in players])
+
+        other_competition = Competition.objects.create(name=f'Competition {n}', dota_id=f'competition_{n}',
+                                                       status=CompetitionStatusEnum.STARTED)
+        other_tour = CompetitionTour.objects.create(competition=other_competition, name=f'Other tour {n}')
+        other_fantasy_team = FantasyTeam.objects.create(user=self.user, competition=other_competition,
+                                                        name_extended=f'user team {n}')
+        FantasyTeamTour.objects.create(fantasy_team=other_fantasy_team, competition_tour=other_tour)
+
+        for i in range(3):
+            user = CustomUser.objects.create(username=f'user {n}.{i}', email=f'user_{n}_{i}@example.com')
+            fantasy_team = FantasyTeam.objects.create(user=user, competition=self.competition,
+                                                      name_extended=f'user team {n}.{i}', result=n * 10 + i)
+            FantasyTeamTour.objects.create(fantasy_team=fantasy_team, competition_tour=self.competition_tour,
+                                           result=n * 10 + i)
+
+    @property
+    def competition_tour(self):
+        return self.competition.competition_tours.order_by('id').first()
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [query['sql'] for query in context.captured_queries]
+
+    def assertQueryBudget(self, url, budget):
+        small_queries = self.count_queries(url)
+        for _ in range(3):
+            self.grow()
+        large_queries = self.count_queries(url)
+        self.assertLessEqual(len(small_queries), budget, '\n'.join(small_queries))
+        self.assertEqual(len(small_queries), len(large_queries), '\n'.join(large_queries))
+
+
+class CompetitionQueryBudgetTest(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget('/api/competition/', 3)
+
+    def test_retrieve(self):
+        self.assertQueryBudget(f'/api/competition/{self.competition.id}/', 3)
+
+    def test_edit_status(self):
+        self.assertQueryBudget(f'/api/competition/{self.competition.id}/edit_status/', 1)
+
+    def test_rating(self):
+        self.assertQueryBudget(f'/api/competition/{self.competition.id}/rating/', 3)
+
+    def test_leaderboard(self):
+        self.assertQueryBudget(f'/api/competition/{self.competition.id}/leaderboard/?limit=5', 3)
+
+    def test_my_rating(self):
+        self.assertQueryBudget(f'/api/competition/{self.competition.id}/my-rating/', 4)
+
+
+class CompetitionTourQueryBudgetTest(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget(f'/api/competition-tour/?competition={self.competition.id}', 4)
+
+    def test_retrieve(self):
+        self.assertQueryBudget(f'/api/competition-tour/{self.tour.id}/', 2)
+
+    def test_rating(self):
+        self.assertQueryBudget(f'/api/competition-tour/{self.tour.id}/rating/', 3)
+
+    def test_my_rating(self):
+        self.assertQueryBudget(f'/api/competition-tour/{self.tour.id}/my-rating/', 4)
+
+
+class PlayerQueryBudgetTest(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget('/api/player/', 2)
+
+    def test_list_by_competition(self):
+        self.assertQueryBudget(f'/api/player/?competition_id={self.competition.id}', 2)
+
+
+class FantasyTeamQueryBudgetTest(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertQueryBudget('/api/fantasy-team/', 4)
+
+    def test_retrieve(self):
+        self.assertQueryBudget(f'/api/fantasy-team/{self.fantasy_team.id}/', 3)
+
+    def test_tours_list(self):
+        self.assertQueryBudget(f'/api/fantasy-team-tour/?fantasy_team={self.fantasy_team.id}', 4)
+
+    def test_tours_retrieve(self):
+        self.assertQueryBudget(f'/api/fantasy-team-tour/{self.fantasy_team_tour.id}/', 2)
+
+    def test_players_list(self):
+        self.assertQueryBudget('/api/fantasy-player/', 2)
+
+
+class AppQueryBudgetTest(QueryBudgetTestCase):
+    def test_user(self):
+        self.assertQueryBudget('/api/user/', 0)
+
+    def test_app_info(self):
+        self.assertQueryBudget('/api/app-info/?screen=main', 2)
+
+
+class FantasyLineupTest(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        tour = self.fantasy_team_tour.competition_tour
+        tour.editing_start = timezone.now() - timedelta(hours=1)
+        tour.editing_end = timezone.now() + timedelta(hours=1)
+        tour.save()
+        self.url = f'/api/fantasy-team-tour/{self.fantasy_team_tour.id}/lineup/'
+        self.players = list(Player.objects.filter(team__name='Team 1').order_by('id'))
+
+    def put_lineup(self, players):
+        return self.client.put(self.url, {'players': [player.id for player in players]}, format='json')
+
+    def test_replace(self):
+        for _ in range(3):
+            self.grow()
+        self.players = list(Player.objects.filter(team__name='Team 2').order_by('id'))
+        old_ids = set(self.fantasy_team_tour.fantasy_players.values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as context:
+            response = self.put_lineup(self.players[:4])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertLessEqual(len(context.captured_queries), 9)
+        self.assertEqual({fan_player['player']['id'] for fan_player in response.data['fantasy_players']},
+                         {player.id for player in self.players[:4]})
+        self.assertEqual(set(self.fantasy_team_tour.fantasy_players.values_list('player_id', flat=True)),
+                         {player.id for player in self.players[:4]})
+        self.assertTrue(set(self.fantasy_team_tour.fantasy_players.values_list('id', flat=True)) < old_ids)
+
+    def test_validation(self):
+        same_role = Player.objects.create(nickname='Other', game_role=self.players[0].game_role, dota_id='other')
+        self.assertEqual(self.put_lineup([self.players[0], same_role]).status_code, 400)
+
+        players = Player.objects.filter(id__in=[player.id for player in self.players])
+        players.update(cost=11)
+        self.assertEqual(self.put_lineup(self.players).status_code, 400)
+        players.update(cost=10)
+        self.assertEqual(self.put_lineup(self.players).status_code, 200)
+
+        CompetitionTour.objects.filter(id=self.fantasy_team_tour.competition_tour_id) \
+            .update(editing_end=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.put_lineup(self.players[:1]).status_code, 400)
+        self.assertEqual(self.fantasy_team_tour.fantasy_players.count(), len(self.players))
+
+    def test_other_user(self):
+        self.client.force_authenticate(CustomUser.objects.create(username='other', email='other@example.com'))
+        self.assertEqual(self.put_lineup(self.players[:1]).status_code, 404)
+
+
+class PlayerPoolTest(QueryBudgetTestCase):
+    def test_player_pool(self):
+        url = f'/api/competition/{self.competition.id}/player-pool/'
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        pool = response.json()
+        self.assertEqual(len(pool['players']), Player.objects.filter(team__competitions=self.competition).count())
+        self.assertEqual(dict(zip(pool['player_fields'], pool['players'][0]))['cost'], '5.00')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(context.captured_queries), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Player.objects.filter(team__competitions=self.competition).update(cost=6)
+            Player.objects.first().save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_competition(self):
+        self.assertEqual(self.client.get('/api/competition/0/player-pool/').status_code, 404)
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.competition = Competition.objects.create(name='Competition', dota_id='1',
+                                                     status=CompetitionStatusEnum.STARTED)
+        cls.tour = CompetitionTour.objects.create(competition=cls.competition, name='Tour')
+        CompetitionTour.objects.bulk_create([CompetitionTour(competition=cls.competition, name=f'Tour {i}')
+                                             for i in range(500)])
+        cls.player = Player.objects.create(nickname='Player', dota_id='player', game_role=GameRoleEnum.CARRY)
+        Match.objects.bulk_create([Match(dota_id=str(i), competition=cls.competition, competition_tour=cls.tour,
+                                         is_parsed=i % 100 > 0, is_rated=i % 100 > 1, is_saved_to_players=i % 100 > 2)
+                                   for i in range(10000)])
+        cls.match = Match.objects.first()
+        PlayerMatchResult.objects.bulk_create([PlayerMatchResult(player=cls.player, match=match)
+                                               for match in Match.objects.all()])
+        users = CustomUser.objects.bulk_create([CustomUser(username=f'user {i}', email=f'user_{i}@example.com')
+                                                for i in range(500)])
+        fantasy_teams = FantasyTeam.objects.bulk_create([
+            FantasyTeam(user=user, competition=cls.competition, name_extended=user.username, result=i)
+            for i, user in enumerate(users)
+        ])
+        FantasyTeamTour.objects.bulk_create([FantasyTeamTour(fantasy_team=fantasy_team, competition_tour=cls.tour,
+                                                             result=i)
+                                             for i, fantasy_team in enumerate(fantasy_teams)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertRegex(plan, f'Index (Only )?Scan using "?{index}"? ', plan)
+
+    def test_pipeline_queries(self):
+        self.assertUsesIndex(Match.objects.filter(is_parsed=False), 'match_not_parsed_idx')
+        self.assertUsesIndex(Match.objects.filter(is_parsed=True, is_rated=False), 'match_not_rated_idx')
+        self.assertUsesIndex(Match.objects.filter(is_rated=True, is_saved_to_players=False), 'match_not_saved_idx')
+        self.assertUsesIndex(Match.objects.filter(competition__status=CompetitionStatusEnum.STARTED,
+                                                  is_saved_to_players=False), 'match_not_saved_idx')
+        self.assertUsesIndex(PlayerMatchResult.objects.filter(player=self.player, match=self.match),
+                             'player and match unique')
+
+    def test_tour_lookup(self):
+        now = timezone.now()
+        self.assertUsesIndex(CompetitionTour.objects.filter(competition=self.competition, start_date__lte=now,
+                                                            end_date__gte=now), 'competition_tour_dates_idx')
+
+    def test_rating_queries(self):
+        self.assertUsesIndex(FantasyTeamTour.objects.filter(competition_tour=self.tour).order_by('-result')[:100],
+                             'fantasy_team_tour_rating_idx')
+        self.assertUsesIndex(FantasyTeam.objects.filter(competition=self.competition).order_by('-result')[:100],
+                             'fantasy_team_rating_idx')
+
+
+class TourResultsTest(TestCase):
+    def test_same_as_set_result(self):
+        competition = Competition.objects.create(name='Competition', dota_id='1', status=CompetitionStatusEnum.STARTED)
+        tour = CompetitionTour.objects.create(competition=competition, name='Tour')
+        players = [Player.objects.create(nickname=f'Player {i}', dota_id=f'player_{i}', game_role=GameRoleEnum.CARRY)
+                   for i in range(4)]
+        series_results = [
+            (MatchSeriesBOFormatEnum.BO3, [[10.1, 3.33], [-2, 7], [5.55, 0]]),
+            (MatchSeriesBOFormatEnum.BO3, [[4, 1.01], [8.8, 0]]),
+            (MatchSeriesBOFormatEnum.BO5, [[7.77, 2], [3.1, 9]]),
+            (MatchSeriesBOFormatEnum.BO1, [[12.34, -1.5]]),
+        ]
+        for i, (bo_format, matches_results) in enumerate(series_results):
+            series = MatchSeries.objects.create(dota_id=str(i), bo_format=bo_format, competition=competition,
+                                                competition_tour=tour)
+            for j, results in enumerate(matches_results):
+                match = Match.objects.create(dota_id=f'{i}_{j}', series=series, competition=competition,
+                                             competition_tour=tour)
+                PlayerMatchResult.objects.bulk_create([PlayerMatchResult(player=player, match=match, result=result)
+                                                       for player, result in zip(players[i % 2:], results)])
+
+        fan_players = []
+        for i in range(3):
+            user = CustomUser.objects.create(username=f'user_{i}', email=f'user_{i}@example.com')
+            fantasy_team = FantasyTeam.objects.create(user=user, competition=competition, name_extended=f'team {i}')
+            fantasy_team_tour = FantasyTeamTour.objects.create(fantasy_team=fantasy_team, competition_tour=tour)
+            fan_players += [FantasyPlayer.objects.create(player=player, fantasy_team_tour=fantasy_team_tour)
+                            for player in players[i:i + 2]]
+
+        def get_results():
+            return (list(FantasyPlayer.objects.order_by('id').values_list('result', flat=True)),
+                    list(FantasyTeamTour.objects.order_by('id').values_list('result', flat=True)),
+                    list(FantasyTeam.objects.order_by('id').values_list('result', flat=True)))
+
+        for obj in fan_players + list(FantasyTeamTour.objects.all()) + list(FantasyTeam.objects.all()):
+            obj.set_result()
+        expected = get_results()
+        self.assertEqual(expected[0][-1], 0)
+        FantasyPlayer.objects.update(result=0)
+        FantasyTeamTour.objects.update(result=0)
+        FantasyTeam.objects.update(result=0)
+
+        update_tour_fantasy_results(tour.id)
+        self.assertEqual(get_results(), expected)
+
+
+class ResultsChangesTest(TransactionTestCase):
+    def setUp(self):
+        competition = Competition.objects.create(name='Competition', dota_id='1', status=CompetitionStatusEnum.STARTED)
+        self.tour = CompetitionTour.objects.create(competition=competition, name='Tour')
+        series = MatchSeries.objects.create(dota_id='1', competition=competition, competition_tour=self.tour)
+        self.match = Match.objects.create(dota_id='1', series=series, competition=competition,
+                                          competition_tour=self.tour)
+        self.player = Player.objects.create(nickname='Player', dota_id='player', game_role=GameRoleEnum.CARRY)
+        PlayerMatchResult.objects.create(player=self.player, match=self.match, result=10)
+
+    def record_concurrently(self, *args):
+        def record():
+            try:
+                record_results_changes([self.match.id])
+            finally:
+                connections.close_all()
+
+        self.recorder = threading.Thread(target=record)
+        self.recorder.start()
+        self.recorder.join(timeout=0.5)
+
+    def test_change_during_propagation(self):
+        record_results_changes([self.match.id])
+        with mock.patch('fantasy.results.update_tour_fantasy_results', side_effect=self.record_concurrently):
+            self.assertEqual(propagate_results_changes(), 1)
+        self.recorder.join()
+        self.assertTrue(PlayerResultChange.objects.filter(player=self.player, competition_tour=self.tour).exists())
+        self.assertEqual(propagate_results_changes(), 1)
+        self.assertFalse(PlayerResultChange.objects.exists())
+
+
+class RateMatchesTest(TestCase):
+    def test_matches_without_stats(self):
+        competition = Competition.objects.create(name='Competition', dota_id='1', status=CompetitionStatusEnum.STARTED)
+        Player.objects.create(nickname='Player', dota_id='10', game_role=GameRoleEnum.CARRY)
+        Match.objects.create(dota_id='1', competition=competition, is_parsed=True,
+                             data={'players': [{'account_id': 10, 'win': 1, 'kills': 3}]})
+        Match.objects.create(dota_id='2', competition=competition, is_parsed=True, data={'players': []})
+
+        tasks.rate_matches(['1', '2'])
+        self.assertEqual(dict(Match.objects.values_list('dota_id', 'is_rated')), {'1': True, '2': True})
+        self.assertEqual(Match.objects.get(dota_id='1').result_data['10']['NICKNAME'], 'Player')
+        self.assertEqual(Match.objects.get(dota_id='2').result_data, {})
+
+        with mock.patch.object(tasks.ScoringEngine, 'score_match_stats') as score_match_stats:
+            tasks.rate_matches_celery_task.apply()
+            rate_match_celery_task.apply(args=['2'])
+        score_match_stats.assert_not_called()
+        save_match_results_celery_task.apply(args=['2'])
+        self.assertTrue(Match.objects.get(dota_id='2').is_saved_to_players)
+
+
+class ScoringEngineTest(TestCase):
+    def test_same_as_get_result(self):
+        Player.objects.create(nickname='Core', dota_id='10', game_role=GameRoleEnum.CARRY)
+        Player.objects.create(nickname='Support', dota_id='20', game_role=GameRoleEnum.SUPPORT_5)
+        players = [
+            {'account_id': 10, 'win': 1, 'kills': 7, 'deaths': 2, 'last_hits': 12.5, 'stuns': 100,
+             'hero_healing': 30000, 'hero_damage': 12345.678, 'tower_damage': None},
+            {'account_id': 20, 'win': 0, 'kills': 1, 'deaths': 9, 'assists': 17, 'denies': 0.5, 'stuns': 2.345,
+             'hero_healing': 24.99},
+            {'account_id': 20, 'win': 1},
+            {'account_id': 30, 'win': 1, 'kills': 3},
+            {'account_id': 0, 'kills': 3},
+        ]
+        matches = [Match.objects.create(dota_id=str(i), is_parsed=True, data={'players': [player_data]})
+                   for i, player_data in enumerate(players)]
+
+        expected = [tasks.get_result(match) for match in matches]
+        self.assertEqual(expected[0][10]['stuns'], 5)
+        self.assertEqual(expected[2][20]['kills'], 0)
+        self.assertEqual(json.dumps(ScoringEngine().score_matches([match.payload for match in matches])),
+                         json.dumps(expected))
+
+        match_ids = [match.id for match in matches]
+        tasks.extract_player_match_stats(match_ids)
+        results = ScoringEngine().score_match_stats(match_ids)
+        self.assertEqual(json.dumps([results[match_id] for match_id in match_ids]), json.dumps(expected))
+
+
+class CompetitionFormulaTest(TestCase):
+    def test_clean(self):
+        competition = Competition.objects.create(name='Competition', dota_id='1', status=CompetitionStatusEnum.STARTED)
+        CompetitionFormula(competition=competition).clean()
+        invalid_formulas = [
+            {},
+            {'gold_per_min': {'type': '+', 'coef': {'core': 1}}},
+            {'kills': {'coef': {'core': 1}}},
+            {'kills': {'type': '*', 'coef': {'core': 1}}},
+            {'kills': {'type': '+', 'coef': {'carry': 1}}},
+            {'kills': {'type': '+', 'coef': {'core': '1'}}},
+            {'kills': {'type': '+', 'cap': 'high'}},
+            {'kills': 2},
+        ]
+        for formula in invalid_formulas:
+            with self.subTest(formula=formula), self.assertRaises(ValidationError):
+                CompetitionFormula(competition=competition, formula=formula).clean()
+
+
+class RescoringTest(TestCase):
+    def setUp(self):
+        self.competition = Competition.objects.create(name='Competition', dota_id='1',
+                                                      status=CompetitionStatusEnum.STARTED)
+        Player.objects.create(nickname='Player', dota_id='10', game_role=GameRoleEnum.CARRY)
+        self.formula = CompetitionFormula.objects.create(competition=self.competition,
+                                                         formula={'kills': {'type': '+', 'coef': {'core': 10}}})
+
+    def create_match(self, dota_id):
+        Match.objects.create(dota_id=dota_id, competition=self.competition, is_parsed=True,
+                             data={'players': [{'account_id': 10, 'win': 0, 'kills': 3}]})
+
+    def get_totals(self):
+        return {dota_id: result_data['10']['TOTAL']
+                for dota_id, result_data in Match.objects.values_list('dota_id', 'result_data')}
+
+    def test_match_rated_after_snapshot(self):
+        self.create_match('1')
+        tasks.rate_matches(['1'])
+        rescoring.rescore_matches(self.formula.id, list(Match.objects.values_list('id', flat=True)))
+        self.create_match('2')
+        tasks.rate_matches(['2'])
+        self.assertEqual(self.get_totals(), {'1': 6, '2': 6})
+
+        rescoring.switch_formula(self.formula)
+        self.assertEqual(self.get_totals(), {'1': 30, '2': 30})
+        self.assertFalse(RescoredMatchResult.objects.exists())
+
+    @override_settings(RESCORE_WORKERS=2, RESCORE_CHUNK_SIZE=1)
+    def test_job_in_daemonic_worker(self):
+        for dota_id in ('1', '2', '3'):
+            self.create_match(dota_id)
+        tasks.rate_matches(['1', '2', '3'])
+        job, _ = enqueue_job(PipelineJobKindEnum.RESCORE_COMPETITION, [self.formula.id])
+        with mock.patch.dict(multiprocessing.current_process()._config, daemon=True):
+            run_pipeline_job_celery_task.apply(args=[job.id])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, PipelineJobStatusEnum.DONE, job.error)
+        self.assertEqual(self.get_totals(), {'1': 30, '2': 30, '3': 30})
+        self.assertTrue(CompetitionFormula.objects.get(id=self.formula.id).is_active)
+
+
+class MatchDataTest(TestCase):
+    def test_payload(self):
+        payload = {'match_id': 1, 'version': 21, 'players': [{'account_id': 10, 'kills': 3, 'name': 'Гравець'}] * 10}
+        legacy = Match.objects.create(dota_id='1', data=payload)
+        match = Match.objects.create(dota_id='2')
+        MatchData.store({match.id: payload})
+        self.assertLess(len(MatchData.objects.get(match=match).payload), len(json.dumps(payload)))
+
+        matches = {match.dota_id: match for match in Match.objects.prefetch_related('raw_data')}
+        self.assertEqual(matches['1'].get_deferred_fields(), {'data'})
+        with self.assertNumQueries(1):
+            self.assertEqual(matches['1'].payload, payload)
+        with self.assertNumQueries(0):
+            self.assertEqual(matches['2'].payload, payload)
+
+        self.assertEqual(tasks.move_match_payloads(), 1)
+        legacy = Match.objects.prefetch_related('raw_data').get(id=legacy.id)
+        self.assertEqual((legacy.payload, Match.objects.values_list('data', flat=True).get(id=legacy.id)),
+                         (payload, None))
+
+
+class MatchPipelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_chain_lock(self):
+        with mock.patch('fantasy.tasks.chain') as chain:
+            self.assertEqual(tasks.start_matches_pipeline(['1', '2']), 2)
+            self.assertEqual(tasks.start_matches_pipeline(['1', '2', '3']), 1)
+            self.assertEqual(chain.call_count, 3)
+
+            competition = Competition.objects.create(name='Competition', dota_id='1',
+                                                      status=CompetitionStatusEnum.STARTED)
+            Match.objects.create(dota_id='1', competition=competition, is_parsed=True, is_rated=True, result_data={})
+            save_match_results_celery_task.apply(args=['1'])
+            self.assertTrue(Match.objects.get(dota_id='1').is_saved_to_players)
+            self.assertIsNone(cache.get(tasks.get_match_pipeline_key('1')))
+            self.assertEqual(tasks.start_matches_pipeline(['1', '2']), 1)
+
+
+class PipelineJobTest(TestCase):
+    def test_dedup(self):
+        job, created = enqueue_job(PipelineJobKindEnum.RATE_MATCHES, ['2', '1'])
+        self.assertTrue(created)
+        self.assertEqual(enqueue_job(PipelineJobKindEnum.RATE_MATCHES, [1, 2]), (job, False))
+        self.assertTrue(enqueue_job(PipelineJobKindEnum.SAVE_RESULTS, [1, 2])[1])
+        self.assertTrue(enqueue_job(PipelineJobKindEnum.RATE_MATCHES, [1, 2, 3])[1])
+
+        PipelineJob.objects.filter(id=job.id).update(status=PipelineJobStatusEnum.DONE)
+        new_job, created = enqueue_job(PipelineJobKindEnum.RATE_MATCHES, [1, 2])
+        self.assertTrue(created)
+        self.assertNotEqual(new_job.id, job.id)
+
+    def test_failed_matches(self):
+        Match.objects.bulk_create([Match(dota_id=str(i)) for i in range(3)])
+        job, _ = enqueue_job(PipelineJobKindEnum.PARSE_MATCHES, ['0', '1', '2'])
+        matches_info = [('0', {}, None), ('1', None, ApiRetryError('circuit open')), ('2', {}, None)]
+        with mock.patch.object(tasks.api_connector, 'get_matches_info', return_value=matches_info):
+            run_pipeline_job_celery_task.apply(args=[job.id])
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.failed), (PipelineJobStatusEnum.PARTIAL, 3, 1))
+
+
+class SyntheticBenchmarkTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.counts = DatasetGenerator(tours=2, teams=4, series=2, users=10, cache_dir=self.cache_dir).generate()
+
+    def test_generate(self):
+        self.assertEqual(self.counts['fantasy_players'], 10 * 2 * len(GameRoleEnum))
+        self.assertEqual(Player.objects.filter(nickname__startswith=SYNTHETIC_PREFIX).count(), 4 * len(GameRoleEnum))
+        self.assertEqual(Match.objects.count(), 0)
+
+    def test_benchmark(self):
+        baseline_path = os.path.join(self.cache_dir, 'baseline.json')
+        call_command('benchmark_pipeline', cache_dir=self.cache_dir, repeat=1, save_baseline=baseline_path,
+                     stdout=io.StringIO())
+        self.assertEqual(Match.objects.count(), 0)
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        self.assertEqual(baseline['dataset']['matches'], self.counts['matches'])
+        self.assertIn('update_fantasy_results', baseline['stages'])
+        self.assertIn('GET /api/competition/{competition}/rating/', baseline['stages'])
+
+        out = io.StringIO()
+        call_command('benchmark_pipeline', cache_dir=self.cache_dir, skip_api=True, keep=True, baseline=baseline_path,
+                     threshold=10 ** 6, fail_on_regression=True, stdout=out)
+        self.assertIn('regressions over', out.getvalue())
+        self.assertEqual(Match.objects.filter(is_saved_to_players=True).count(), self.counts['matches'])
+        self.assertTrue(FantasyTeam.objects.filter(result__gt=0).exists())
+
+
+class FakeOpenDotaServerTest(SimpleTestCase):
+    def start_server(self, **kwargs):
+        server = FakeOpenDotaServer(**kwargs).start()
+        self.addCleanup(server.stop)
+        return server, DotaApiConnector(rate_limit=1000, cache=False, base_url=server.url)
+
+    def test_generated(self):
+        server, connector = self.start_server(league_size=7)
+        league_matches = connector.get_league_matches_id('5')
+        self.assertEqual(len(league_matches), 7)
+        match_data = connector.get_match_info(league_matches[0].match_id)
+        self.assertEqual(match_data['series_id'], league_matches[0].series_id)
+        self.assertEqual(len(match_data['players']), 10)
+        self.assertTrue(is_parse_match_data_full(match_data))
+        self.assertEqual(server.stats, {200: 2})
+
+    def test_cache_dir(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        ResponseCache(cache_dir, 10 ** 6).put(f'{settings.OPENDOTA_API_URL}matches/1', b'{"match_id": 1}')
+        server, connector = self.start_server(cache_dir=cache_dir)
+        self.assertEqual(requests.get(f'{server.url}matches/1').json(), {'match_id': 1})
+        self.assertEqual(requests.get(f'{server.url}matches/2').status_code, 404)
+
+    def test_incomplete_match_not_cached(self):
+        server_cache_dir, cache_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, server_cache_dir)
+        self.addCleanup(shutil.rmtree, cache_dir)
+        server_cache = ResponseCache(server_cache_dir, 10 ** 6)
+        server_cache.put(f'{settings.OPENDOTA_API_URL}matches/1', b'{"match_id": 1, "version": null}')
+        server, _ = self.start_server(cache_dir=server_cache_dir)
+        connector = DotaApiConnector(rate_limit=1000, cache=ResponseCache(cache_dir, 10 ** 6), base_url=server.url)
+
+        self.assertIsNone(connector.get_match_info(1)['version'])
+        server_cache.put(f'{settings.OPENDOTA_API_URL}matches/1', b'{"match_id": 1, "version": 21}')
+        self.assertEqual(connector.get_match_info(1)['version'], 21)
+        self.assertEqual(connector.get_match_info(1)['version'], 21)
+        self.assertEqual(server.stats, {200: 2})
+
+    def test_faults(self):
+        server, _ = self.start_server(error_rate=1)
+        self.assertIn(requests.get(f'{server.url}matches/1').status_code, [500, 502, 503])
+
+        server, _ = self.start_server(rate_limit=0.1)
+        self.assertEqual(requests.get(f'{server.url}matches/1').status_code, 200)
+        response = requests.get(f'{server.url}matches/1')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+
+
+class ResponseCacheTest(SimpleTestCase):
+    def test_concurrent_puts(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        response_cache = ResponseCache(cache_dir, 10 ** 6, evict_every=7)
+        url = f'{settings.OPENDOTA_API_URL}matches/1'
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: response_cache.put(url, b'{"match_id": 1}'), range(200)))
+        self.assertEqual(response_cache.get(url), b'{"match_id": 1}')
+        self.assertEqual(response_cache.puts, 200)
+        tmp_files = [name for _, _, files in os.walk(cache_dir) for name in files if name.endswith('.tmp')]
+        self.assertEqual(tmp_files, [])
+
+    def test_evict_refs(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        response_cache = ResponseCache(cache_dir, 2000, evict_every=10 ** 6)
+        for n in range(10):
+            response_cache.put(f'https://example.com/{n}', os.urandom(500))
+            os.utime(response_cache.get_fresh_blob_path(f'https://example.com/{n}'), (n, n))
+        response_cache.put('https://example.com/expired', b'{}', ttl=-1)
+
+        self.assertGreater(response_cache.evict(), 0)
+        refs = [name for _, _, files in os.walk(os.path.join(cache_dir, 'refs')) for name in files]
+        blobs = [name for _, _, files in os.walk(os.path.join(cache_dir, 'blobs')) for name in files]
+        self.assertEqual(len(refs), len(blobs) - 1)
+        self.assertIsNone(response_cache.get('https://example.com/0'))
+        self.assertIsNotNone(response_cache.get('https://example.com/9'))
+
+
+class SharedTokenBucketTest(SimpleTestCase):
+    def test_shared_between_processes(self):
+        get_redis_connection('default').delete('opendota:rate_limit:test')
+        first, second = (SharedTokenBucket('opendota:rate_limit:test', rate=1, capacity=2) for _ in range(2))
+        self.assertEqual(first.try_acquire(), 0)
+        self.assertEqual(second.try_acquire(), 0)
+        self.assertGreater(first.try_acquire(), 0.5)
+        self.assertGreater(second.try_acquire(), 0.5)
+
+
+class RetryPolicyTest(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('opendota:circuit:test', failure_threshold=2, cooldown=1)
+        self.breaker.redis.delete(self.breaker.key, self.breaker.failures_key)
+        self.addCleanup(self.breaker.redis.delete, self.breaker.key, self.breaker.failures_key)
+
+    def get_connector(self, **kwargs):
+        server = FakeOpenDotaServer(**kwargs).start()
+        self.addCleanup(server.stop)
+        return server, DotaApiConnector(rate_limit=1000, cache=False, base_url=server.url, breaker=self.breaker,
+                                        max_workers=1)
+
+    def test_delay(self):
+        policy = RetryPolicy(base_delay=10, max_delay=300)
+        self.assertTrue(5 <= policy.get_delay(0) <= 10)
+        self.assertTrue(40 <= policy.get_delay(3) <= 80)
+        self.assertTrue(150 <= policy.get_delay(10) <= 300)
+        self.assertTrue(120 <= policy.get_delay(0, retry_after=120) <= 130)
+        self.assertEqual(policy.get_delay(0, retry_after=1000), 300)
+        self.assertEqual(parse_retry_after('7'), 7)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_not_found(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        server, connector = self.get_connector(cache_dir=cache_dir)
+        self.assertEqual(connector.get_match_info(1), {})
+        self.assertEqual(server.stats, {404: 1})
+        self.assertEqual(self.breaker.get_remaining(), 0)
+
+    def test_throttled(self):
+        server, connector = self.get_connector(throttle_rate=1)
+        with self.assertRaises(ApiRetryError) as error:
+            connector.get_match_info(1)
+        self.assertEqual(error.exception.retry_after, 1)
+        self.assertGreater(self.breaker.get_remaining(), 0)
+        with self.assertRaises(ApiRetryError):
+            connector.get_match_info(2)
+        self.assertEqual(server.stats, {429: 1})
+
+    def test_errors(self):
+        server, connector = self.get_connector(error_rate=1)
+        competition = Competition.objects.create(name='Competition', dota_id='1', status=CompetitionStatusEnum.STARTED)
+        Match.objects.create(dota_id='1', competition=competition)
+        Match.objects.create(dota_id='2', competition=competition)
+        api_connector = tasks.api_connector
+        tasks.api_connector = connector
+        try:
+            failed = tasks.parse_matches_data(['1', '2', '3'])
+        finally:
+            tasks.api_connector = api_connector
+        self.assertEqual(set(failed), {'1', '2', '3'})
+        self.assertEqual(sum(server.stats.values()), 2)
+        self.assertGreater(self.breaker.get_remaining(), 0)
+        self.assertFalse(Match.objects.filter(is_parsed=True).exists())
+
+
+class LeagueStreamTest(TestCase):
+    def test_iter_json_array(self):
+        data = [{'match_id': 1, 'name': 'Лига'}, {'match_id': 2, 'values': [1, 2.5, None]}, 3, 'four']
+        content = json.dumps(data, ensure_ascii=False, indent=1).encode()
+        for size in (1, 7, len(content)):
+            chunks = [content[i:i + size] for i in range(0, len(content), size)]
+            self.assertEqual(list(iter_json_array(chunks)), data)
+        self.assertEqual(list(iter_json_array([b' [ ', b']'])), [])
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'[{"match_id": 1}, {"match_']))
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"error": "Not Found"}']))
+
+    def use_league(self, league_size, cache=True):
+        server = FakeOpenDotaServer(league_size=league_size).start()
+        self.addCleanup(server.stop)
+        response_cache = False
+        if cache:
+            cache_dir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, cache_dir)
+            response_cache = ResponseCache(cache_dir, 10 ** 6)
+        connector = DotaApiConnector(rate_limit=1000, cache=response_cache, base_url=server.url)
+        api_connector = tasks.api_connector
+        tasks.api_connector = connector
+        self.addCleanup(setattr, tasks, 'api_connector', api_connector)
+        return server, connector
+
+    def test_parse_match_ids(self):
+        server, connector = self.use_league(7)
+        competition = Competition.objects.create(name='Competition', dota_id='5', status=CompetitionStatusEnum.STARTED)
+        match_ids = tasks.competitions_parse_match_ids(['5'], batch_size=3)
+        self.assertEqual(len(match_ids), 7)
+        self.assertEqual(Match.objects.filter(competition=competition).count(), 7)
+        competition.refresh_from_db()
+        self.assertIsNotNone(competition.full_synced_at)
+        self.assertEqual(competition.sync_start_time, max(m.start_time for m in connector.get_league_matches_id('5')))
+        self.assertEqual(server.stats, {200: 1})
+        self.assertEqual(tasks.competitions_parse_match_ids(['5'], batch_size=3), [])
+
+    def test_incremental_sync(self):
+        server, connector = self.use_league(7, cache=False)
+        competition = Competition.objects.create(name='Competition', dota_id='5', status=CompetitionStatusEnum.STARTED)
+        oldest, *_, newest = [str(m.match_id) for m in sorted(connector.get_league_matches_id('5'),
+                                                              key=lambda m: m.start_time)]
+        self.assertEqual(len(tasks.competitions_parse_match_ids(['5'])), 7)
+        Match.objects.filter(dota_id__in=[oldest, newest]).delete()
+
+        self.assertEqual(tasks.competitions_parse_match_ids(['5']), [newest])
+        full_synced_at = timezone.now() - timedelta(seconds=settings.LEAGUE_FULL_SYNC_INTERVAL + 1)
+        Competition.objects.filter(pk=competition.pk).update(full_synced_at=full_synced_at)
+        self.assertEqual(tasks.competitions_parse_match_ids(['5']), [oldest])
+        competition.refresh_from_db()
+        self.assertGreater(competition.full_synced_at, full_synced_at)
+        self.assertEqual(server.stats, {200: 4})
+
+    def test_preloaded_lookups(self):
+        queries = []
+        for dota_id, league_size in (('5', 6), ('6', 30)):
+            _, connector = self.use_league(league_size)
+            league_matches = connector.get_league_matches_id(dota_id)
+            for team_id in {m.radiant_team_id for m in league_matches} | {m.dire_team_id for m in league_matches}:
+                Team.objects.get_or_create(dota_id=str(team_id), defaults={'name': f'Team {team_id}'})
+            IgnoreMatch.objects.create(dota_id=str(league_matches[0].match_id))
+            competition = Competition.objects.create(name=f'Competition {dota_id}', dota_id=dota_id,
+                                                     status=CompetitionStatusEnum.STARTED)
+            with CaptureQueriesContext(connection) as context:
+                match_ids = tasks.competitions_parse_match_ids([dota_id])
+            queries.append(len(context.captured_queries))
+
+            self.assertEqual(len(match_ids), league_size - 1)
+            self.assertNotIn(str(league_matches[0].match_id), match_ids)
+            self.assertFalse(Match.objects.filter(competition=competition, team_radiant__isnull=True).exists())
+            self.assertFalse(Match.objects.filter(competition=competition, series__isnull=True).exists())
+        self.assertEqual(queries[0], queries[1])
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        get_redis_connection('default').delete(metrics.METRICS_KEY)
+
+    def test_metrics_endpoint(self):
+        competition = Competition.objects.create(name='Competition', dota_id='1', status=CompetitionStatusEnum.STARTED)
+        Match.objects.create(dota_id='1', competition=competition)
+        Match.objects.create(dota_id='2', competition=competition, is_parsed=True)
+        server = FakeOpenDotaServer().start()
+        self.addCleanup(server.stop)
+        DotaApiConnector(rate_limit=1000, cache=False, base_url=server.url).get_match_info(1)
+        with self.assertRaises(ValueError), metrics.stage('rate_matches'):
+            raise ValueError
+
+        self.client.force_login(CustomUser.objects.create(username='staff', email='staff@example.com', is_staff=True))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('# TYPE opendota_request_duration_seconds histogram', content)
+        self.assertIn('opendota_requests_total{endpoint="matches",status="200"} 1.0', content)
+        self.assertIn('opendota_request_duration_seconds_count{endpoint="matches"} 1.0', content)
+        self.assertIn('fantasy_pipeline_stage_runs_total{outcome="error",stage="rate_matches"} 1.0', content)
+        self.assertIn('fantasy_pipeline_backlog{state="not_parsed"} 1', content)
+        self.assertIn('fantasy_pipeline_backlog{state="not_rated"} 1', content)
+        buckets = [line for line in content.splitlines()
+                   if line.startswith('fantasy_pipeline_stage_duration_seconds_bucket')]
+        self.assertEqual(len(buckets), len(settings.METRICS_HISTOGRAM_BUCKETS) + 1)
+        self.assertIn('le="+Inf"', buckets[-1])
+
+    def test_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        self.client.force_login(CustomUser.objects.create(username='user', email='user@example.com'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='token')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer token').status_code, 200)
+
+    def test_json_logs(self):
+        record = logging.LogRecord('fantasy.tasks', logging.INFO, __file__, 1, 'Оброблено зміни.', (), None)
+        record.changes = 3
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data['message'], 'Оброблено зміни.')
+        self.assertEqual(data['changes'], 3)
+        self.assertEqual(data['level'], 'INFO')
+
+
+class ProfilingTest(APITestCase):
+    def setUp(self):
+        self.profiling_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profiling_dir)
+        settings_override = override_settings(PROFILING_DIR=self.profiling_dir, PROFILING_TOKEN='token',
+                                              PROFILING_ENABLED=True, PROFILING_CONFIG_TTL=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_authenticate(CustomUser.objects.create(username='user', email='user@example.com'))
+        Competition.objects.create(name='Competition', dota_id='1', status=CompetitionStatusEnum.STARTED)
+
+    def load_summary(self, profile_id):
+        with open(os.path.join(self.profiling_dir, f'{profile_id}.json')) as f:
+            return json.load(f)
+
+    def test_header(self):
+        response = self.client.get('/api/competition/')
+        self.assertNotIn('X-Profile-Id', response)
+        cache.clear()
+        response = self.client.get('/api/competition/', HTTP_X_PROFILE='token')
+        profile_id = response['X-Profile-Id']
+        self.assertIn('sql;desc=', response['Server-Timing'])
+        self.assertTrue(os.path.exists(os.path.join(self.profiling_dir, f'{profile_id}.prof')))
+        summary = self.load_summary(profile_id)
+        self.assertEqual(summary['name'], 'GET /api/competition/')
+        self.assertGreater(summary['sql_count'], 0)
+
+        out = io.StringIO()
+        call_command('profile_report', profile_id, stdout=out)
+        self.assertIn('cProfile', out.getvalue())
+
+    def test_slow_threshold(self):
+        ProfilingConfig.objects.create(is_enabled=True, path_prefix='/api/competition/', slow_threshold_ms=0,
+                                       sampling_interval_ms=1)
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/player/'))
+        profile_id = self.client.get('/api/competition/')['X-Profile-Id']
+        self.assertTrue(os.path.exists(os.path.join(self.profiling_dir, f'{profile_id}.folded')))
+        self.assertFalse(os.path.exists(os.path.join(self.profiling_dir, f'{profile_id}.prof')))
+
+    def test_repeated_queries(self):
+        session = ProfileSession('task', 'test', profile=True)
+        session.start()
+        for player_id in range(12):
+            list(Player.objects.filter(id=player_id))
+        list(Player.objects.filter(id__in=[1, 2, 3]))
+        list(Player.objects.filter(id__in=[1, 2]))
+        summary = self.load_summary(session.stop())
+        self.assertEqual(summary['sql_count'], 14)
+        self.assertEqual(len(summary['repeated_queries']), 1)
+        self.assertEqual(summary['repeated_queries'][0]['count'], 12)
+        self.assertIn({'IN (...)': 2}, [{'IN (...)': shape['count']} for shape in summary['top_queries']
+                                        if 'IN (...)' in shape['sql']])
+
+    def test_task(self):
+        ProfilingConfig.objects.create(is_enabled=True, profile_tasks=True, task_names='3.1. Оцінка матчу.')
+        save_match_results_celery_task.apply(args=['1'])
+        self.assertEqual(get_profile_ids(), [])
+        rate_match_celery_task.apply(args=['1'])
+        profile_id, = get_profile_ids()
+        summary = self.load_summary(profile_id)
+        self.assertEqual((summary['kind'], summary['outcome']), ('task', 'SUCCESS'))
+
+
+@override_settings(ALLOWED_HOSTS=['testserver', 'a.example.com', 'b.example.com'])
+class CachedResponseTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(CustomUser.objects.create(username='user', email='user@example.com'))
+        Player.objects.bulk_create([Player(nickname=f'Player {i}', dota_id=str(i), game_role=GameRoleEnum.CARRY)
+                                    for i in range(settings.REST_FRAMEWORK['PAGE_SIZE'] + 1)])
+
+    def test_version_bump(self):
+        player = Player.objects.get(dota_id='0')
+        url = f'/api/player/{player.id}/'
+        self.assertEqual(self.client.get(url).data['nickname'], 'Player 0')
+        Player.objects.filter(pk=player.pk).update(nickname='Renamed')
+        self.assertEqual(self.client.get(url).data['nickname'], 'Player 0')
+        player.nickname = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            player.save()
+        self.assertEqual(self.client.get(url).data['nickname'], 'Renamed')
+
+    def test_host(self):
+        for host in ('a.example.com', 'b.example.com'):
+            response = self.client.get('/api/player/', HTTP_HOST=host)
+            self.assertEqual(response.data['next'], f'http://{host}/api/player/?page=2')
+
+
+@override_settings(ROOT_URLCONF='fantasy.tests')
+class AsyncReadViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.competition = Competition.objects.create(name='Competition', dota_id='1',
+                                                      status=CompetitionStatusEnum.STARTED)
+        self.tour = CompetitionTour.objects.create(competition=self.competition, name='Tour 1',
+                                                   start_date=now - timedelta(days=1), end_date=now + timedelta(days=6),
+                                                   editing_start=now - timedelta(days=2),
+                                                   editing_end=now + timedelta(hours=1))
+        self.competition.active_tour = self.tour
+        self.competition.save()
+        for n in range(1, 6):
+            user = CustomUser.objects.create(username=f'user{n}', email=f'user{n}@example.com')
+            fantasy_team = FantasyTeam.objects.create(user=user, competition=self.competition, name_extended=f'team{n}',
+                                                      result=n % 3)
+            FantasyTeamTour.objects.create(fantasy_team=fantasy_team, competition_tour=self.tour, result=n)
+        self.token = Token.objects.create(user=user)
+        AppScreenInfo.objects.create(screen='main', text='Головна')
+
+    def get_async(self, url, method='get', **headers):
+        async def request():
+            return await getattr(self.async_client, method)(url, headers=headers)
+        return async_to_sync(request)()
+
+    def test_same_as_sync(self):
+        urls = [
+            f'competition/{self.competition.id}/',
+            f'competition/{self.competition.id}/edit_status/',
+            f'competition/{self.competition.id}/leaderboard/?limit=3',
+            f'competition/{self.competition.id}/leaderboard/?cursor=3&limit=3',
+            f'competition/{self.competition.id}/rating/',
+            f'competition/{self.competition.id}/my-rating/?around=1',
+            f'competition/{self.competition.id}/my-rating/?around=-3',
+            f'competition-tour/{self.tour.id}/',
+            f'competition-tour/{self.tour.id}/leaderboard/',
+            f'competition-tour/{self.tour.id}/rating/',
+            f'competition-tour/{self.tour.id}/my-rating/',
+            'app-info/?screen=main',
+        ]
+        authorization = f'Token {self.token.key}'
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.get_async(f'/async/api/{url}', authorization=authorization)
+                self.assertEqual(response.status_code, 200)
+                sync_response = self.client.get(f'/api/{url}', HTTP_AUTHORIZATION=authorization)
+                self.assertEqual(response.json(), sync_response.json())
+
+        self.assertEqual(self.get_async('/async/api/competition/0/', authorization=authorization).status_code, 404)
+        self.assertEqual(self.get_async('/async/api/competition/0/leaderboard/',
+                                        authorization=authorization).status_code, 404)
+        self.assertEqual(self.get_async('/async/api/competition-tour/0/rating/',
+                                        authorization=authorization).status_code, 404)
+        for limit in ('x', '0', '-5'):
+            url = f'competition/{self.competition.id}/leaderboard/?limit={limit}'
+            self.assertEqual(self.get_async(f'/async/api/{url}', authorization=authorization).status_code, 400)
+            self.assertEqual(self.client.get(f'/api/{url}', HTTP_AUTHORIZATION=authorization).status_code, 400)
+
+    def test_auth(self):
+        url = f'/async/api/competition/{self.competition.id}/'
+        self.assertEqual(self.get_async(url).status_code, 401)
+        self.assertEqual(self.get_async(url, authorization='Token invalid').status_code, 401)
+        self.assertEqual(self.get_async('/async/api/app-info/').status_code, 200)
+        response = self.get_async(url, method='post', authorization=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 405)
+
+        self.assertEqual(self.get_async(url, authorization=f'Token {self.token.key}').status_code, 200)
+        self.token.user.is_active = False
+        self.token.user.save()
+        self.assertEqual(self.get_async(url, authorization=f'Token {self.token.key}').status_code, 401)
+
+    def test_cache_versions(self):
+        url = f'/async/api/competition-tour/{self.tour.id}/'
+        authorization = f'Token {self.token.key}'
+        self.assertEqual(self.get_async(url, authorization=authorization).json()['name'], 'Tour 1')
+        CompetitionTour.objects.filter(pk=self.tour.pk).update(name='Tour 2')
+        self.assertEqual(self.get_async(url, authorization=authorization).json()['name'], 'Tour 1')
+        bump_versions(CompetitionTour)
+        self.assertEqual(self.get_async(url, authorization=authorization).json()['name'], 'Tour 2')
+
+    def test_absolute_links(self):
+        AppScreenInfo.objects.bulk_create([AppScreenInfo(screen=f'screen {i}', text=str(i))
+                                           for i in range(settings.REST_FRAMEWORK['PAGE_SIZE'])])
+        for scheme in ('http', 'https'):
+            response = async_to_sync(self.async_client.get)('/async/api/app-info/', secure=scheme == 'https')
+            self.assertEqual(response.json()['next'], f'{scheme}://testserver/async/api/app-info/?page=2')
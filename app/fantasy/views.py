@@ -1,3 +1,31 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
 
-# Create your views here.
+from api.connectors import CircuitBreaker
+from core import metrics
+from fantasy.constants import CompetitionStatusEnum
+from fantasy.models import Match, PlayerResultChange
+
+BACKLOG_FILTERS = {
+    'not_parsed': {'is_parsed': False},
+    'not_rated': {'is_parsed': True, 'is_rated': False},
+    'not_saved': {'is_rated': True, 'is_saved_to_players': False},
+}
+
+
+def get_backlog_gauges():
+    matches = Match.objects.filter(competition__status=CompetitionStatusEnum.STARTED)
+    gauges = [('fantasy_pipeline_backlog', {'state': state}, matches.filter(**filters).count())
+              for state, filters in BACKLOG_FILTERS.items()]
+    gauges.append(('fantasy_pipeline_backlog', {'state': 'not_propagated'}, PlayerResultChange.objects.count()))
+    gauges.append(('opendota_circuit_open_seconds', {}, CircuitBreaker().get_remaining()))
+    return gauges
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    has_token = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not has_token and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(get_backlog_gauges()), content_type='text/plain; version=0.0.4; charset=utf-8')
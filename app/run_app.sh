@@ -1,7 +1,17 @@
 #!/bin/sh
 
 python manage.py makemigrations --noinput
+python manage.py dedupe_player_match_results
 python manage.py migrate
 python manage.py collectstatic --noinput  # need to gunicorn download static
-gunicorn --access-logfile - --workers 4 --timeout 120 --reload \
-  --bind app:8000 core.wsgi:application
+if [ "$ASYNC_READ_VIEWS" = "1" ]; then
+  # writes and the other sync endpoints stay on the sync workers on :8000, the reverse proxy sends
+  # GET requests of the routes in api/async_views.py to the async workers on :8001
+  ASYNC_READ_VIEWS=0 gunicorn --access-logfile - --workers 4 --timeout 120 --reload \
+    --bind app:8000 core.wsgi:application &
+  exec gunicorn --access-logfile - --workers "$(nproc)" --timeout 120 --reload \
+    --worker-class uvicorn.workers.UvicornWorker --bind app:8001 core.asgi:application
+else
+  gunicorn --access-logfile - --workers 4 --timeout 120 --reload \
+    --bind app:8000 core.wsgi:application
+fi